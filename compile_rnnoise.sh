@@ -18,3 +18,7 @@ mv rnnoise-master/.libs/librnnoise.so.0.4.1 rnnoise_wrapper/libs/librnnoise_defa
 rm -rf rnnoise-master
 
 echo -e "\n'librnnoise.so.0.4.1' has been successfully moved to 'rnnoise_wrapper/libs/librnnoise_default.so.0.4.1'"
+
+# Native shim for batched processing of frames (used by the wrapper if present, works with all model libraries)
+gcc -O2 -shared -fPIC -o rnnoise_wrapper/libs/rnnoise_batch.so rnnoise_wrapper/src/rnnoise_batch.c
+echo -e "'rnnoise_batch.so' has been successfully built in 'rnnoise_wrapper/libs/rnnoise_batch.so'"
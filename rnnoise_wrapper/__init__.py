@@ -9,9 +9,13 @@
 '''
 Designed to suppress noise in wav audio using the RNNoise library (https://github.com/xiph/rnnoise).
 
-Contains the RNNoise class. Read more at https://github.com/Desklop/RNNoise_Wrapper.
+Contains the RNNoise, RNNoiseStream, DenoiseCache, WavWriter, CallbackAdapter and FrameTracer classes. Read more at https://github.com/Desklop/RNNoise_Wrapper.
 
 Dependencies: pydub, numpy.
 '''
 
-from .rnnoise_wrapper import RNNoise
+from .rnnoise_wrapper import RNNoise, RNNoiseStream
+from .denoise_cache import DenoiseCache
+from .wav_writer import WavWriter
+from .callback_adapter import CallbackAdapter
+from .tracing import FrameTracer
@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Vectorized audio conversions on np.ndarray for rnnoise_wrapper without intermediate byte strings:
+    - ratecv() - sample rate conversion, bit-exact with audioop.ratecv() (used by pydub) including the format of its state
+    - g711_decode(), g711_encode() - G.711 mu-law/A-law codec with lookup tables, bit-exact with audioop.ulaw2lin()/lin2ulaw()/alaw2lin()/lin2alaw()
+    - parse_wav_header(), read_wav_samples() - reading .wav audio (8/16/24/32 bit int, 32/64 bit float, any number of channels) to 16 bit
+      mono samples with the given sample rate in one pass into one preallocated buffer
+'''
+
+import math
+import struct
+import numpy as np
+
+
+G711_ENCODINGS = ('ulaw', 'alaw')
+
+WAV_FORMAT_PCM = 0x0001
+WAV_FORMAT_IEEE_FLOAT = 0x0003
+WAV_FORMAT_EXTENSIBLE = 0xFFFE
+
+_RATECV_BLOCK_SIZE = 65536
+
+
+def ratecv(samples, in_rate, out_rate, state=None):
+    ''' Sample rate conversion of 16 bit mono audio, bit-exact with audioop.ratecv(data, 2, 1, in_rate, out_rate, state) (linear interpolation
+    without filtering). The state can be passed between calls to convert a stream in blocks, it has the same format as in audioop.
+
+    1. samples - np.ndarray with int16 samples
+    2. in_rate - sample rate of samples
+    3. out_rate - desired sample rate
+    4. state - state from the previous call (if None - the beginning of the audio)
+    5. returns a tuple of np.ndarray with int16 samples and the new state '''
+
+    # Long audio is converted in blocks with the state (the result is the same), so temporary arrays of 8 bytes per sample stay small
+    if len(samples) > _RATECV_BLOCK_SIZE:
+        converted_blocks = []
+        for start in range(0, len(samples), _RATECV_BLOCK_SIZE):
+            converted_block, state = ratecv(samples[start:start + _RATECV_BLOCK_SIZE], in_rate, out_rate, state)
+            converted_blocks.append(converted_block)
+        return np.concatenate(converted_blocks), state
+
+    rates_gcd = math.gcd(in_rate, out_rate)
+    in_rate, out_rate = in_rate // rates_gcd, out_rate // rates_gcd
+
+    if state is None:
+        d, prev_sample, cur_sample = -out_rate, 0, 0
+    else:
+        d, ((prev_sample, cur_sample),) = state
+
+    # Samples are scaled by 2**16 as in audioop, history[c], history[c+1] are the previous and the current samples after consuming c samples
+    number_of_samples = len(samples)
+    history = np.empty(number_of_samples + 2, dtype=np.int64)
+    history[0], history[1] = prev_sample, cur_sample
+    history[2:] = np.left_shift(samples.astype(np.int64), 16)
+
+    # Output m is produced after consuming c(m) = ceil((m*in_rate - d) / out_rate) samples, with the weight d(m) = d + c(m)*out_rate - m*in_rate
+    total = number_of_samples * out_rate + d
+    number_of_outputs = total // in_rate + 1 if total >= 0 else 0
+    m = np.arange(number_of_outputs, dtype=np.int64)
+    consumed = -((d - m * in_rate) // out_rate)
+    weights = d + consumed * out_rate - m * in_rate
+
+    interpolated = (history[consumed].astype(np.float64) * weights + history[consumed + 1].astype(np.float64) * (out_rate - weights)) / out_rate
+    converted_samples = np.right_shift(np.trunc(interpolated).astype(np.int64), 16).astype(np.int16)
+
+    new_state = (int(d + number_of_samples * out_rate - number_of_outputs * in_rate),
+                 ((int(history[number_of_samples]), int(history[number_of_samples + 1])),))
+    return converted_samples, new_state
+
+
+def _build_ulaw_tables():
+    ''' Decoding table (256 values) and encoding table (65536 values, indexed by int16 sample viewed as uint16) of mu-law. '''
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    t = (((codes & 0x0F) << 3) + 0x84) << ((codes & 0x70) >> 4)
+    decode_table = np.where(codes & 0x80, 0x84 - t, t - 0x84).astype(np.int16)
+
+    pcm_val = np.arange(-32768, 32768, dtype=np.int32) >> 2
+    mask = np.where(pcm_val < 0, 0x7F, 0xFF)
+    pcm_val = np.minimum(np.abs(pcm_val), 8159) + (0x84 >> 2)
+    seg = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), pcm_val)
+    uval = np.where(seg >= 8, 0x7F, (np.minimum(seg, 7) << 4) | ((pcm_val >> (np.minimum(seg, 7) + 1)) & 0x0F))
+    encode_table = np.empty(65536, dtype=np.uint8)
+    encode_table[np.arange(-32768, 32768, dtype=np.int32).astype(np.int16).view(np.uint16)] = (uval ^ mask).astype(np.uint8)
+    return decode_table, encode_table
+
+
+def _build_alaw_tables():
+    ''' Decoding table (256 values) and encoding table (65536 values, indexed by int16 sample viewed as uint16) of A-law. '''
+
+    codes = np.arange(256, dtype=np.int32) ^ 0x55
+    seg = (codes & 0x70) >> 4
+    t = ((codes & 0x0F) << 4) + np.where(seg == 0, 8, 0x108)
+    t = np.where(seg > 1, t << np.maximum(seg - 1, 0), t)
+    decode_table = np.where(codes & 0x80, t, -t).astype(np.int16)
+
+    pcm_val = np.arange(-32768, 32768, dtype=np.int32) >> 3
+    mask = np.where(pcm_val >= 0, 0xD5, 0x55)
+    pcm_val = np.where(pcm_val >= 0, pcm_val, -pcm_val - 1)
+    seg = np.searchsorted(np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF]), pcm_val)
+    shift = np.where(seg < 2, 1, np.minimum(seg, 7))
+    aval = np.where(seg >= 8, 0x7F, (np.minimum(seg, 7) << 4) | ((pcm_val >> shift) & 0x0F))
+    encode_table = np.empty(65536, dtype=np.uint8)
+    encode_table[np.arange(-32768, 32768, dtype=np.int32).astype(np.int16).view(np.uint16)] = (aval ^ mask).astype(np.uint8)
+    return decode_table, encode_table
+
+
+_G711_TABLES = {'ulaw': _build_ulaw_tables(), 'alaw': _build_alaw_tables()}
+
+
+def g711_decode(codes, encoding):
+    ''' Decoding G.711 audio to 16 bit samples with a lookup table.
+    1. codes - byte string or np.ndarray with uint8 codes
+    2. encoding - 'ulaw' or 'alaw'
+    3. returns np.ndarray with int16 samples '''
+
+    if encoding not in _G711_TABLES:
+        raise ValueError("unsupported 'encoding' '{}', supported: {}".format(encoding, ', '.join(G711_ENCODINGS)))
+    if not isinstance(codes, np.ndarray):
+        codes = np.frombuffer(codes, dtype=np.uint8)
+    return _G711_TABLES[encoding][0][codes]
+
+
+def g711_encode(samples, encoding):
+    ''' Encoding 16 bit samples to G.711 with a lookup table.
+    1. samples - np.ndarray with int16 samples
+    2. encoding - 'ulaw' or 'alaw'
+    3. returns np.ndarray with uint8 codes '''
+
+    if encoding not in _G711_TABLES:
+        raise ValueError("unsupported 'encoding' '{}', supported: {}".format(encoding, ', '.join(G711_ENCODINGS)))
+    return _G711_TABLES[encoding][1][samples.astype(np.int16, copy=False).view(np.uint16)]
+
+
+def parse_wav_header(data):
+    ''' Parsing the header of .wav audio: the 'fmt ' chunk and the position of the 'data' chunk (other chunks are skipped). The size of the
+    'data' chunk is limited to the available data (for example, for audio written to a pipe with an unknown length).
+
+    1. data - byte string (or other object with the buffer protocol) with .wav audio
+    2. returns a tuple of audio format (WAV_FORMAT_PCM or WAV_FORMAT_IEEE_FLOAT, for WAV_FORMAT_EXTENSIBLE - its subformat), number
+       of channels, sample rate, bits per sample, offset of the audio data and its size in bytes (whole frames) '''
+
+    if len(data) < 12 or bytes(data[:4]) != b'RIFF' or bytes(data[8:12]) != b'WAVE':
+        raise ValueError("'data' is not a .wav audio (no RIFF/WAVE header)")
+
+    wav_format = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = bytes(data[position:position + 4])
+        chunk_size = struct.unpack_from('<I', data, position + 4)[0]
+        position += 8
+
+        if chunk_id == b'fmt ':
+            if chunk_size < 16:
+                raise ValueError("'fmt ' chunk of .wav audio is too short ({} bytes)".format(chunk_size))
+            audio_format, channels, sample_rate, _, block_align, bits_per_sample = struct.unpack_from('<HHIIHH', data, position)
+            if audio_format == WAV_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                audio_format = struct.unpack_from('<H', data, position + 24)[0]
+            wav_format = (audio_format, channels, sample_rate, bits_per_sample, block_align)
+
+        elif chunk_id == b'data':
+            if wav_format is None:
+                raise ValueError("'data' chunk of .wav audio is before the 'fmt ' chunk")
+            audio_format, channels, sample_rate, bits_per_sample, block_align = wav_format
+            if channels < 1 or block_align != channels * ((bits_per_sample + 7) // 8):
+                raise ValueError('unsupported .wav audio: {} channels, {} bits per sample, block size {} bytes'.format(
+                    channels, bits_per_sample, block_align))
+            data_size = min(chunk_size, len(data) - position)
+            return audio_format, channels, sample_rate, bits_per_sample, position, data_size - data_size % block_align
+
+        # Chunks are aligned to 2 bytes
+        position += chunk_size + chunk_size % 2
+
+    raise ValueError("no 'data' chunk in .wav audio" if wav_format else "no 'fmt ' chunk in .wav audio")
+
+
+def _get_channel_samples(data, audio_format, bits_per_sample, channels, data_offset, number_of_samples, channel):
+    ''' View of the samples of one channel of .wav audio data (without copying) and a function that brings a block of them to 16 bit range.
+    For integer formats of 16 bits and more, the 2 most significant bytes of each sample are viewed as int16, the same as the conversion of
+    sample width by audioop.lin2lin() (used by pydub). '''
+
+    sample_width = bits_per_sample // 8
+    frame_width = sample_width * channels
+    offset = data_offset + channel * sample_width
+
+    if audio_format == WAV_FORMAT_PCM and bits_per_sample in (16, 24, 32):
+        samples = np.ndarray((number_of_samples,), dtype='<i2', buffer=data, offset=offset + sample_width - 2, strides=(frame_width,))
+        return samples, lambda block: block.astype(np.int32)
+    elif audio_format == WAV_FORMAT_PCM and bits_per_sample == 8:
+        samples = np.ndarray((number_of_samples,), dtype=np.uint8, buffer=data, offset=offset, strides=(frame_width,))
+        return samples, lambda block: (block.astype(np.int32) - 128) << 8
+    elif audio_format == WAV_FORMAT_IEEE_FLOAT and bits_per_sample in (32, 64):
+        samples = np.ndarray((number_of_samples,), dtype='<f{}'.format(sample_width), buffer=data, offset=offset, strides=(frame_width,))
+        return samples, lambda block: np.clip(np.rint(block * 32768.0), -32768, 32767).astype(np.int32)
+
+    raise ValueError('unsupported .wav audio: format 0x{:04X}, {} bits per sample (supported: 8, 16, 24, 32 bit int and 32, 64 bit float)'.format(
+        audio_format, bits_per_sample))
+
+
+def read_wav_samples(data, sample_rate=None, channel=None, frame_length=None, dtype=np.int16, block_size=65536):
+    ''' Reading .wav audio to 16 bit mono samples. The header is parsed, the samples of all formats are brought to 16 bit range, channels are
+    mixed down (or one channel is selected) and the result is resampled, all in np.ndarray without AudioSegment and intermediate byte strings.
+    Samples are converted and resampled in blocks (to keep temporary arrays small) and written straight to one preallocated buffer.
+
+    The result is bit-exact with AudioSegment.from_wav() followed by set_frame_rate(), set_sample_width(2) and set_channels(1) for 16 bit mono
+    audio and for audio which does not need resampling (the mixdown is the same as in pydub: (left + right) >> 1 for 2 channels, sum of
+    sample // channels for more channels). Audio with several channels or a sample width other than 16 bit is mixed down and brought to 16 bit
+    before resampling (pydub resamples first), so only one channel of 16 bit samples is resampled.
+
+    1. data - byte string (or other object with the buffer protocol) with .wav audio
+    2. sample_rate - the desired sample rate (if None - do not change the sample rate)
+    3. channel - index of the channel to keep (if None - all channels are mixed down)
+    4. frame_length - if not None, the buffer is padded with zeros to a multiple of frame_length samples (for example, for 10 ms frames)
+    5. dtype - type of the buffer (for example, np.int16 or np.float32, samples are in 16 bit range in both cases)
+    6. block_size - number of samples converted at a time
+    7. returns a tuple of np.ndarray (buffer) with samples, number of samples in it (without padding) and the source sample rate '''
+
+    audio_format, channels, source_sample_rate, bits_per_sample, data_offset, data_size = parse_wav_header(data)
+    if channel is not None and not 0 <= channel < channels:
+        raise ValueError("'channel' must be from 0 to {} for audio with {} channels".format(channels - 1, channels))
+    number_of_samples = data_size // (channels * ((bits_per_sample + 7) // 8))
+
+    if number_of_samples == 0:
+        return np.zeros(0, dtype=dtype), 0, source_sample_rate
+
+    selected_channels = range(channels) if channel is None else (channel,)
+    channel_samples = [_get_channel_samples(data, audio_format, bits_per_sample, channels, data_offset, number_of_samples, i)
+                       for i in selected_channels]
+
+    def get_block(start, end):
+        if len(channel_samples) == 1:
+            return channel_samples[0][1](channel_samples[0][0][start:end])
+        blocks = [to_16_bit(samples[start:end]) for samples, to_16_bit in channel_samples]
+        if len(blocks) == 2:
+            return (blocks[0] + blocks[1]) >> 1
+        return np.clip(sum(block // channels for block in blocks), -32768, 32767)
+
+    # Resampling is performed in blocks with the state of ratecv(), so the number of resampled samples is known in advance
+    is_resampled = bool(sample_rate) and sample_rate != source_sample_rate
+    number_of_input_samples = number_of_samples
+    if is_resampled:
+        rates_gcd = math.gcd(source_sample_rate, sample_rate)
+        number_of_samples = (number_of_samples - 1) * (sample_rate // rates_gcd) // (source_sample_rate // rates_gcd) + 1
+
+    buffer = np.empty(number_of_samples + (-number_of_samples % frame_length if frame_length else 0), dtype=dtype)
+    buffer[number_of_samples:] = 0
+
+    position, ratecv_state = 0, None
+    for start in range(0, number_of_input_samples, block_size):
+        block = get_block(start, start + block_size)
+        if is_resampled:
+            block, ratecv_state = ratecv(block, source_sample_rate, sample_rate, ratecv_state)
+        buffer[position:position + len(block)] = block
+        position += len(block)
+    return buffer, number_of_samples, source_sample_rate
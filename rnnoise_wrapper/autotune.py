@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Autotuning of rnnoise_wrapper for the current host. Short micro-benchmarks of the existing processing paths are run for each model on
+synthetic audio:
+    - backend - RNNoise.filter_frames() with the native batch shim ('batch') and with one ctypes call per frame ('ctypes')
+    - block_duration_ms - RNNoiseStream.process() with blocks of 10-160 ms (pipe mode of the CLI with --block_duration_ms auto and
+      RNNoise.iter_filter() with block_duration_ms=None, the default of both stays 10 ms for the latency of the first output)
+    - max_batch_size - RNNoiseStream.process_streams() with 10 ms blocks of 2-64 streams, as in a tick of DenoiseServer
+    - workers - worker processes running in parallel (batch mode of the CLI)
+    - threads - worker threads running in parallel (DenoiseServer, RealtimeScheduler)
+
+The native shim is kept as the backend unless one ctypes call per frame is faster by more than the tolerance (both run the same native code,
+so small differences are noise). Larger blocks and batches and more workers give more throughput only until the per-call overhead is amortized
+or the cores are saturated, so for them the smallest value with throughput within the tolerance of the best one is chosen: it keeps latency
+and memory low at near-best throughput. The result is saved as the host profile (see rnnoise_wrapper.host_profile), which RNNoise, the CLI,
+RealtimeScheduler and DenoiseServer load by default.
+
+Usage: python3 -m rnnoise_wrapper.autotune [-m MODEL ...] [-d DURATION] [-t TOLERANCE] [-o PROFILE] [--show]
+'''
+
+import os
+import sys
+import json
+import time
+import glob
+import queue
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+
+from .rnnoise_wrapper import RNNoise, RNNoiseStream, _load_batch_lib
+from .cpu_affinity import get_allowed_cpus
+from .host_profile import profile_version, get_host_info, load_profile, save_profile, get_profile_path
+
+
+FRAME_LENGTH = int(RNNoise.sample_rate * RNNoise.frame_duration_ms / 1000)
+SEED = 43
+
+BLOCK_DURATIONS_MS = (10, 20, 40, 80, 160)
+# A batch of 1 block would turn off grouping of streams in ticks of DenoiseServer, so it is not a candidate
+BATCH_SIZES = (2, 4, 8, 16, 32, 64)
+BATCH_SAMPLE_RATE = 16000
+
+
+def get_test_frames(number_of_frames, seed=SEED):
+    ''' Synthetic audio for benchmarks: a tone with noise, 48 kHz.
+    1. number_of_frames - number of 10 ms frames
+    2. seed - seed of the noise
+    3. returns np.ndarray with shape (number_of_frames, 480) and type float32 (samples in 16 bit range) '''
+
+    random_state = np.random.RandomState(seed)
+    t = np.arange(number_of_frames * FRAME_LENGTH) / RNNoise.sample_rate
+    samples = 3000.0 * np.sin(2 * np.pi * 440.0 * t) + 1000.0 * random_state.randn(len(t))
+    return np.clip(np.round(samples), -32768, 32767).astype(np.float32).reshape(-1, FRAME_LENGTH)
+
+
+def measure(function, duration):
+    ''' Calling function() repeatedly for at least duration seconds (after one warm-up call).
+    1. function - function without arguments that returns the amount of work done (for example, the number of frames)
+    2. duration - duration of the measurement in seconds
+    3. returns the amount of work per second '''
+
+    function()
+    amount = 0
+    start_time = time.perf_counter()
+    while True:
+        amount += function()
+        elapsed_time = time.perf_counter() - start_time
+        if elapsed_time >= duration:
+            return amount / elapsed_time
+
+
+def choose_smallest(throughputs, tolerance):
+    ''' Choosing the smallest value with throughput at least (1 - tolerance) of the best one.
+    1. throughputs - dict of values (block durations, batch sizes, numbers of workers) to throughputs
+    2. tolerance - allowed relative loss of throughput
+    3. returns the chosen value '''
+
+    best_throughput = max(throughputs.values())
+    return min(value for value, throughput in throughputs.items() if throughput >= (1.0 - tolerance) * best_throughput)
+
+
+def _set_backend(denoiser, backend):
+    denoiser.batch_lib = _load_batch_lib() if backend == 'batch' else None
+    return denoiser
+
+
+def _frames_loop(f_name_lib, backend, number_of_frames=100):
+    ''' Function for measure(): denoising number_of_frames frames with filter_frames() (the input is restored before each call). '''
+
+    denoiser = _set_backend(RNNoise(f_name_lib), backend)
+    source_frames = get_test_frames(number_of_frames)
+    frames = np.empty_like(source_frames)
+
+    def process():
+        np.copyto(frames, source_frames)
+        denoiser.filter_frames(frames)
+        return number_of_frames
+    return process
+
+
+def benchmark_backends(f_name_lib, duration):
+    ''' Frames per second of filter_frames() with each available backend.
+    1. f_name_lib - path to the library
+    2. duration - duration of each measurement in seconds
+    3. returns a dict of backends to frames per second '''
+
+    backends = ['batch', 'ctypes'] if _load_batch_lib() is not None else ['ctypes']
+    return {backend: measure(_frames_loop(f_name_lib, backend), duration) for backend in backends}
+
+
+def benchmark_block_durations(f_name_lib, backend, duration, block_durations_ms=BLOCK_DURATIONS_MS):
+    ''' Speed of RNNoiseStream.process() (relative to real time) with blocks of different duration, 16 bit mono 48 kHz.
+    1. f_name_lib - path to the library
+    2. backend - 'batch' or 'ctypes'
+    3. duration - duration of each measurement in seconds
+    4. block_durations_ms - block durations in milliseconds (multiples of 10)
+    5. returns a dict of block durations to the speed '''
+
+    audio_bytes = get_test_frames(max(block_durations_ms) // RNNoise.frame_duration_ms * 4).astype(np.int16).tobytes()
+    audio_duration = len(audio_bytes) / RNNoise.sample_width / RNNoise.sample_rate
+
+    speeds = {}
+    for block_duration_ms in block_durations_ms:
+        stream = RNNoiseStream(RNNoise.sample_rate, 1, 's16le', f_name_lib)
+        _set_backend(stream.denoisers[0], backend)
+        block_size = FRAME_LENGTH * (block_duration_ms // RNNoise.frame_duration_ms) * RNNoise.sample_width
+        blocks = [audio_bytes[i:i+block_size] for i in range(0, len(audio_bytes), block_size)]
+
+        def process():
+            for block in blocks:
+                stream.process(block)
+            return audio_duration
+        speeds[block_duration_ms] = measure(process, duration)
+    return speeds
+
+
+def benchmark_batch_sizes(f_name_lib, backend, duration, batch_sizes=BATCH_SIZES, sample_rate=BATCH_SAMPLE_RATE, number_of_ticks=10):
+    ''' Blocks per second of ticks of DenoiseServer: RNNoiseStream.process_streams() with one 10 ms block (16 bit mono) of each of batch_size
+    streams per call, including decoding, resampling and encoding of the blocks.
+    1. f_name_lib - path to the library
+    2. backend - 'batch' or 'ctypes'
+    3. duration - duration of each measurement in seconds
+    4. batch_sizes - numbers of streams in a tick
+    5. sample_rate - sample rate of the streams
+    6. number_of_ticks - number of ticks in one call of the measured function
+    7. returns a dict of batch sizes to blocks per second '''
+
+    samples = get_test_frames(number_of_ticks).astype(np.int16).reshape(-1)[::RNNoise.sample_rate // sample_rate]
+    block_size = len(samples) // number_of_ticks
+    ticks = [[samples[i*block_size:(i+1)*block_size].tobytes()] for i in range(number_of_ticks)]
+
+    throughputs = {}
+    for batch_size in batch_sizes:
+        streams = [RNNoiseStream(sample_rate, 1, 's16le', f_name_lib) for i in range(batch_size)]
+        for stream in streams:
+            _set_backend(stream.denoisers[0], backend)
+
+        def process():
+            for blocks in ticks:
+                RNNoiseStream.process_streams(streams, blocks * batch_size)
+            return number_of_ticks * batch_size
+        throughputs[batch_size] = measure(process, duration)
+    return throughputs
+
+
+def _parallel_worker(f_name_lib, backend, duration, barrier, results):
+    ''' Worker of benchmark_workers(): waits for the other workers and measures its own frames per second. '''
+
+    process = _frames_loop(f_name_lib, backend)
+    process()
+    barrier.wait()
+    results.put(measure(process, duration))
+
+
+def benchmark_workers(f_name_lib, backend, duration, numbers_of_workers, use_processes=True):
+    ''' Total frames per second of several workers denoising in parallel (each worker has its own RNNoise object).
+    1. f_name_lib - path to the library
+    2. backend - 'batch' or 'ctypes'
+    3. duration - duration of each measurement in seconds
+    4. numbers_of_workers - numbers of workers to measure
+    5. use_processes - True: workers are processes (batch mode of the CLI), False: threads (DenoiseServer, RealtimeScheduler)
+    6. returns a dict of numbers of workers to total frames per second '''
+
+    throughputs = {}
+    for number_of_workers in numbers_of_workers:
+        if use_processes:
+            barrier, results = multiprocessing.Barrier(number_of_workers), multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=_parallel_worker, args=(f_name_lib, backend, duration, barrier, results))
+                       for i in range(number_of_workers)]
+        else:
+            barrier, results = threading.Barrier(number_of_workers), queue.Queue()
+            workers = [threading.Thread(target=_parallel_worker, args=(f_name_lib, backend, duration, barrier, results))
+                       for i in range(number_of_workers)]
+
+        for worker in workers:
+            worker.start()
+        throughputs[number_of_workers] = sum(results.get() for worker in workers)
+        for worker in workers:
+            worker.join()
+    return throughputs
+
+
+def get_numbers_of_workers(number_of_cpus):
+    ''' Numbers of workers to measure: powers of 2 up to the number of cores and the number of cores. '''
+
+    numbers_of_workers = set([number_of_cpus])
+    number_of_workers = 1
+    while number_of_workers < number_of_cpus:
+        numbers_of_workers.add(number_of_workers)
+        number_of_workers *= 2
+    return sorted(numbers_of_workers)
+
+
+def tune_model(f_name_lib, duration=0.5, tolerance=0.05):
+    ''' Running all benchmarks for one model.
+    1. f_name_lib - path to the library
+    2. duration - duration of each measurement in seconds
+    3. tolerance - allowed relative loss of throughput when choosing smaller blocks, batches and numbers of workers
+    4. returns a dict with the settings and measurements of the model '''
+
+    numbers_of_workers = get_numbers_of_workers(len(get_allowed_cpus()))
+
+    backend_throughputs = benchmark_backends(f_name_lib, duration)
+    backend = 'batch' if 'batch' in backend_throughputs else 'ctypes'
+    if backend_throughputs['ctypes'] > (1.0 + tolerance) * backend_throughputs[backend]:
+        backend = 'ctypes'
+    block_speeds = benchmark_block_durations(f_name_lib, backend, duration)
+    batch_throughputs = benchmark_batch_sizes(f_name_lib, backend, duration)
+    process_throughputs = benchmark_workers(f_name_lib, backend, duration, numbers_of_workers, use_processes=True)
+    thread_throughputs = benchmark_workers(f_name_lib, backend, duration, numbers_of_workers, use_processes=False)
+
+    # Keys of measurements are strings, as after loading from JSON
+    to_json = lambda throughputs: {str(value): round(throughput, 2) for value, throughput in throughputs.items()}
+    return {'backend': backend,
+            'block_duration_ms': choose_smallest(block_speeds, tolerance),
+            'max_batch_size': choose_smallest(batch_throughputs, tolerance),
+            'workers': choose_smallest(process_throughputs, tolerance),
+            'threads': choose_smallest(thread_throughputs, tolerance),
+            'frames_per_second': round(backend_throughputs[backend], 2),
+            'measurements': {'backend_frames_per_second': to_json(backend_throughputs),
+                             'block_duration_ms_speed_rt': to_json(block_speeds),
+                             'max_batch_size_blocks_per_second': to_json(batch_throughputs),
+                             'workers_frames_per_second': to_json(process_throughputs),
+                             'threads_frames_per_second': to_json(thread_throughputs)}}
+
+
+def autotune(f_names_libs=None, duration=0.5, tolerance=0.05, f_name_profile=None):
+    ''' Tuning models on the current host. Models tuned earlier on this host and not passed now are kept in the profile.
+    1. f_names_libs - paths to the libraries (if None - all libraries from rnnoise_wrapper/libs)
+    2. duration - duration of each measurement in seconds
+    3. tolerance - allowed relative loss of throughput when choosing smaller blocks, batches and numbers of workers
+    4. f_name_profile - name of the profile file to update (if None - get_profile_path())
+    5. returns a dict with the profile (not saved, see host_profile.save_profile()) '''
+
+    if f_names_libs is None:
+        f_names_libs = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libs', 'librnnoise*')))
+
+    old_profile = load_profile(f_name_profile) or {}
+    profile = {'version': profile_version, 'host': get_host_info(), 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'duration_s': duration, 'tolerance': tolerance, 'default_model': os.path.basename(RNNoise().f_name_lib),
+               'models': dict(old_profile.get('models', {}))}
+
+    for f_name_lib in f_names_libs:
+        f_name_lib = RNNoise(f_name_lib).f_name_lib
+        model_name = os.path.basename(f_name_lib)
+        print("[i] Tuning model '{}'...".format(model_name))
+        settings = tune_model(f_name_lib, duration, tolerance)
+        profile['models'][model_name] = settings
+        print('[i]     backend {} ({:.0f} frames/s), block {} ms, batch of {} stream(-s), {} worker process(-es), {} worker thread(-s)'.format(
+            settings['backend'], settings['frames_per_second'], settings['block_duration_ms'], settings['max_batch_size'], settings['workers'],
+            settings['threads']))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Autotuning of RNNoise_Wrapper for the current host: benchmarks choose the backend, block duration, ' + \
+                                                 'batch size and numbers of workers for each model and save them as the host profile.')
+    parser.add_argument('-m', '--models', type=str, nargs='+', default=None,
+                        help='Names/paths of RNNoise libraries (default is all libraries from rnnoise_wrapper/libs)')
+    parser.add_argument('-d', '--duration', type=float, default=0.5,
+                        help='Duration of each measurement in seconds (default is 0.5)')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.05,
+                        help='Allowed relative loss of throughput when choosing smaller blocks, batches and numbers of workers (default is 0.05)')
+    parser.add_argument('-o', '--profile', type=str, default=None,
+                        help='Name of the profile file (default is $RNNOISE_WRAPPER_PROFILE or ~/.cache/rnnoise_wrapper/profile.json)')
+    parser.add_argument('--show', action='store_true',
+                        help='Print the current profile and exit')
+    args = parser.parse_args()
+
+    if args.show:
+        profile = load_profile(args.profile)
+        if profile is None:
+            print("[W] No valid profile for this host in '{}'".format(args.profile or get_profile_path()))
+            sys.exit(1)
+        print(json.dumps(profile, indent=4, sort_keys=True))
+        return
+
+    start_time = time.time()
+    profile = autotune(args.models, args.duration, args.tolerance, args.profile)
+    f_name_profile = save_profile(profile, args.profile)
+    print("[i] Profile saved to '{}' ({:.1f} s)".format(f_name_profile, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
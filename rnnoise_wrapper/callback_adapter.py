@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Adapter of rnnoise_wrapper.RNNoise() for callbacks of audio I/O frameworks (PortAudio/sounddevice, JACK, CoreAudio, etc.), which call back
+with arbitrary block sizes (128, 256, 441 samples, ...) at 44.1 or 48 kHz, while RNNoise needs frames of exactly 480 samples at 48 kHz.
+
+Input blocks are written into a ring buffer, each complete 10 ms frame is denoised (with resampling to 48 kHz and back, if needed) and written
+into an output ring buffer, which is prefilled with silence. Each callback returns a block of the same size from the output ring buffer, so
+the adapter adds a fixed latency, reported in latency_samples and latency_ms. All buffers are allocated in the constructor, the work per
+callback is bounded by the number of frames that fit into one block.
+
+Can be tested without audio hardware with the simulated callback driver in main().
+
+Contains the CallbackAdapter class.
+'''
+
+import math
+import time
+import wave
+import argparse
+import numpy as np
+
+from .rnnoise_wrapper import RNNoise
+from .audio_utils import ratecv
+from .wav_writer import WavWriter
+
+
+class _RingBuffer(object):
+    ''' Ring buffer of float32 samples with shape (capacity, channels), reads and writes copy into/from preallocated arrays. '''
+
+    def __init__(self, capacity, channels):
+        self.data = np.zeros((capacity, channels), dtype=np.float32)
+        self.capacity = capacity
+        self.read_position = 0
+        self.size = 0
+
+
+    def write(self, samples):
+        number_of_samples = len(samples)
+        if self.size + number_of_samples > self.capacity:
+            raise BufferError('ring buffer overflow: {} + {} samples, capacity {}'.format(self.size, number_of_samples, self.capacity))
+
+        write_position = (self.read_position + self.size) % self.capacity
+        first_length = min(number_of_samples, self.capacity - write_position)
+        self.data[write_position:write_position+first_length] = samples[:first_length]
+        self.data[:number_of_samples-first_length] = samples[first_length:]
+        self.size += number_of_samples
+
+
+    def read(self, samples):
+        number_of_samples = len(samples)
+        first_length = min(number_of_samples, self.capacity - self.read_position)
+        samples[:first_length] = self.data[self.read_position:self.read_position+first_length]
+        samples[first_length:] = self.data[:number_of_samples-first_length]
+        self.read_position = (self.read_position + number_of_samples) % self.capacity
+        self.size -= number_of_samples
+
+
+    def clear(self):
+        self.read_position = 0
+        self.size = 0
+
+
+class _LinearResampler(object):
+    ''' Resampling of blocks with a fixed number of samples by linear interpolation (as in audioop.ratecv()). Output sample k of a block
+    corresponds to the input position k*in_length/out_length - 1, i.e. the delay is one input sample. '''
+
+    def __init__(self, in_length, out_length, channels):
+        positions = np.arange(out_length) * in_length / out_length
+        self.indices = np.floor(positions).astype(np.intp)
+        self.next_indices = self.indices + 1
+        self.weights = (positions - self.indices).astype(np.float32)[:, np.newaxis]
+
+        # history[0] is the last sample of the previous block
+        self.history = np.zeros((in_length + 1, channels), dtype=np.float32)
+        self.left = np.zeros((out_length, channels), dtype=np.float32)
+        self.right = np.zeros((out_length, channels), dtype=np.float32)
+
+
+    def process(self, samples, resampled_samples):
+        self.history[1:] = samples
+        np.take(self.history, self.indices, axis=0, out=self.left)
+        np.take(self.history, self.next_indices, axis=0, out=self.right)
+        np.subtract(self.right, self.left, out=self.right)
+        np.multiply(self.right, self.weights, out=self.right)
+        np.add(self.left, self.right, out=resampled_samples)
+        self.history[0] = samples[-1]
+
+
+    def reset(self):
+        self.history.fill(0.0)
+
+
+class CallbackAdapter(object):
+    """Denoising in a duplex audio callback with blocks of any size and a fixed latency (see the module description):
+    - process(): denoise one input block, returns an output block of the same size
+    - reset(): reset the state (for example, after the audio stream has been restarted)
+
+    The latency is the buffering latency (up to one frame, depends on block sizes), plus the delay of RNNoise (one frame, 10 ms), plus
+    the delay of the resampling (about 2 samples, only if sample_rate is not 48 kHz). It is available in latency_samples and latency_ms.
+    The probability of having a voice in the last denoised frame of each channel is available in vad_probabilities.
+
+    1. sample_rate - sample rate of the audio device (a multiple of 100 Hz, for example 44100 or 48000)
+    2. channels - number of channels (each channel is denoised with its own RNNoise object)
+    3. max_block_size - maximum number of samples (per channel) in one block
+    4. block_size - if the device always calls back with the same block size, pass it to reduce the buffering latency (for example, the buffering
+       latency is 0 for blocks of 480 samples at 48 kHz). If None - blocks can have any size up to max_block_size
+    5. f_name_lib - path to the library (see RNNoise)
+    """
+
+    def __init__(self, sample_rate=48000, channels=1, max_block_size=4096, block_size=None, f_name_lib=None):
+        if sample_rate % 100 != 0:
+            raise ValueError("'sample_rate' must be a multiple of 100 Hz (one frame must contain an integer number of samples)")
+        if block_size is not None and not 0 < block_size <= max_block_size:
+            raise ValueError("'block_size' must be in range [1, max_block_size]")
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_block_size = max_block_size
+        self.block_size = block_size
+
+        self.frame_length = sample_rate * RNNoise.frame_duration_ms // 1000
+        self.rnnoise_frame_length = RNNoise.sample_rate * RNNoise.frame_duration_ms // 1000
+        self.denoisers = [RNNoise(f_name_lib) for i in range(channels)]
+        self.vad_probabilities = [0.0] * channels
+
+        # Output must be available for each block right after it has been received: the worst case is a block that completes
+        # the frame except for its last sample, so the output ring buffer is prefilled with silence for up to one frame
+        if block_size is None:
+            self.buffering_latency = self.frame_length - 1
+        else:
+            self.buffering_latency = self.frame_length - math.gcd(block_size, self.frame_length)
+
+        self.input_ring = _RingBuffer(self.frame_length + max_block_size, channels)
+        self.output_ring = _RingBuffer(self.buffering_latency + self.frame_length + max_block_size, channels)
+
+        self.input_block = np.zeros((max_block_size, channels), dtype=np.float32)
+        self.output_block = np.zeros((max_block_size, channels), dtype=np.float32)
+        self.output_blocks = {}
+        self.device_frame = np.zeros((self.frame_length, channels), dtype=np.float32)
+        self.frames = np.zeros((channels, self.rnnoise_frame_length), dtype=np.float32)
+
+        latency_samples = self.buffering_latency + self.frame_length
+        if sample_rate != RNNoise.sample_rate:
+            self.upsampler = _LinearResampler(self.frame_length, self.rnnoise_frame_length, channels)
+            self.downsampler = _LinearResampler(self.rnnoise_frame_length, self.frame_length, channels)
+            self.resampled_frame = np.zeros((self.rnnoise_frame_length, channels), dtype=np.float32)
+            latency_samples += 1 + self.frame_length / self.rnnoise_frame_length
+        else:
+            self.upsampler = self.downsampler = None
+            self.resampled_frame = self.device_frame
+
+        self.latency_samples = latency_samples
+        self.latency_ms = latency_samples / sample_rate * 1000
+        self.reset()
+
+
+    def reset(self):
+        for denoiser in self.denoisers:
+            denoiser.reset()
+        if self.upsampler is not None:
+            self.upsampler.reset()
+            self.downsampler.reset()
+        self.vad_probabilities = [0.0] * self.channels
+
+        self.input_ring.clear()
+        self.output_ring.clear()
+        self.output_ring.write(np.zeros((self.buffering_latency, self.channels), dtype=np.float32))
+
+
+    def process(self, block, out=None):
+        ''' Denoising one block of a callback.
+        1. block - np.ndarray with float32 samples in range [-1, 1] or int16 samples, shape (block_size,) for mono or (block_size, channels)
+        2. out - np.ndarray with the same shape and type as block for the denoised block (for example, the output buffer of the callback).
+           If None - a preallocated array is returned, which is valid until the next call
+        3. returns np.ndarray with the denoised block of the same shape and type as block '''
+
+        block_size = len(block)
+        if block_size > self.max_block_size:
+            raise ValueError('block of {} samples is larger than max_block_size = {}'.format(block_size, self.max_block_size))
+        if self.block_size is not None and block_size != self.block_size:
+            raise ValueError('block of {} samples, but the adapter was created for blocks of {} samples'.format(block_size, self.block_size))
+
+        input_block = self.input_block[:block_size]
+        if block.dtype.kind == 'f':
+            np.multiply(block.reshape(block_size, self.channels), 32768.0, out=input_block)
+        else:
+            input_block[:] = block.reshape(block_size, self.channels)
+        self.input_ring.write(input_block)
+
+        while self.input_ring.size >= self.frame_length:
+            self.__process_frame()
+
+        output_block = self.output_block[:block_size]
+        self.output_ring.read(output_block)
+
+        if out is None:
+            out = self.__get_output_buffer(block.dtype, block_size).reshape(block.shape)
+        if block.dtype.kind == 'f':
+            np.multiply(output_block, 1 / 32768.0, out=out.reshape(block_size, self.channels), casting='unsafe')
+        else:
+            np.clip(output_block, -32768, 32767, out=output_block)
+            np.copyto(out.reshape(block_size, self.channels), output_block, casting='unsafe')
+        return out
+
+
+    def __process_frame(self):
+        ''' Denoising one frame from the input ring buffer and writing it into the output ring buffer. '''
+
+        self.input_ring.read(self.device_frame)
+        if self.upsampler is not None:
+            self.upsampler.process(self.device_frame, self.resampled_frame)
+
+        self.frames.T[:] = self.resampled_frame
+        self.vad_probabilities = RNNoise.filter_frames_of_streams(self.denoisers, self.frames).tolist()
+        self.resampled_frame[:] = self.frames.T
+
+        if self.downsampler is not None:
+            self.downsampler.process(self.resampled_frame, self.device_frame)
+        self.output_ring.write(self.device_frame)
+
+
+    def __get_output_buffer(self, dtype, block_size):
+        ''' Preallocated output array for the type of samples (allocated once for each type). '''
+
+        output_buffer = self.output_blocks.get(dtype)
+        if output_buffer is None:
+            output_buffer = self.output_blocks[dtype] = np.zeros((self.max_block_size, self.channels), dtype=dtype)
+        return output_buffer[:block_size]
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated callback driver for CallbackAdapter of RNNoise_Wrapper (no audio hardware is needed).')
+    parser.add_argument('-i', '--source_audio', type=str, required=True,
+                        help='Name of 16 bit .wav audio, which is passed to the adapter in blocks')
+    parser.add_argument('-o', '--denoised_audio', type=str, default=None,
+                        help='Name of .wav audio for the output of the adapter (default is not saved)')
+    parser.add_argument('-r', '--sample_rate', type=int, default=48000,
+                        help='Sample rate of the simulated audio device, the audio is resampled to it (default is 48000)')
+    parser.add_argument('-b', '--block_sizes', type=int, nargs='+', default=[256],
+                        help='Block sizes of callbacks, used cyclically (default is 256)')
+    parser.add_argument('-m', '--model', type=str, default=None,
+                        help='Name/path of RNNoise library (default is librnnoise_5h_b_500k)')
+    args = parser.parse_args()
+
+    with wave.open(args.source_audio, 'rb') as f_source:
+        if f_source.getsampwidth() != 2:
+            raise ValueError("only 16 bit .wav audio is supported, '{}' has {} bit".format(args.source_audio, f_source.getsampwidth()*8))
+        channels = f_source.getnchannels()
+        samples = np.frombuffer(f_source.readframes(f_source.getnframes()), dtype=np.int16).reshape(-1, channels)
+        if f_source.getframerate() != args.sample_rate:
+            samples = np.stack([ratecv(np.ascontiguousarray(samples[:, i]), f_source.getframerate(), args.sample_rate)[0]
+                                for i in range(channels)], axis=1)
+    samples = samples.astype(np.float32) / 32768.0
+
+    block_size = args.block_sizes[0] if len(set(args.block_sizes)) == 1 else None
+    adapter = CallbackAdapter(args.sample_rate, channels, max(args.block_sizes), block_size, args.model)
+    print('[i] Simulated device: {} Hz, {} channel(-s), blocks of {} samples, latency: {:.2f} samples ({:.3f} ms)'.format(
+        args.sample_rate, channels, ', '.join(str(size) for size in args.block_sizes), adapter.latency_samples, adapter.latency_ms))
+
+    denoised_samples = np.zeros_like(samples)
+    callback_times = []
+    number_of_late_callbacks = 0
+    position = 0
+    i = 0
+    while position < len(samples):
+        block_size = min(args.block_sizes[i % len(args.block_sizes)], len(samples) - position)
+        i += 1
+        if adapter.block_size is not None and block_size != adapter.block_size:
+            break
+
+        start_time = time.perf_counter()
+        adapter.process(samples[position:position+block_size], out=denoised_samples[position:position+block_size])
+        callback_time = time.perf_counter() - start_time
+
+        callback_times.append(callback_time * 1000)
+        if callback_time > block_size / args.sample_rate:
+            number_of_late_callbacks += 1
+        position += block_size
+
+    callback_times = np.array(callback_times)
+    print('[i] Callbacks: {}, time per callback: mean {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms, slower than real time: {}'.format(
+        len(callback_times), np.mean(callback_times), np.percentile(callback_times, 99), np.max(callback_times), number_of_late_callbacks))
+
+    if args.denoised_audio:
+        with WavWriter(args.denoised_audio, args.sample_rate, channels) as wav_writer:
+            wav_writer.write(np.clip(np.round(denoised_samples[:position] * 32768.0), -32768, 32767).astype(np.int16))
+        print("[i] Saved '{}'".format(args.denoised_audio))
+
+
+if __name__ == '__main__':
+    main()
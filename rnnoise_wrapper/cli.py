@@ -12,47 +12,396 @@ Simple CLI for rnnoise_wrapper.RNNoise().
 
 import os
 import sys
+import glob
+import json
 import time
+import wave
 import argparse
-from rnnoise_wrapper import RNNoise
+import multiprocessing
+import numpy as np
+from rnnoise_wrapper import RNNoise, RNNoiseStream, FrameTracer
+from rnnoise_wrapper.audio_utils import G711_ENCODINGS, g711_decode
+from rnnoise_wrapper.wav_writer import WavWriter
+from rnnoise_wrapper.cpu_affinity import get_cpu_layout, pin_current_worker, limit_library_threads, get_current_cpus, format_cpu_list
+from rnnoise_wrapper.host_profile import get_model_settings
+
+
+def denoise_stream(args):
+    ''' Denoising in pipe mode: raw PCM is read from stdin (or .wav file) in blocks of --block_duration_ms (one frame by default, so the first
+    output is available after one frame), denoised with carried state and written to stdout (or .wav file) with a flush after each block.
+    Memory usage does not depend on the audio length. All messages are written to stderr so as not to mix them with audio data. '''
+
+    if args.source_audio == '-':
+        f_source = sys.stdin.buffer
+        sample_rate, channels, sample_format = args.sample_rate, args.channels, args.format
+    else:
+        f_source = wave.open(args.source_audio, 'rb')
+        if f_source.getsampwidth() != RNNoise.sample_width:
+            raise ValueError("only 16 bit .wav audio is supported in pipe mode, '{}' has {} bit".format(args.source_audio,
+                                                                                                     f_source.getsampwidth()*8))
+        sample_rate, channels, sample_format = f_source.getframerate(), f_source.getnchannels(), 's16le'
+
+    tracer = FrameTracer() if args.trace else None
+    stream = RNNoiseStream(sample_rate, channels, sample_format, tracer=tracer, stream_name=args.source_audio)
+
+    if args.denoised_audio == '-':
+        f_denoised = sys.stdout.buffer
+        write = f_denoised.write
+    else:
+        f_denoised = WavWriter(args.denoised_audio, sample_rate, channels, RNNoise.sample_width)
+        write = f_denoised.write
+
+    block_duration_ms = args.block_duration_ms or stream.denoisers[0].block_duration_ms
+    if block_duration_ms <= 0 or block_duration_ms % RNNoise.frame_duration_ms != 0:
+        raise ValueError("'block_duration_ms' must be a positive multiple of {}".format(RNNoise.frame_duration_ms))
+    block_length = sample_rate * block_duration_ms // 1000
+    block_size = block_length * channels * stream.sample_dtype.itemsize
+    # Raw f32le and G.711 audio is saved to .wav file as 16 bit
+    to_s16le = None
+    if args.denoised_audio != '-' and sample_format == 'f32le':
+        to_s16le = lambda data: np.clip(np.round(np.frombuffer(data, dtype='<f4') * 32768.0), -32768, 32767).astype('<i2')
+    elif args.denoised_audio != '-' and sample_format in G711_ENCODINGS:
+        to_s16le = lambda data: g711_decode(data, sample_format).astype('<i2', copy=False)
+
+    print('[i] Pipe mode: {} Hz, {} channel(-s), {}, blocks of {} ms'.format(sample_rate, channels, sample_format, block_duration_ms),
+          file=sys.stderr)
+    start_time = time.time()
+    number_of_samples = 0
+    try:
+        while True:
+            if args.source_audio == '-':
+                block = f_source.read(block_size)
+            else:
+                block = f_source.readframes(block_length)
+            if not block:
+                break
+            number_of_samples += len(block) // (channels * stream.sample_dtype.itemsize)
+
+            denoised_block = stream.process(block)
+            if denoised_block:
+                write(to_s16le(denoised_block) if to_s16le else denoised_block)
+                if args.denoised_audio == '-':
+                    f_denoised.flush()
+
+        denoised_block = stream.flush()
+        if denoised_block:
+            write(to_s16le(denoised_block) if to_s16le else denoised_block)
+        if args.denoised_audio == '-':
+            f_denoised.flush()
+    except BrokenPipeError:
+        # The reading side of the pipe has been closed, nothing else to do. Stdout is redirected to /dev/null, so that flushing it at exit
+        # does not raise BrokenPipeError again (see "Note on SIGPIPE" in the documentation of the signal module), stderr is kept open
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    finally:
+        # The trace is saved first, so that it is kept even if closing the outputs fails
+        if tracer is not None:
+            export_trace(tracer, args.trace)
+        if args.denoised_audio != '-':
+            f_denoised.close()
+        if args.source_audio != '-':
+            f_source.close()
+    elapsed_time = time.time() - start_time
+
+    print('[i] Audio length: {:.2f} s, processing time: {:.2f} s, processing speed: {:.1f} RT'.format(
+        number_of_samples/sample_rate, elapsed_time, number_of_samples/sample_rate/max(elapsed_time, 1e-9)), file=sys.stderr)
+
+
+def block_duration(value):
+    ''' Type of the --block_duration_ms argument: a number of milliseconds or 'auto' (None, the block duration is taken from the host profile). '''
+
+    return None if value == 'auto' else int(value)
+
+
+def export_trace(tracer, f_name_trace):
+    ''' Saving events recorded by the tracer in Chrome trace-event format (messages are written to stderr, as in pipe mode). The trace is saved
+    even if stderr has been closed (for example, by the reader of a pipe with 2>&1). '''
+
+    tracer.close()
+    number_of_events = tracer.export_chrome_trace(f_name_trace)
+    try:
+        print("[i] Trace with {} events saved to '{}' (open it in chrome://tracing or https://ui.perfetto.dev)".format(number_of_events,
+              f_name_trace), file=sys.stderr)
+    except (OSError, ValueError):
+        pass
+
+
+_denoiser = None
+_worker_name = None
+
+
+def _init_batch_worker(cpu_layout=None, worker_counter=None):
+    ''' Initialization of a batch worker process: pinning to its cores (if cpu_layout is passed), limiting thread pools of numerical libraries
+    and creating one long-lived RNNoise object per process. The object is created after pinning, so its native state is allocated in the memory
+    of the NUMA node of the worker.
+
+    1. cpu_layout - list of tuples of cores for each worker from get_cpu_layout() (if None - the worker is not pinned)
+    2. worker_counter - multiprocessing.Value with the number of started workers (workers restarted by the pool continue the layout) '''
+
+    global _denoiser, _worker_name
+    _worker_name = 'process {}'.format(os.getpid())
+    if cpu_layout is not None:
+        with worker_counter.get_lock():
+            worker_index = worker_counter.value
+            worker_counter.value += 1
+        if pin_current_worker(cpu_layout[worker_index % len(cpu_layout)]):
+            _worker_name = 'cores {}'.format(get_current_cpus())
+    limit_library_threads(1)
+    _denoiser = RNNoise()
+
+
+def _denoise_file(task):
+    ''' Batch task: denoising one .wav audio. The result is written to a temporary file and renamed, so an interrupted run never leaves
+    an incomplete output that looks up to date.
+
+    1. task - tuple of source and denoised audio names and energy floor of silence in dBFS (or None)
+    2. returns a tuple of source and denoised audio names, audio length in seconds, processing time in seconds, error message (or None)
+       and name of the worker (its cores, if it is pinned) '''
+
+    f_name_audio, f_name_denoised_audio, silence_floor_db = task
+    start_time = time.time()
+    try:
+        _denoiser.reset()
+        denoised_audio = _denoiser.filter_wav(f_name_audio, silence_floor_db=silence_floor_db)
+
+        folder_name = os.path.dirname(f_name_denoised_audio)
+        if folder_name and not os.path.exists(folder_name):
+            os.makedirs(folder_name, exist_ok=True)
+        f_name_tmp = '{}.{}.tmp.wav'.format(f_name_denoised_audio[:-len('.wav')], os.getpid())
+        _denoiser.write_wav(f_name_tmp, denoised_audio)
+        os.replace(f_name_tmp, f_name_denoised_audio)
+        return f_name_audio, f_name_denoised_audio, len(denoised_audio)/1000, time.time() - start_time, None, _worker_name
+    except Exception as e:
+        return f_name_audio, f_name_denoised_audio, 0.0, time.time() - start_time, '{}: {}'.format(type(e).__name__, e), _worker_name
+
+
+def _is_batch_audio(f_name, excluded_folder_name=None):
+    ''' Checking that a file found in a folder or by a glob pattern is source audio for batch mode: a .wav file, which is not a temporary file
+    of an interrupted run (see _denoise_file()) and is not in the output folder. '''
+
+    if not f_name.lower().endswith('.wav') or f_name.lower().endswith('.tmp.wav'):
+        return False
+    if excluded_folder_name:
+        return os.path.commonpath([os.path.realpath(f_name), excluded_folder_name]) != excluded_folder_name
+    return True
+
+
+def find_batch_audio(source, f_name_file_list=None, excluded_folder_name=None):
+    ''' Search .wav audio for batch mode.
+
+    1. source - folder (searched recursively), glob pattern or None
+    2. f_name_file_list - text file with audio names, one per line (or None)
+    3. excluded_folder_name - folder which is not searched (the output folder, so that outputs are not denoised again when it is inside
+       the source folder)
+    4. returns a list of tuples of the audio name and its path relative to the source root '''
+
+    excluded_folder_name = os.path.realpath(excluded_folder_name) if excluded_folder_name else None
+    f_names_audio = []
+    if f_name_file_list:
+        with open(f_name_file_list, 'r') as f_file_list:
+            f_names = [line.strip() for line in f_file_list if line.strip()]
+        root_folder_name = os.path.commonpath([os.path.dirname(os.path.abspath(f_name)) for f_name in f_names]) if f_names else ''
+        f_names_audio += [(f_name, os.path.relpath(os.path.abspath(f_name), root_folder_name)) for f_name in f_names]
+
+    if source and os.path.isdir(source):
+        for path, folder_names, f_names in os.walk(source):
+            folder_names[:] = [folder_name for folder_name in folder_names
+                               if os.path.realpath(os.path.join(path, folder_name)) != excluded_folder_name]
+            for f_name in f_names:
+                if _is_batch_audio(os.path.join(path, f_name), excluded_folder_name):
+                    f_names_audio.append((os.path.join(path, f_name), os.path.relpath(os.path.join(path, f_name), source)))
+    elif source:
+        root_folder_name = source
+        while glob.has_magic(root_folder_name):
+            root_folder_name = os.path.dirname(root_folder_name)
+        for f_name in glob.glob(source, recursive=True):
+            if os.path.isfile(f_name) and _is_batch_audio(f_name, excluded_folder_name):
+                f_names_audio.append((f_name, os.path.relpath(f_name, root_folder_name or '.')))
+    return sorted(f_names_audio)
+
+
+def read_journal(f_name_journal):
+    ''' Reading the batch journal: a dict of source audio names to the signature (size, modification time) of the processed version. '''
+
+    processed = {}
+    if os.path.isfile(f_name_journal):
+        with open(f_name_journal, 'r') as f_journal:
+            for line in f_journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line may be incomplete if the previous run was interrupted
+                    continue
+                processed[entry['source']] = (entry['size'], entry['mtime'])
+    return processed
+
+
+def denoise_batch(args):
+    ''' Denoising many .wav audio (folders, glob patterns or a file list) in a pool of worker processes. Outputs that are up to date (newer than
+    the source or recorded in the journal for the same version of the source) are skipped. Progress is appended to the journal, so an interrupted
+    run can be resumed. Workers can be pinned to cores (--cpus) or NUMA nodes (--numa), the throughput of each core (or group of cores)
+    is printed at the end. '''
+
+    f_names_audio = find_batch_audio(args.source_audio, args.file_list, args.denoised_audio)
+    output_folder_name = args.denoised_audio
+    f_name_journal = args.journal or os.path.join(output_folder_name, '.rnnoise_wrapper_journal')
+    if not os.path.exists(output_folder_name):
+        os.makedirs(output_folder_name)
+
+    processed = read_journal(f_name_journal)
+    tasks = []
+    number_of_skipped = 0
+    for f_name_audio, relative_f_name in f_names_audio:
+        f_name_denoised_audio = os.path.join(output_folder_name, relative_f_name)
+        if not args.force and os.path.isfile(f_name_denoised_audio):
+            source_stat = os.stat(f_name_audio)
+            if processed.get(os.path.abspath(f_name_audio)) == (source_stat.st_size, source_stat.st_mtime) or \
+               os.path.getmtime(f_name_denoised_audio) >= source_stat.st_mtime:
+                number_of_skipped += 1
+                continue
+        tasks.append((f_name_audio, f_name_denoised_audio, args.silence_floor_db))
+
+    cpu_layout = get_cpu_layout(args.jobs, args.cpus, args.numa)
+    print('[i] Found {} audio, {} are up to date, {} to process with {} worker(-s)'.format(len(f_names_audio), number_of_skipped, len(tasks),
+                                                                                       args.jobs))
+    if cpu_layout is not None:
+        print('[i] Workers are pinned to cores: {}'.format(', '.join(format_cpu_list(cpus) for cpus in cpu_layout)))
+    start_time = time.time()
+    total_duration = 0.0
+    number_of_errors = 0
+    worker_stats = {}
+    if tasks:
+        pool = multiprocessing.Pool(args.jobs, initializer=_init_batch_worker, initargs=(cpu_layout, multiprocessing.Value('i', 0)))
+        try:
+            with open(f_name_journal, 'a') as f_journal:
+                for i, (f_name_audio, f_name_denoised_audio, duration, elapsed_time, error, worker_name) in \
+                                                        enumerate(pool.imap_unordered(_denoise_file, tasks, chunksize=args.chunk_size)):
+                    stats = worker_stats.setdefault(worker_name, [0, 0.0, 0.0])
+                    stats[0] += 1
+                    stats[1] += duration
+                    stats[2] += elapsed_time
+                    if error:
+                        number_of_errors += 1
+                        print("[E] '{}': {}".format(f_name_audio, error))
+                    else:
+                        total_duration += duration
+                        source_stat = os.stat(f_name_audio)
+                        f_journal.write(json.dumps({'source': os.path.abspath(f_name_audio), 'denoised': f_name_denoised_audio,
+                                                    'size': source_stat.st_size, 'mtime': source_stat.st_mtime, 'duration': duration}) + '\n')
+                        f_journal.flush()
+                    if (i + 1) % 100 == 0 or i + 1 == len(tasks):
+                        print('[i] Processed {} of {} ({:.1f} s of audio)'.format(i + 1, len(tasks), total_duration))
+        finally:
+            pool.terminate()
+    elapsed_time = time.time() - start_time
+
+    print('[i] Denoised: {}, skipped: {}, errors: {}'.format(len(tasks) - number_of_errors, number_of_skipped, number_of_errors))
+    print('[i] Audio length: {:.3f} h, wall time: {:.3f} h, throughput: {:.1f} audio hours per wall hour'.format(
+        total_duration/3600, elapsed_time/3600, total_duration/max(elapsed_time, 1e-9)))
+    # Workers pinned to the same cores are reported together
+    for worker_name, (number_of_audio, duration, busy_time) in sorted(worker_stats.items()):
+        print('[i] {}: {} audio, {:.1f} s of audio, busy {:.1f} s, throughput: {:.1f} audio hours per busy hour'.format(
+            worker_name.capitalize(), number_of_audio, duration, busy_time, duration/max(busy_time, 1e-9)))
+    if number_of_errors:
+        sys.exit(1)
 
 
 def denoise():
     parser = argparse.ArgumentParser(description='Simple CLI for audio noise reduction using RNNoise_Wrapper.')
-    parser.add_argument('-i', '--source_audio', type=str, required=True,
-                        help='Name .wav audio for noise reduction (for example, "test_audio/source/test_3.wav")')
+    parser.add_argument('-i', '--source_audio', type=str, default=None,
+                        help='Name .wav audio for noise reduction (for example, "test_audio/source/test_3.wav", other formats are decoded ' + \
+                             'by ffmpeg), "-" to read raw PCM from stdin, or folder/glob pattern (for example, "audio/**/*.wav") for batch mode')
     parser.add_argument('-o', '--denoised_audio', type=str, required=True,
-                        help='Name .wav audio for result (for example, "test_audio/test_3_denoised.wav")')
-    
+                        help='Name .wav audio for result (for example, "test_audio/test_3_denoised.wav", other formats are encoded by ffmpeg), ' + \
+                             '"-" to write raw PCM to stdout, ' + \
+                             'or output folder in batch mode (the structure of source folders is kept)')
+    parser.add_argument('-r', '--sample_rate', type=int, default=48000,
+                        help='Sample rate of raw PCM in pipe mode (default is 48000)')
+    parser.add_argument('-c', '--channels', type=int, default=1,
+                        help='Number of interleaved channels of raw PCM in pipe mode (default is 1)')
+    parser.add_argument('-f', '--format', type=str, default='s16le', choices=sorted(RNNoiseStream.sample_formats),
+                        help='Sample format of raw audio in pipe mode: 16 bit PCM, 32 bit float or G.711 (default is "s16le")')
+    parser.add_argument('-l', '--file_list', type=str, default=None,
+                        help='Text file with names of .wav audio, one per line (batch mode, -o is the output folder)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes in batch mode (default is from the host profile made by rnnoise_wrapper_autotune, ' + \
+                             'else the number of CPU cores)')
+    parser.add_argument('--chunk_size', type=int, default=4,
+                        help='Number of audio passed to a worker at once in batch mode (default is 4)')
+    parser.add_argument('--block_duration_ms', type=block_duration, default=10,
+                        help='Duration of blocks read and written in pipe mode in milliseconds, a multiple of 10 (default is 10), or "auto" ' + \
+                             'for the block duration with the best throughput from the host profile (larger blocks delay the first output)')
+    parser.add_argument('--journal', type=str, default=None,
+                        help='Journal of processed audio for resuming batch mode (default is ".rnnoise_wrapper_journal" in the output folder)')
+    parser.add_argument('--silence_floor_db', type=float, default=None,
+                        help='Energy floor of silence in dBFS (for example, -80): long runs of quieter frames are replaced by silence ' + \
+                             'without running the neural network (default is disabled)')
+    parser.add_argument('--ffmpeg', type=str, default='ffmpeg',
+                        help='Name or path of the ffmpeg executable used for audio in formats other than .wav (default is "ffmpeg")')
+    parser.add_argument('--cpus', type=str, default=None,
+                        help='Cores for worker processes in batch mode, one core per worker (for example, "0-15,32-47", default is not pinned)')
+    parser.add_argument('--numa', action='store_true',
+                        help='Spread worker processes in batch mode over NUMA nodes, each worker is pinned to the cores of its node')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Name of .json file to save a per-frame timeline of denoising in Chrome trace-event format (not in batch mode)')
+    parser.add_argument('--force', action='store_true',
+                        help='Denoise all audio in batch mode, even if outputs are up to date')
+
     if len(sys.argv) < 2:
         parser.print_help()
         sys.exit(1)
 
     args = parser.parse_args()
+    args.jobs = args.jobs or get_model_settings().get('workers') or multiprocessing.cpu_count()
+
+    if args.file_list or (args.source_audio and (os.path.isdir(args.source_audio) or glob.has_magic(args.source_audio))):
+        denoise_batch(args)
+        return
+    if not args.source_audio:
+        parser.error('the following arguments are required: -i/--source_audio')
+
+    if args.source_audio == '-' or args.denoised_audio == '-':
+        denoise_stream(args)
+        return
 
     f_name_audio = args.source_audio
     f_name_denoised_audio = args.denoised_audio
 
-    if f_name_audio.rfind('.wav') == -1:
+    if not os.path.splitext(f_name_audio)[1]:
         f_name_audio += '.wav'
-    if f_name_denoised_audio.rfind('.wav') == -1:
+    if not os.path.splitext(f_name_denoised_audio)[1]:
         f_name_denoised_audio += '.wav'
 
 
-    denoiser = RNNoise()
+    tracer = FrameTracer() if args.trace else None
+    denoiser = RNNoise(tracer=tracer)
+    denoiser.trace_name = f_name_audio
+
+    # Other formats (mp3, opus, flac, etc.) are decoded and encoded by ffmpeg subprocesses with constant memory
+    if os.path.splitext(f_name_audio)[1].lower() != '.wav' or os.path.splitext(f_name_denoised_audio)[1].lower() != '.wav':
+        print("[i] Denoising '{}' to '{}' with ffmpeg...".format(f_name_audio, f_name_denoised_audio))
+        start_time = time.time()
+        duration = denoiser.filter_file(f_name_audio, f_name_denoised_audio, silence_floor_db=args.silence_floor_db, f_name_ffmpeg=args.ffmpeg)
+        elapsed_time = time.time() - start_time
 
-    print("[i] Loading '{}'...".format(f_name_audio))
-    audio = denoiser.read_wav(f_name_audio)
+        print('[i] Audio length: {:.2f} s, processing time: {:.2f} s, processing speed: {:.1f} RT'.format(
+            duration, elapsed_time, duration/max(elapsed_time, 1e-9)))
+        if tracer is not None:
+            export_trace(tracer, args.trace)
+        return
 
+    print("[i] Denoising '{}'...".format(f_name_audio))
     start_time = time.time()
-    denoised_audio = denoiser.filter(audio)
+    denoised_audio = denoiser.filter_wav(f_name_audio, silence_floor_db=args.silence_floor_db)
     elapsed_time = time.time() - start_time
 
     print("[i] Saving '{}'...".format(f_name_denoised_audio))
     denoiser.write_wav(f_name_denoised_audio, denoised_audio)
 
-    print('[i] Audio length: {:.2f} s, processing time: {:.2f} s, processing speed: {:.1f} RT'.format(
-        len(audio)/1000, elapsed_time, len(audio)/1000/elapsed_time))
+    print('[i] Audio length: {:.2f} s, processing time: {:.2f} s (with reading), processing speed: {:.1f} RT'.format(
+        len(denoised_audio)/1000, elapsed_time, len(denoised_audio)/1000/elapsed_time))
+    if tracer is not None:
+        export_trace(tracer, args.trace)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+CPU affinity and thread budget of worker processes and threads. Workers can be pinned to a list of cores (one core per worker, in a round-robin
+manner) or to NUMA nodes (workers are spread over the nodes, each worker can run on all cores of its node). Pinning uses os.sched_setaffinity()
+and is available only on Linux, on other systems workers are not pinned.
+
+Memory is placed on a NUMA node only if a worker allocates its native states itself after pinning, as worker processes of the batch mode of
+the CLI do. Worker threads of DenoiseServer and RealtimeScheduler are pinned, but states of streams are allocated by the threads that open
+the streams and any worker can process any stream, so there pinning places only the computation.
+
+Thread pools of numerical libraries (OpenBLAS, MKL, OpenMP) are not needed for denoising and only compete with workers for cores, so they are
+limited to one thread inside workers: with environment variables (for libraries loaded later and subprocesses) and with threadpoolctl
+(for already loaded libraries, if threadpoolctl is installed).
+'''
+
+import os
+import glob
+
+
+library_thread_variables = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                            'NUMEXPR_NUM_THREADS')
+
+
+def parse_cpu_list(cpu_list):
+    ''' Parsing a list of cores in the format of taskset and /sys/devices/system (for example, '0-3,8,10-11').
+    1. cpu_list - string with the list of cores or an iterable of core numbers
+    2. returns a sorted list of core numbers '''
+
+    if not isinstance(cpu_list, str):
+        return sorted(set(int(cpu) for cpu in cpu_list))
+
+    cpus = set()
+    for part in cpu_list.replace(' ', '').split(','):
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                first_cpu, last_cpu = part.split('-')
+                cpus.update(range(int(first_cpu), int(last_cpu) + 1))
+            else:
+                cpus.add(int(part))
+        except ValueError:
+            raise ValueError("invalid list of cores '{}', expected for example '0-3,8,10-11'".format(cpu_list))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    ''' Formatting core numbers as a compact list (for example, [0, 1, 2, 3, 8] -> '0-3,8').
+    1. cpus - iterable of core numbers
+    2. returns a string '''
+
+    parts = []
+    for cpu in sorted(set(cpus)):
+        if parts and parts[-1][1] == cpu - 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ','.join(str(first_cpu) if first_cpu == last_cpu else '{}-{}'.format(first_cpu, last_cpu) for first_cpu, last_cpu in parts)
+
+
+def get_allowed_cpus():
+    ''' Cores on which the current process is allowed to run.
+    1. returns a sorted list of core numbers '''
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_numa_nodes():
+    ''' NUMA nodes of the machine with their cores (only cores allowed for the current process are kept). If the information is not available
+    (not Linux), all cores are considered as one node.
+    1. returns a dict of node numbers to sorted lists of core numbers '''
+
+    allowed_cpus = set(get_allowed_cpus())
+    numa_nodes = {}
+    for f_name_cpu_list in glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'):
+        node = int(os.path.basename(os.path.dirname(f_name_cpu_list))[len('node'):])
+        with open(f_name_cpu_list, 'r') as f_cpu_list:
+            cpus = [cpu for cpu in parse_cpu_list(f_cpu_list.read().strip()) if cpu in allowed_cpus]
+        if cpus:
+            numa_nodes[node] = cpus
+
+    if not numa_nodes:
+        numa_nodes[0] = sorted(allowed_cpus)
+    return numa_nodes
+
+
+def get_cpu_layout(workers, cpus=None, numa=False):
+    ''' Cores of each worker.
+    1. workers - number of workers
+    2. cpus - list of cores (string like '0-3,8' or an iterable of numbers): worker i is pinned to core cpus[i % len(cpus)]
+    3. numa - True: workers are spread over NUMA nodes in a round-robin manner, each worker is pinned to all cores of its node
+       (if cpus is also passed, only these cores are used)
+    4. returns a list of tuples of cores for each worker (if None - workers are not pinned) '''
+
+    if cpus is None and not numa:
+        return None
+
+    if numa:
+        numa_nodes = get_numa_nodes()
+        if cpus is not None:
+            cpus = set(parse_cpu_list(cpus))
+            numa_nodes = {node: [cpu for cpu in node_cpus if cpu in cpus] for node, node_cpus in numa_nodes.items()}
+        groups = [tuple(node_cpus) for node, node_cpus in sorted(numa_nodes.items()) if node_cpus]
+    else:
+        groups = [(cpu,) for cpu in parse_cpu_list(cpus)]
+
+    if not groups:
+        raise ValueError('no cores are available for workers')
+    return [groups[i % len(groups)] for i in range(workers)]
+
+
+def pin_current_worker(cpus):
+    ''' Pinning the calling thread (and threads and processes it creates later) to cores. On Linux, os.sched_setaffinity(0) affects only the
+    calling thread, so each worker thread pins itself.
+    1. cpus - iterable of core numbers (if None - nothing is done)
+    2. returns True if the worker has been pinned '''
+
+    if cpus is None or not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def limit_library_threads(number_of_threads=1):
+    ''' Limiting thread pools of numerical libraries (OpenBLAS, MKL, OpenMP, etc.) in the current process.
+    1. number_of_threads - maximum number of threads of each library '''
+
+    for variable in library_thread_variables:
+        os.environ[variable] = str(number_of_threads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(number_of_threads)
+
+
+def get_current_cpus():
+    ''' Cores on which the calling thread is allowed to run, as a compact list (for reports).
+    1. returns a string (for example, '0-3,8') '''
+
+    return format_cpu_list(get_allowed_cpus())
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Two-tier cache of denoising results (in-memory LRU and size-bounded on-disk storage) for rnnoise_wrapper.RNNoise().
+
+Contains the DenoiseCache class.
+'''
+
+import os
+import threading
+import collections
+
+
+class DenoiseCache(object):
+    """Cache of denoising results with an in-memory LRU tier and an optional on-disk tier. Values are byte strings, keys are hex strings
+    (content hashes). Both tiers are bounded by size, the least recently used values are evicted first. Can be shared by several RNNoise objects
+    and threads:
+    - get(): get a value by key (from memory, then from disk), returns None on miss
+    - put(): save a value in both tiers
+    - stats(): hit/miss statistics and the current size of tiers
+    - clear(): remove all values from both tiers
+
+    1. max_memory_size_mb - maximum size of values in memory in megabytes (if 0 - the in-memory tier is disabled)
+    2. folder_name - folder of the on-disk tier (if None - the on-disk tier is disabled)
+    3. max_disk_size_mb - maximum size of values on disk in megabytes
+    """
+
+    def __init__(self, max_memory_size_mb=64, folder_name=None, max_disk_size_mb=1024):
+        self.max_memory_size = int(max_memory_size_mb * 1024 * 1024)
+        self.folder_name = folder_name
+        self.max_disk_size = int(max_disk_size_mb * 1024 * 1024)
+
+        self.lock = threading.Lock()
+        self.memory_values = collections.OrderedDict()
+        self.memory_size = 0
+        self.disk_files = collections.OrderedDict()
+        self.disk_size = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+
+        if self.folder_name:
+            self.__load_disk_index()
+
+
+    def __reduce__(self):
+        ''' Pickling the configuration of the cache (for example, with RNNoise objects passed to worker processes): a restored cache starts with
+        an empty in-memory tier and shares the on-disk tier through the folder. '''
+
+        return (DenoiseCache, (self.max_memory_size / 1024 / 1024, self.folder_name, self.max_disk_size / 1024 / 1024))
+
+
+    def __load_disk_index(self):
+        ''' Building the index of the on-disk tier from existing files, ordered by the time of last use. '''
+
+        if not os.path.exists(self.folder_name):
+            os.makedirs(self.folder_name)
+
+        disk_files = []
+        for path, folder_names, f_names in os.walk(self.folder_name):
+            for f_name in f_names:
+                if f_name.endswith('.bin'):
+                    f_stat = os.stat(os.path.join(path, f_name))
+                    disk_files.append((f_stat.st_mtime, f_name[:-len('.bin')], f_stat.st_size))
+
+        for mtime, key, size in sorted(disk_files):
+            self.disk_files[key] = size
+            self.disk_size += size
+
+
+    def __get_f_name(self, key):
+        return os.path.join(self.folder_name, key[:2], key + '.bin')
+
+
+    def get(self, key):
+        ''' Get a value by key. A value found on disk is also put in memory.
+        1. key - hex string
+        2. returns a byte string or None if there is no such key '''
+
+        with self.lock:
+            if key in self.memory_values:
+                self.memory_values.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self.memory_values[key]
+
+            if key not in self.disk_files:
+                self.counters['misses'] += 1
+                return None
+
+        f_name = self.__get_f_name(key)
+        try:
+            with open(f_name, 'rb') as f_value:
+                value = f_value.read()
+            # The modification time marks the last use, so that the order of eviction is kept between processes
+            os.utime(f_name, None)
+        except OSError:
+            with self.lock:
+                if key in self.disk_files:
+                    self.disk_size -= self.disk_files.pop(key)
+                self.counters['misses'] += 1
+            return None
+
+        with self.lock:
+            if key in self.disk_files:
+                self.disk_files.move_to_end(key)
+            self.counters['disk_hits'] += 1
+            self.__put_in_memory(key, value)
+        return value
+
+
+    def put(self, key, value):
+        ''' Save a value in memory and on disk.
+        1. key - hex string
+        2. value - byte string '''
+
+        with self.lock:
+            self.__put_in_memory(key, value)
+            if not self.folder_name or key in self.disk_files or len(value) > self.max_disk_size:
+                return
+
+        f_name = self.__get_f_name(key)
+        if not os.path.exists(os.path.dirname(f_name)):
+            os.makedirs(os.path.dirname(f_name), exist_ok=True)
+        f_name_tmp = '{}.{}.{}.tmp'.format(f_name, os.getpid(), threading.get_ident())
+        with open(f_name_tmp, 'wb') as f_value:
+            f_value.write(value)
+        os.replace(f_name_tmp, f_name)
+
+        f_names_to_remove = []
+        with self.lock:
+            if key not in self.disk_files:
+                self.disk_files[key] = len(value)
+                self.disk_size += len(value)
+            while self.disk_size > self.max_disk_size and self.disk_files:
+                old_key, old_size = self.disk_files.popitem(last=False)
+                self.disk_size -= old_size
+                self.counters['disk_evictions'] += 1
+                f_names_to_remove.append(self.__get_f_name(old_key))
+
+        for f_name_to_remove in f_names_to_remove:
+            try:
+                os.remove(f_name_to_remove)
+            except OSError:
+                pass
+
+
+    def __put_in_memory(self, key, value):
+        ''' Saving a value in the in-memory tier with eviction of the least recently used values (the lock must be held). '''
+
+        if len(value) > self.max_memory_size:
+            return
+        if key in self.memory_values:
+            self.memory_values.move_to_end(key)
+            return
+
+        self.memory_values[key] = value
+        self.memory_size += len(value)
+        while self.memory_size > self.max_memory_size:
+            old_key, old_value = self.memory_values.popitem(last=False)
+            self.memory_size -= len(old_value)
+            self.counters['memory_evictions'] += 1
+
+
+    def stats(self):
+        ''' Statistics of the cache.
+        1. returns a dict with numbers of hits in memory and on disk, misses, evictions, hit rate, number and size of values in each tier '''
+
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memory_items'] = len(self.memory_values)
+            stats['memory_size'] = self.memory_size
+            stats['disk_items'] = len(self.disk_files)
+            stats['disk_size'] = self.disk_size
+
+        number_of_requests = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / number_of_requests if number_of_requests else 0.0
+        return stats
+
+
+    def clear(self):
+        ''' Removing all values from memory and disk. Statistics are kept. '''
+
+        with self.lock:
+            keys = list(self.disk_files)
+            self.memory_values.clear()
+            self.memory_size = 0
+            self.disk_files.clear()
+            self.disk_size = 0
+
+        for key in keys:
+            try:
+                os.remove(self.__get_f_name(key))
+            except OSError:
+                pass
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Host profile of rnnoise_wrapper: settings chosen by rnnoise_wrapper.autotune for each model on the current host (backend, block duration
+of streaming, batch size of the server, numbers of worker processes and threads). RNNoise, the CLI, RealtimeScheduler and DenoiseServer
+take their defaults from the profile, arguments passed explicitly always take precedence.
+
+The profile is a JSON file at $RNNOISE_WRAPPER_PROFILE or ~/.cache/rnnoise_wrapper/profile.json (set RNNOISE_WRAPPER_PROFILE to an empty
+string to disable it). It is used only on the host where it was made: the same host name, architecture and number of allowed cores.
+The file is read once per process and again only when it has been changed.
+'''
+
+import os
+import json
+import platform
+import threading
+
+from .cpu_affinity import get_allowed_cpus
+
+
+profile_version = 1
+
+_profile = None
+_profile_signature = None
+_profile_lock = threading.Lock()
+
+
+def get_profile_path():
+    ''' Name of the profile file.
+    1. returns a string (empty if the profile is disabled) '''
+
+    f_name_profile = os.environ.get('RNNOISE_WRAPPER_PROFILE')
+    if f_name_profile is not None:
+        return f_name_profile
+    cache_folder_name = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_folder_name, 'rnnoise_wrapper', 'profile.json')
+
+
+def get_host_info():
+    ''' Description of the current host, the profile is used only on a host with the same description.
+    1. returns a dict '''
+
+    return {'hostname': platform.node(), 'machine': platform.machine(), 'cpus': len(get_allowed_cpus())}
+
+
+def load_profile(f_name_profile=None):
+    ''' Loading the profile (once per process, it is reloaded only when the file has been changed).
+    1. f_name_profile - name of the profile file (if None - get_profile_path())
+    2. returns a dict with the profile or None (no profile, the profile is disabled, invalid or made on another host) '''
+
+    global _profile, _profile_signature
+
+    f_name_profile = get_profile_path() if f_name_profile is None else f_name_profile
+    if not f_name_profile:
+        return None
+    try:
+        profile_stat = os.stat(f_name_profile)
+    except OSError:
+        return None
+
+    signature = (f_name_profile, profile_stat.st_mtime, profile_stat.st_size)
+    with _profile_lock:
+        if signature != _profile_signature:
+            try:
+                with open(f_name_profile, 'r') as f_profile:
+                    profile = json.load(f_profile)
+            except (OSError, ValueError):
+                profile = None
+            if not isinstance(profile, dict) or profile.get('version') != profile_version or profile.get('host') != get_host_info():
+                profile = None
+            _profile, _profile_signature = profile, signature
+        return _profile
+
+
+def save_profile(profile, f_name_profile=None):
+    ''' Saving the profile (to a temporary file which is renamed, so a running process never reads an incomplete profile).
+    1. profile - dict with the profile (see rnnoise_wrapper.autotune)
+    2. f_name_profile - name of the profile file (if None - get_profile_path())
+    3. returns the name of the profile file '''
+
+    f_name_profile = get_profile_path() if f_name_profile is None else f_name_profile
+    if not f_name_profile:
+        raise ValueError('the profile is disabled (RNNOISE_WRAPPER_PROFILE is empty), pass the name of the profile file')
+
+    folder_name = os.path.dirname(f_name_profile)
+    if folder_name and not os.path.exists(folder_name):
+        os.makedirs(folder_name, exist_ok=True)
+    f_name_tmp = '{}.{}.tmp'.format(f_name_profile, os.getpid())
+    with open(f_name_tmp, 'w') as f_profile:
+        json.dump(profile, f_profile, indent=4, sort_keys=True)
+    os.replace(f_name_tmp, f_name_profile)
+    return f_name_profile
+
+
+def get_model_settings(f_name_lib=None, f_name_profile=None):
+    ''' Settings of a model from the profile.
+    1. f_name_lib - path or name of the model library (the base name is compared, a prefix like 'librnnoise_default' is enough), if None -
+       the default model of RNNoise
+    2. f_name_profile - name of the profile file (if None - get_profile_path())
+    3. returns a dict with 'backend', 'block_duration_ms', 'max_batch_size', 'workers' and 'threads' (empty if there is no profile or
+       the model has not been tuned) '''
+
+    profile = load_profile(f_name_profile)
+    if profile is None:
+        return {}
+
+    models = profile.get('models', {})
+    model_name = os.path.basename(f_name_lib) if f_name_lib else profile.get('default_model')
+    if model_name in models:
+        return models[model_name]
+    for other_model_name in sorted(models):
+        if model_name and other_model_name.startswith(model_name):
+            return models[other_model_name]
+    return {}
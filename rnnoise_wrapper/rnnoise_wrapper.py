@@ -9,30 +9,166 @@
 '''
 Designed to suppress noise in wav audio using the RNNoise library (https://github.com/xiph/rnnoise).
 
-Contains the RNNoise class. Read more at https://github.com/Desklop/RNNoise_Wrapper.
+Contains the RNNoise and RNNoiseStream classes. Read more at https://github.com/Desklop/RNNoise_Wrapper.
 
-Dependencies: pydub, numpy.
+Dependencies: pydub, numpy (and ffmpeg for RNNoise.filter_file()).
 '''
 
 import os
 import platform
 import time
 import ctypes
+import struct
+import hashlib
+import threading
+import subprocess
+import collections
 import pkg_resources
 import numpy as np
 from pydub import AudioSegment
 
+from .audio_utils import G711_ENCODINGS, ratecv, g711_decode, g711_encode, read_wav_samples
+from .wav_writer import WavWriter
+from .host_profile import get_model_settings
+
 
 __version__ = 1.1
 
 
+class _DenseLayer(ctypes.Structure):
+    ''' DenseLayer from rnn.h. '''
+
+    _fields_ = [('bias', ctypes.c_void_p), ('input_weights', ctypes.c_void_p), ('nb_inputs', ctypes.c_int), ('nb_neurons', ctypes.c_int),
+                ('activation', ctypes.c_int)]
+
+
+class _GRULayer(ctypes.Structure):
+    ''' GRULayer from rnn.h. '''
+
+    _fields_ = [('bias', ctypes.c_void_p), ('input_weights', ctypes.c_void_p), ('recurrent_weights', ctypes.c_void_p),
+                ('nb_inputs', ctypes.c_int), ('nb_neurons', ctypes.c_int), ('activation', ctypes.c_int)]
+
+
+class _RNNModel(ctypes.Structure):
+    ''' struct RNNModel from rnn_data.h (sizes of layers and pointers to DenseLayer/GRULayer). '''
+
+    _fields_ = [('input_dense_size', ctypes.c_int), ('input_dense', ctypes.c_void_p),
+                ('vad_gru_size', ctypes.c_int), ('vad_gru', ctypes.c_void_p),
+                ('noise_gru_size', ctypes.c_int), ('noise_gru', ctypes.c_void_p),
+                ('denoise_gru_size', ctypes.c_int), ('denoise_gru', ctypes.c_void_p),
+                ('denoise_output_size', ctypes.c_int), ('denoise_output', ctypes.c_void_p),
+                ('vad_output_size', ctypes.c_int), ('vad_output', ctypes.c_void_p)]
+
+
+class _RNNState(ctypes.Structure):
+    ''' struct RNNState from rnn_data.h, the last member of struct DenoiseState from denoise.c. '''
+
+    _fields_ = [('model', ctypes.POINTER(_RNNModel)), ('vad_gru_state', ctypes.POINTER(ctypes.c_float)),
+                ('noise_gru_state', ctypes.POINTER(ctypes.c_float)), ('denoise_gru_state', ctypes.POINTER(ctypes.c_float))]
+
+
+_batch_lib = None
+_is_batch_lib_searched = False
+_batch_lib_lock = threading.Lock()
+
+
+def _load_batch_lib():
+    ''' Loading the native shim for batched processing of frames (libs/rnnoise_batch.so from package files, built by compile_rnnoise.sh from
+    src/rnnoise_batch.c). The shim is searched once per process and is shared by all RNNoise objects, because it does not depend on the model.
+    Returns the loaded library or None if the shim is missing or has an incompatible interface (then frames are processed one by one). '''
+
+    global _batch_lib, _is_batch_lib_searched
+    with _batch_lib_lock:
+        if _is_batch_lib_searched:
+            return _batch_lib
+        _is_batch_lib_searched = True
+
+        f_name_batch_lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libs', 'rnnoise_batch.so')
+        if not os.path.isfile(f_name_batch_lib):
+            return None
+        try:
+            batch_lib = ctypes.cdll.LoadLibrary(f_name_batch_lib)
+            if batch_lib.rnnoise_batch_version() != 1:
+                return None
+        except (OSError, AttributeError):
+            return None
+
+        batch_lib.rnnoise_batch_process_frames.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+                                                           ctypes.c_void_p]
+        batch_lib.rnnoise_batch_process_frames.restype = None
+        batch_lib.rnnoise_batch_process_pairs.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+                                                          ctypes.c_void_p]
+        batch_lib.rnnoise_batch_process_pairs.restype = None
+        _batch_lib = batch_lib
+        return _batch_lib
+
+
+_libs = {}
+_lib_hashes = {}
+_pickled_libs = {}
+_libs_lock = threading.Lock()
+_native_attribute_names = ('rnnoise_lib', 'rnnoise_obj', 'process_frame_address', 'batch_lib')
+
+
+def _load_rnnoise_lib(f_name_lib):
+    ''' Loading a model library with declared types of arguments and results. Each library is loaded once per process and is shared by all
+    RNNoise objects with this model (also by objects restored by pickle in worker processes).
+    1. f_name_lib - absolute path to the library
+    2. returns the loaded library '''
+
+    with _libs_lock:
+        rnnoise_lib = _libs.get(f_name_lib)
+        if rnnoise_lib is not None:
+            return rnnoise_lib
+
+        rnnoise_lib = ctypes.cdll.LoadLibrary(f_name_lib)
+        rnnoise_lib.rnnoise_process_frame.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_float)]
+        rnnoise_lib.rnnoise_process_frame.restype = ctypes.c_float
+        rnnoise_lib.rnnoise_create.restype = ctypes.c_void_p
+        rnnoise_lib.rnnoise_destroy.argtypes = [ctypes.c_void_p]
+        rnnoise_lib.rnnoise_get_size.restype = ctypes.c_int
+        _libs[f_name_lib] = rnnoise_lib
+        return rnnoise_lib
+
+
+def _get_lib_hash(f_name_lib):
+    ''' SHA-256 of a library file (computed once per process).
+    1. f_name_lib - absolute path to the library
+    2. returns a hex string '''
+
+    with _libs_lock:
+        lib_hash = _lib_hashes.get(f_name_lib)
+    if lib_hash is None:
+        with open(f_name_lib, 'rb') as f_lib:
+            lib_hash = hashlib.sha256(f_lib.read()).hexdigest()
+        with _libs_lock:
+            _lib_hashes[f_name_lib] = lib_hash
+    return lib_hash
+
+
+def _drain_stderr(process, messages):
+    ''' Reading stderr of a subprocess in a separate thread so that it can not fill the pipe and block the subprocess. Only the last messages
+    are kept in messages (collections.deque with maxlen). '''
+
+    for line in process.stderr:
+        messages.append(line.decode('utf-8', errors='replace').rstrip())
+
+
 class RNNoise(object):
     """Provides methods to simplify working with RNNoise:
     - read_wav(): loading a .wav audio recording and converting it to a supported format
     - write_wav(): save .wav audio recording
     - filter(): split audio into frames and clean them from noise
+    - filter_wav(): clearing a .wav audio recording from noise, it is read straight into one buffer of frames without pydub conversions
     - filter_frame(): clearing only one frame from noise (directly accessing the RNNoise binary)
-    - reset(): recreate the RNNoise object from the library to reset the state of the neural network
+    - filter_frames(): clearing several frames from noise in place in np.ndarray (without conversion to byte strings)
+    - filter_frames_of_streams(): clearing one frame of each of several streams (RNNoise objects) from noise in one native call
+    - iter_filter(): lazily clearing audio from an iterable or a file-like object from noise, yields denoised blocks as soon as they are ready
+    - filter_file(): clearing an audio file of any format supported by ffmpeg from noise with constant memory
+    - reset(): recreate the RNNoise object from the library to reset the state of the neural network (or restore a saved state)
+    - get_model_info(): sizes of layers and number of weights of the loaded model
+    - get_state(): snapshot of the state of the neural network and of the signal processing as a byte string
+    - set_state(): restore the state from a snapshot made by get_state() (also in another process or on another machine)
 
     1. f_name_lib - path to the library, if None and:
             - OS type linux or mac (darwin) - use librnnoise_5h_b_500k.so.0.4.1 from package files
@@ -40,22 +176,131 @@ class RNNoise(object):
         if is a path to a library/library name - check the existence of the passed path/library name and if:
             - path/name exists - return absolute path
             - path/name does not exist - search the current folder and its subfolders for the file/path using the passed value as the subname
+    2. cache - rnnoise_wrapper.DenoiseCache object for results of filter() (if None - results are not cached). The key is a hash of the audio data,
+        its sample rate, the model library and the arguments of filter(). With cache each call of filter() is denoised from the initial state
+        of the neural network (the state used for streaming is not changed), so the cache is intended for whole audio recordings
+    3. tracer - rnnoise_wrapper.FrameTracer object to record the native call of RNNoise for each frame, resampling and enqueue/emit of audio
+        (if None - nothing is recorded and there is no overhead). Events are tagged with the trace_name attribute as the name of the stream
+
+    If the native shim libs/rnnoise_batch.so (built by compile_rnnoise.sh) is found, several frames are processed in one ctypes call instead of
+    one call per frame (the result is the same). It is available in the batch_lib attribute, set it to None to process frames one by one.
+
+    If the host profile made by rnnoise_wrapper.autotune has settings for the model, the backend (the native shim or one ctypes call per frame)
+    and the block duration with the best throughput (the block_duration_ms attribute) are taken from it. The block duration is used by
+    iter_filter() only if it is requested with block_duration_ms=None, as larger blocks delay the first output.
+
+    RNNoise objects can be pickled (for example, passed to multiprocessing, concurrent.futures.ProcessPoolExecutor or a distributed batch
+    framework): only the configuration is pickled (path and hash of the model library, cache, backend, block duration and, if the pickle_state
+    attribute is True, a snapshot from get_state()), the tracer is dropped. A restored object loads the library only on the first use, and the
+    library is loaded once per process, so tasks in a worker do not pay the loading cost again.
     """
     sample_width = 2
     channels = 1
     sample_rate = 48000
     frame_duration_ms = 10
+    silence_reprime_frames = 8
+    state_magic = b'RNNS'
+    state_version = 1
 
-    def __init__(self, f_name_lib=None):
+    def __init__(self, f_name_lib=None, cache=None, tracer=None):
         f_name_lib = self.__get_f_name_lib(f_name_lib)
-        self.rnnoise_lib = ctypes.cdll.LoadLibrary(f_name_lib)
+        self.f_name_lib = f_name_lib
+        self.cache = cache
+        self.tracer = tracer
+        self.trace_name = None
+        self.number_of_traced_frames = 0
+        self.lib_hash = None
+        self.pickle_state = False
+        self.__create_native_state()
+
+        settings = get_model_settings(f_name_lib)
+        self.batch_lib = _load_batch_lib() if settings.get('backend', 'batch') == 'batch' else None
+        self.block_duration_ms = settings.get('block_duration_ms', 10)
+
 
-        self.rnnoise_lib.rnnoise_process_frame.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_float)]
-        self.rnnoise_lib.rnnoise_process_frame.restype = ctypes.c_float
-        self.rnnoise_lib.rnnoise_create.restype = ctypes.c_void_p
-        self.rnnoise_lib.rnnoise_destroy.argtypes = [ctypes.c_void_p]
+    def __create_native_state(self):
+        ''' Getting the model library from the per-process cache and creating the RNNoise object in it. '''
 
+        self.rnnoise_lib = _load_rnnoise_lib(self.f_name_lib)
         self.rnnoise_obj = self.rnnoise_lib.rnnoise_create(None)
+        self.process_frame_address = ctypes.cast(self.rnnoise_lib.rnnoise_process_frame, ctypes.c_void_p).value
+
+
+    def __del__(self):
+        ''' Destroying the RNNoise object in the library (objects restored by pickle have it only after the first use). '''
+
+        rnnoise_lib = self.__dict__.get('rnnoise_lib')
+        rnnoise_obj = self.__dict__.get('rnnoise_obj')
+        if rnnoise_lib is not None and rnnoise_obj:
+            self.rnnoise_obj = None
+            rnnoise_lib.rnnoise_destroy(rnnoise_obj)
+
+
+    def __getstate__(self):
+        ''' Pickling the configuration of the object instead of the loaded library and native pointers: path and hash of the model library,
+        cache, name in traces, backend, block duration and, if the pickle_state attribute is True, a snapshot from get_state(). The tracer is
+        not pickled. An object which has not been used since it was restored is pickled without loading the library.
+        1. returns a dict with the configuration '''
+
+        config = self.__dict__.get('_RNNoise__config')
+        if config is not None:
+            return dict(config)
+        return {'f_name_lib': self.f_name_lib, 'lib_hash': self.__get_lib_hash(), 'cache': self.cache, 'trace_name': self.trace_name,
+                'is_batch': self.batch_lib is not None, 'block_duration_ms': self.block_duration_ms, 'pickle_state': self.pickle_state,
+                'state': self.get_state() if self.pickle_state else None}
+
+
+    def __setstate__(self, config):
+        ''' Restoring the object from the configuration made by __getstate__(). The library is loaded and the RNNoise object is created only on
+        the first access to them (see __getattr__()), the library is loaded once per process.
+        1. config - dict from __getstate__() '''
+
+        self.f_name_lib = config['f_name_lib']
+        self.cache = config['cache']
+        self.tracer = None
+        self.trace_name = config['trace_name']
+        self.number_of_traced_frames = 0
+        self.lib_hash = config['lib_hash']
+        self.pickle_state = config['pickle_state']
+        self.block_duration_ms = config['block_duration_ms']
+        self.__config = config
+
+
+    def __getattr__(self, name):
+        ''' Loading the library and creating the RNNoise object of an object restored by pickle on the first access to them. '''
+
+        config = self.__dict__.get('_RNNoise__config')
+        if config is None or name not in _native_attribute_names:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+        self.f_name_lib = self.__get_pickled_f_name_lib(config['f_name_lib'], config['lib_hash'])
+        self.__create_native_state()
+        self.batch_lib = _load_batch_lib() if config['is_batch'] else None
+        if config['state'] is not None:
+            self.set_state(config['state'])
+        del self.__dict__['_RNNoise__config']
+        return self.__dict__[name]
+
+
+    def __get_pickled_f_name_lib(self, f_name_lib, lib_hash):
+        ''' Finding the model library of a pickled object in this process: the same path or, if it does not exist (for example, on another host),
+        the library with the same name (see __get_f_name_lib()). The result is cached per process.
+        1. f_name_lib - path to the library in the process where the object was pickled
+        2. lib_hash - SHA-256 of the library
+        3. returns the absolute path to the library with the same hash, raises ValueError if the found library is different '''
+
+        with _libs_lock:
+            found_f_name_lib = _pickled_libs.get((f_name_lib, lib_hash))
+        if found_f_name_lib is not None:
+            return found_f_name_lib
+
+        found_f_name_lib = f_name_lib if os.path.isfile(f_name_lib) else self.__get_f_name_lib(os.path.basename(f_name_lib))
+        if _get_lib_hash(found_f_name_lib) != lib_hash:
+            raise ValueError("RNNoise object was pickled with model library '{}', but '{}' found in this process is a different library".format(
+                             f_name_lib, found_f_name_lib))
+        with _libs_lock:
+            _pickled_libs[(f_name_lib, lib_hash)] = found_f_name_lib
+        return found_f_name_lib
 
 
     def __get_f_name_lib(self, f_name_lib=None):
@@ -114,15 +359,105 @@ class RNNoise(object):
                     return os.path.join(path, f_name)
 
 
-    def reset(self):
+    def reset(self, state=None):
         '''Reset the state of the neural network by creating a new RNNoise object in the compiled source library.
         Can be useful when noise reduction is used on a large number of audio recordings to prevent degradation
         work quality.
 
-        The effectiveness and necessity of this method has not been proven. Implemented just in case :)'''
+        The effectiveness and necessity of this method has not been proven. Implemented just in case :)
+
+        1. state - snapshot from get_state() to start from instead of the initial state (for example, a state already converged on the noise
+           of a certain channel type, so that there is no warm-up at the beginning of each audio), if None - use the initial state'''
 
         self.rnnoise_lib.rnnoise_destroy(self.rnnoise_obj)
         self.rnnoise_obj = self.rnnoise_lib.rnnoise_create(None)
+        if state is not None:
+            self.set_state(state)
+
+
+    def __get_lib_hash(self):
+        ''' SHA-256 of the library file (computed once). '''
+
+        if self.lib_hash is None:
+            self.lib_hash = _get_lib_hash(self.f_name_lib)
+        return self.lib_hash
+
+
+    def __get_native_state(self):
+        ''' Layout of the native state (struct DenoiseState from denoise.c): its last member is struct RNNState with pointers to the model and
+        to 3 separately allocated arrays with GRU states, all other members are plain values.
+        1. returns a tuple of the size of the plain part of the state, RNNState object and list of tuples (GRU state pointer, GRU size) '''
+
+        size_of_plain_part = self.rnnoise_lib.rnnoise_get_size() - ctypes.sizeof(_RNNState)
+        rnn_state = _RNNState.from_address(self.rnnoise_obj + size_of_plain_part)
+        model = rnn_state.model.contents
+        gru_states = [(rnn_state.vad_gru_state, model.vad_gru_size), (rnn_state.noise_gru_state, model.noise_gru_size),
+                      (rnn_state.denoise_gru_state, model.denoise_gru_size)]
+        return size_of_plain_part, rnn_state, gru_states
+
+
+    def get_state(self):
+        '''Snapshot of the current state of noise reduction: all signal processing buffers (analysis/synthesis memory, pitch and cepstral history,
+        gains) and the states of the GRU layers of the neural network. Can be used to start new audio from a converged state with reset() or to
+        continue a stream in another process with set_state().
+        1. returns a byte string with the state (contains the hash of the model library)'''
+
+        size_of_plain_part, rnn_state, gru_states = self.__get_native_state()
+        header = struct.pack('<4sIIIII', self.state_magic, self.state_version, size_of_plain_part, *[gru_size for gru_ptr, gru_size in gru_states])
+        state = [header, bytes.fromhex(self.__get_lib_hash()), ctypes.string_at(self.rnnoise_obj, size_of_plain_part)]
+        state += [ctypes.string_at(gru_ptr, gru_size * ctypes.sizeof(ctypes.c_float)) for gru_ptr, gru_size in gru_states]
+        return b''.join(state)
+
+
+    def set_state(self, state, check_model=True):
+        '''Restore the state of noise reduction from a snapshot made by get_state() (of this or another RNNoise object with the same model).
+        1. state - byte string from get_state()
+        2. check_model - True: raise ValueError if the snapshot was made with a different model library'''
+
+        size_of_plain_part, rnn_state, gru_states = self.__get_native_state()
+        header_size = struct.calcsize('<4sIIIII')
+        expected_size = header_size + 32 + size_of_plain_part + sum(gru_size for gru_ptr, gru_size in gru_states) * ctypes.sizeof(ctypes.c_float)
+
+        if len(state) < header_size:
+            raise ValueError("'state' is not a snapshot of RNNoise state")
+        magic, version, state_size_of_plain_part, *state_gru_sizes = struct.unpack('<4sIIIII', state[:header_size])
+        if magic != self.state_magic or version != self.state_version:
+            raise ValueError("'state' is not a snapshot of RNNoise state or has an unsupported version")
+        if state_size_of_plain_part != size_of_plain_part or state_gru_sizes != [gru_size for gru_ptr, gru_size in gru_states] \
+                                                           or len(state) != expected_size:
+            raise ValueError("'state' was made with an incompatible build of RNNoise library or model")
+        if check_model and state[header_size:header_size+32].hex() != self.__get_lib_hash():
+            raise ValueError("'state' was made with a different model library")
+
+        offset = header_size + 32
+        ctypes.memmove(self.rnnoise_obj, state[offset:offset+size_of_plain_part], size_of_plain_part)
+        offset += size_of_plain_part
+        for gru_ptr, gru_size in gru_states:
+            gru_state_size = gru_size * ctypes.sizeof(ctypes.c_float)
+            ctypes.memmove(gru_ptr, state[offset:offset+gru_state_size], gru_state_size)
+            offset += gru_state_size
+
+
+    def get_model_info(self):
+        ''' Architecture of the loaded model (read from the library, so models trained with any layer sizes are supported).
+        1. returns a dict with sizes of layers ('input_dense_size', 'vad_gru_size', 'noise_gru_size', 'denoise_gru_size',
+           'denoise_output_size', 'vad_output_size') and the total number of weights ('number_of_weights') '''
+
+        size_of_plain_part, rnn_state, gru_states = self.__get_native_state()
+        model = rnn_state.model.contents
+
+        model_info = {}
+        number_of_weights = 0
+        for layer_name in ['input_dense', 'vad_gru', 'noise_gru', 'denoise_gru', 'denoise_output', 'vad_output']:
+            model_info[layer_name + '_size'] = getattr(model, layer_name + '_size')
+            if layer_name.find('_gru') != -1:
+                layer = _GRULayer.from_address(getattr(model, layer_name))
+                number_of_weights += 3 * (layer.nb_inputs + layer.nb_neurons + 1) * layer.nb_neurons
+            else:
+                layer = _DenseLayer.from_address(getattr(model, layer_name))
+                number_of_weights += (layer.nb_inputs + 1) * layer.nb_neurons
+        model_info['number_of_weights'] = number_of_weights
+        return model_info
 
 
     def filter_frame(self, frame):
@@ -143,11 +478,54 @@ class RNNoise(object):
         frame_buf = np.ndarray((480,), 'h', frame).astype(ctypes.c_float)
         frame_buf_ptr = frame_buf.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
 
-        vad_probability = self.rnnoise_lib.rnnoise_process_frame(self.rnnoise_obj, frame_buf_ptr, frame_buf_ptr)
+        if self.tracer is None:
+            vad_probability = self.rnnoise_lib.rnnoise_process_frame(self.rnnoise_obj, frame_buf_ptr, frame_buf_ptr)
+        else:
+            start_time = time.perf_counter()
+            vad_probability = self.rnnoise_lib.rnnoise_process_frame(self.rnnoise_obj, frame_buf_ptr, frame_buf_ptr)
+            self.tracer.add('native', start_time, time.perf_counter(), self.trace_name, self.number_of_traced_frames)
+            self.number_of_traced_frames += 1
         return vad_probability, frame_buf.astype(ctypes.c_short).tobytes()
 
 
-    def filter(self, audio, sample_rate=None, voice_prob_threshold=0.0, save_source_sample_rate=True):
+    def filter_frames(self, frames):
+        ''' Denoising several frames in place with RNNoise (the state of the neural network is carried between frames, as in filter_frame()).
+        1. frames - np.ndarray with shape (number_of_frames, 480) and type float32 (samples in 16 bit range, 48 kHz), C-contiguous
+        2. returns np.ndarray with the probability of having a voice in each frame '''
+
+        if frames.ndim != 2 or frames.shape[1] != int(self.sample_rate * self.frame_duration_ms / 1000) or frames.dtype != ctypes.c_float \
+           or not frames.flags['C_CONTIGUOUS']:
+            raise ValueError("'frames' must be a C-contiguous float32 np.ndarray with shape (number_of_frames, 480)")
+        return self.__process_frames(frames)
+
+
+    @staticmethod
+    def filter_frames_of_streams(denoisers, frames):
+        ''' Denoising one frame of each of several streams in place: frame i is denoised with denoisers[i] (the state of each RNNoise object is
+        carried, as in filter_frame()). With the native shim all frames are processed in one ctypes call (denoisers can use different models).
+        1. denoisers - list of RNNoise objects
+        2. frames - np.ndarray with shape (len(denoisers), 480) and type float32 (samples in 16 bit range, 48 kHz), C-contiguous
+        3. returns np.ndarray with the probability of having a voice in each frame '''
+
+        if frames.ndim != 2 or frames.shape != (len(denoisers), int(RNNoise.sample_rate * RNNoise.frame_duration_ms / 1000)) \
+           or frames.dtype != ctypes.c_float or not frames.flags['C_CONTIGUOUS']:
+            raise ValueError("'frames' must be a C-contiguous float32 np.ndarray with shape (len(denoisers), 480)")
+
+        if not denoisers or any(denoiser.batch_lib is None or denoiser.tracer is not None for denoiser in denoisers):
+            vad_probabilities = np.zeros(len(denoisers), dtype=np.float32)
+            for i, denoiser in enumerate(denoisers):
+                vad_probabilities[i] = denoiser.filter_frames(frames[i:i+1])[0]
+            return vad_probabilities
+
+        process_frames = (ctypes.c_void_p * len(denoisers))(*[denoiser.process_frame_address for denoiser in denoisers])
+        states = (ctypes.c_void_p * len(denoisers))(*[denoiser.rnnoise_obj for denoiser in denoisers])
+        vad_probabilities = np.zeros(len(denoisers), dtype=np.float32)
+        denoisers[0].batch_lib.rnnoise_batch_process_pairs(process_frames, states, frames.ctypes.data, len(denoisers), frames.shape[1],
+                                                           vad_probabilities.ctypes.data)
+        return vad_probabilities
+
+
+    def filter(self, audio, sample_rate=None, voice_prob_threshold=0.0, save_source_sample_rate=True, silence_floor_db=None, encoding='pcm'):
         ''' Get frames from an audio recording and de-noise them. RNNoise is used for noise reduction.
 
         RNNoise additionally for each frame returns the probability of having a vote in this frame (as a number from 0 to 1) and
@@ -168,13 +546,45 @@ class RNNoise(object):
         2. sample_rate - sample rate (required only when audio is a byte string)
         3. voice_prob_threshold - threshold for the probability of having a voice in each frame (value from 0 to 1, if 0 - use all frames)
         4. save_source_sample_rate - True: bring the sample rate of the returned audio recording to the original
-        5. returns pydub.AudioSegment or a byte string (without wav headers) denoised (the returned object type is audio)'''
+        5. silence_floor_db - energy floor of silence in dBFS (for example, -80). If not None, runs of frames with lower energy are not passed
+           through the neural network: silence and a voice probability of 0 are returned for them. The first frame of each run and the last
+           self.silence_reprime_frames frames before the end of the run are still processed to keep the output continuous and to re-prime
+           the state of the neural network. Speeds up audio with long silence (if None - all frames are processed)
+        6. encoding - encoding of audio when it is a byte string: 'pcm' (16 bit), 'ulaw' or 'alaw' (G.711, 8 bit, for example 8 kHz telephony).
+           G.711 audio is decoded, resampled, denoised and encoded back in np.ndarray without pydub and intermediate byte strings,
+           the returned byte string has the same encoding
+        7. returns pydub.AudioSegment or a byte string (without wav headers) denoised (the returned object type is audio)'''
+
+        if encoding != 'pcm':
+            if encoding not in G711_ENCODINGS:
+                raise ValueError("unsupported 'encoding' '{}', supported: pcm, {}".format(encoding, ', '.join(G711_ENCODINGS)))
+            if not isinstance(audio, bytes):
+                raise TypeError("'encoding' can only be used when type(audio) = 'bytes'")
+
+        if self.tracer is None:
+            return self.__filter_audio(audio, sample_rate, voice_prob_threshold, save_source_sample_rate, silence_floor_db, encoding)
+
+        self.tracer.add('enqueue', time.perf_counter(), stream=self.trace_name)
+        try:
+            return self.__filter_audio(audio, sample_rate, voice_prob_threshold, save_source_sample_rate, silence_floor_db, encoding)
+        finally:
+            self.tracer.add('emit', time.perf_counter(), stream=self.trace_name)
+
+
+    def __filter_audio(self, audio, sample_rate, voice_prob_threshold, save_source_sample_rate, silence_floor_db, encoding):
+        ''' Denoising audio for filter() with already checked arguments (with cache, G.711 or PCM). '''
+
+        if self.cache is not None:
+            return self.__filter_with_cache(audio, sample_rate, voice_prob_threshold, save_source_sample_rate, silence_floor_db, encoding)
+
+        if encoding != 'pcm':
+            return self.__filter_g711(audio, sample_rate, voice_prob_threshold, save_source_sample_rate, silence_floor_db, encoding)
 
         frames, source_sample_rate = self.__get_frames(audio, sample_rate)
         if not save_source_sample_rate:
             source_sample_rate = None
 
-        denoised_audio = self.__filter_frames(frames, voice_prob_threshold, source_sample_rate)
+        denoised_audio = self.__filter_frames(frames, voice_prob_threshold, source_sample_rate, silence_floor_db)
 
         if isinstance(audio, AudioSegment):
             return denoised_audio
@@ -182,7 +592,316 @@ class RNNoise(object):
             return denoised_audio.raw_data
 
 
-    def __filter_frames(self, frames, voice_prob_threshold=0.0, sample_rate=None):
+    def filter_wav(self, f_name_wav, voice_prob_threshold=0.0, save_source_sample_rate=True, silence_floor_db=None, channel=None):
+        ''' Same as filter(self.read_wav(f_name_wav)), but the .wav audio is parsed, brought to 16 bit mono and resampled to 48 kHz in one pass
+        straight into one float32 buffer of frames, which is denoised in place (instead of several copies of the audio made by conversions
+        of pydub, splitting into frames and joining them). For 16 bit mono audio the result is bit-exact with filter(self.read_wav(f_name_wav)).
+        With cache, filter() is used.
+
+        1. f_name_wav - name of the .wav audio recording, BytesIO or byte string with .wav audio (8, 16, 24, 32 bit int or 32, 64 bit float)
+        2. voice_prob_threshold, save_source_sample_rate, silence_floor_db - see filter()
+        3. channel - index of the channel to denoise (if None - all channels are mixed down)
+        4. returns a pydub.AudioSegment object with the denoised audio recording '''
+
+        if self.cache is not None:
+            return self.filter(self.read_wav(f_name_wav, channel=channel), voice_prob_threshold=voice_prob_threshold,
+                               save_source_sample_rate=save_source_sample_rate, silence_floor_db=silence_floor_db)
+
+        if self.tracer is None:
+            return self.__filter_wav(f_name_wav, voice_prob_threshold, save_source_sample_rate, silence_floor_db, channel)
+
+        self.tracer.add('enqueue', time.perf_counter(), stream=self.trace_name)
+        try:
+            return self.__filter_wav(f_name_wav, voice_prob_threshold, save_source_sample_rate, silence_floor_db, channel)
+        finally:
+            self.tracer.add('emit', time.perf_counter(), stream=self.trace_name)
+
+
+    def __filter_wav(self, f_name_wav, voice_prob_threshold, save_source_sample_rate, silence_floor_db, channel):
+        ''' Denoising .wav audio for filter_wav() in one float32 buffer of frames. '''
+
+        wav_data = self.__read_wav_data(f_name_wav)
+        frame_length = int(self.sample_rate * self.frame_duration_ms / 1000)
+        frames, _, source_sample_rate = self.__call_traced('resample', read_wav_samples, wav_data, self.sample_rate, channel, frame_length,
+                                                           ctypes.c_float)
+        del wav_data
+
+        denoised_samples = self.__denoise_frames(frames.reshape(-1, frame_length), voice_prob_threshold, silence_floor_db)
+        sample_rate = self.sample_rate
+        if save_source_sample_rate and source_sample_rate != self.sample_rate:
+            denoised_samples = self.__call_traced('resample', ratecv, denoised_samples, self.sample_rate, source_sample_rate)[0]
+            sample_rate = source_sample_rate
+        return AudioSegment(data=denoised_samples.tobytes(), sample_width=self.sample_width, frame_rate=sample_rate, channels=self.channels)
+
+
+    def iter_filter(self, source, sample_rate=None, block_duration_ms=10, voice_prob_threshold=0.0, save_source_sample_rate=True):
+        ''' Lazy denoising of audio in blocks: the source is read only as needed and each block is yielded as soon as it has been denoised, so
+        the consumer (ASR, encoding, upload, etc.) can work in parallel with denoising. The state of the neural network and of the resampling
+        is carried between blocks, so the joined blocks are the same as the result of filter() for the whole audio.
+
+        1. source - iterable of byte strings with audio data of any length (for example, a generator of network packets), file-like object
+           with read() (for example, an open file with raw PCM or sys.stdin.buffer), byte string or pydub.AudioSegment. Audio is 16 bit mono
+           without wav headers
+        2. sample_rate - sample rate of source (if None - 48 kHz, for pydub.AudioSegment its sample rate is used)
+        3. block_duration_ms - duration of yielded blocks in milliseconds (a multiple of 10, the last block can be shorter), if None -
+           self.block_duration_ms (the block duration with the best throughput from the host profile, else 10)
+        4. voice_prob_threshold - threshold for the probability of having a voice in each frame (see filter()), frames with a lower probability
+           are removed from blocks
+        5. save_source_sample_rate - True: bring the sample rate of yielded blocks to the sample rate of source
+        6. yields tuples of the maximum probability of having a voice among frames of the block and a byte string with the denoised block '''
+
+        block_duration_ms = block_duration_ms or self.block_duration_ms
+        if block_duration_ms <= 0 or block_duration_ms % self.frame_duration_ms != 0:
+            raise ValueError("'block_duration_ms' must be a positive multiple of {}".format(self.frame_duration_ms))
+
+        frame_length = int(self.sample_rate * self.frame_duration_ms / 1000)
+        block_length = frame_length * (block_duration_ms // self.frame_duration_ms)
+
+        if isinstance(source, AudioSegment):
+            sample_rate = source.frame_rate
+            source = source.raw_data
+        sample_rate = sample_rate or self.sample_rate
+
+        # Audio in memory and file-like objects are read in blocks of the same duration as the yielded blocks
+        read_size = int(sample_rate * block_duration_ms / 1000) * self.sample_width
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = memoryview(source).cast('B')
+            chunks = (source[i:i+read_size] for i in range(0, len(source), read_size))
+        elif hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(read_size), b'')
+        else:
+            chunks = source
+        denoised_sample_rate = sample_rate if save_source_sample_rate else self.sample_rate
+
+        upsample_state = downsample_state = None
+        samples = np.zeros(0, dtype=np.int16)
+        tail = b''
+        for chunk in chunks:
+            if self.tracer is not None:
+                self.tracer.add('enqueue', time.perf_counter(), stream=self.trace_name)
+            if tail:
+                chunk = tail + bytes(chunk)
+            number_of_bytes = len(chunk) - len(chunk) % self.sample_width
+            tail = bytes(chunk[number_of_bytes:])
+            new_samples = np.frombuffer(chunk, dtype=np.int16, count=number_of_bytes // self.sample_width)
+            if sample_rate != self.sample_rate:
+                new_samples, upsample_state = ratecv(new_samples, sample_rate, self.sample_rate, upsample_state)
+            samples = np.concatenate((samples, new_samples))
+
+            position = 0
+            while len(samples) - position >= block_length:
+                vad_probability, denoised_block, downsample_state = self.__filter_block(samples[position:position+block_length], voice_prob_threshold,
+                                                                                        denoised_sample_rate, downsample_state)
+                position += block_length
+                if self.tracer is not None:
+                    self.tracer.add('emit', time.perf_counter(), stream=self.trace_name)
+                yield vad_probability, denoised_block
+            samples = samples[position:]
+
+        # The last incomplete frame is padded with zeros, as in filter()
+        if len(samples):
+            samples = np.concatenate((samples, np.zeros(-len(samples) % frame_length, dtype=np.int16)))
+            vad_probability, denoised_block, downsample_state = self.__filter_block(samples, voice_prob_threshold, denoised_sample_rate,
+                                                                                    downsample_state)
+            if self.tracer is not None:
+                self.tracer.add('emit', time.perf_counter(), stream=self.trace_name)
+            yield vad_probability, denoised_block
+
+
+    def __filter_block(self, samples, voice_prob_threshold, sample_rate, downsample_state):
+        ''' Denoising one block of iter_filter().
+        1. samples - np.ndarray with int16 samples at 48 kHz, the length is a multiple of the frame length
+        2. voice_prob_threshold - threshold for the probability of having a voice in each frame
+        3. sample_rate - sample rate of the denoised block
+        4. downsample_state - state of the resampling from the previous block
+        5. returns a tuple of the maximum probability of having a voice, a byte string with the denoised block and the new resampling state '''
+
+        frames = samples.reshape(-1, int(self.sample_rate * self.frame_duration_ms / 1000)).astype(ctypes.c_float)
+        vad_probabilities = self.__process_frames(frames)
+        denoised_frames = frames.astype(ctypes.c_short)
+
+        if voice_prob_threshold > 0.0:
+            denoised_frames = denoised_frames[vad_probabilities >= voice_prob_threshold]
+        denoised_samples = denoised_frames.reshape(-1)
+
+        if sample_rate != self.sample_rate:
+            denoised_samples, downsample_state = ratecv(denoised_samples, self.sample_rate, sample_rate, downsample_state)
+        return float(np.max(vad_probabilities)), denoised_samples.tobytes(), downsample_state
+
+
+    def filter_file(self, f_name_source, f_name_denoised, sample_rate=None, voice_prob_threshold=0.0, silence_floor_db=None, block_duration_ms=1000,
+                    f_name_ffmpeg='ffmpeg'):
+        ''' Denoising an audio file of any format supported by ffmpeg (mp3, opus, flac, etc.) with constant memory and without temporary files.
+
+        The file is decoded by a ffmpeg subprocess to 16 bit 48 kHz mono, its output is read in blocks of block_duration_ms and denoised with
+        the carried state of the neural network (as filter() for the whole audio), while ffmpeg decodes the next blocks on another core.
+        The denoised audio is written directly if f_name_denoised is a .wav file, otherwise it is piped to a ffmpeg encoder subprocess
+        (the format of the denoised audio is chosen by ffmpeg from the extension of f_name_denoised).
+
+        1. f_name_source - name of the source audio file
+        2. f_name_denoised - name of the file for the denoised audio
+        3. sample_rate - sample rate of the denoised audio (if None - 48 kHz)
+        4. voice_prob_threshold - threshold for the probability of having a voice in each frame (see filter())
+        5. silence_floor_db - energy floor of silence in dBFS (see filter(), runs of silent frames are searched within each block)
+        6. block_duration_ms - duration of blocks read from the decoder in milliseconds (a multiple of 10)
+        7. f_name_ffmpeg - name or path of the ffmpeg executable
+        8. returns the duration of the source audio in seconds '''
+
+        if block_duration_ms <= 0 or block_duration_ms % self.frame_duration_ms != 0:
+            raise ValueError("'block_duration_ms' must be a positive multiple of {}".format(self.frame_duration_ms))
+        sample_rate = sample_rate or self.sample_rate
+
+        frame_length = int(self.sample_rate * self.frame_duration_ms / 1000)
+        frame_width = frame_length * self.sample_width
+        block_size = frame_width * (block_duration_ms // self.frame_duration_ms)
+
+        try:
+            decoder = subprocess.Popen([f_name_ffmpeg, '-v', 'error', '-nostdin', '-i', f_name_source, '-f', 's16le', '-acodec', 'pcm_s16le',
+                                        '-ac', str(self.channels), '-ar', str(self.sample_rate), '-'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise FileNotFoundError("ffmpeg executable '{}' not found, install ffmpeg or pass its path in 'f_name_ffmpeg'".format(f_name_ffmpeg))
+        processes = [(decoder, collections.deque(maxlen=20))]
+        encoder = f_denoised = None
+        try:
+            if os.path.splitext(f_name_denoised)[1].lower() == '.wav':
+                f_denoised = WavWriter(f_name_denoised, sample_rate, self.channels, self.sample_width)
+                write = f_denoised.write
+            else:
+                encoder = subprocess.Popen([f_name_ffmpeg, '-v', 'error', '-y', '-f', 's16le', '-ac', str(self.channels), '-ar', str(sample_rate),
+                                            '-i', '-', f_name_denoised], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                processes.append((encoder, collections.deque(maxlen=20)))
+                write = encoder.stdin.write
+
+            drain_threads = [threading.Thread(target=_drain_stderr, args=(process, messages), daemon=True) for process, messages in processes]
+            for drain_thread in drain_threads:
+                drain_thread.start()
+
+            number_of_bytes = 0
+            downsample_state = None
+            pending = b''
+            is_finished = False
+            while not is_finished:
+                block = decoder.stdout.read(block_size)
+                number_of_bytes += len(block)
+                pending += block
+                is_finished = not block
+
+                # The last incomplete frame is padded with zeros, as in filter()
+                if is_finished and len(pending) % frame_width:
+                    pending += b'\x00' * (frame_width - len(pending) % frame_width)
+                number_of_frames = len(pending) // frame_width
+                if number_of_frames == 0:
+                    continue
+
+                frames = np.frombuffer(pending[:number_of_frames*frame_width], dtype=np.int16).reshape(-1, frame_length).astype(ctypes.c_float)
+                pending = pending[number_of_frames*frame_width:]
+
+                if silence_floor_db is None:
+                    vad_probabilities = self.__process_frames(frames)
+                else:
+                    vad_probabilities = self.__process_frames_skipping_silence(frames, silence_floor_db)
+                denoised_frames = frames.astype(ctypes.c_short)
+
+                if voice_prob_threshold > 0.0:
+                    denoised_frames = denoised_frames[vad_probabilities >= voice_prob_threshold]
+                denoised_samples = denoised_frames.reshape(-1)
+
+                if sample_rate != self.sample_rate:
+                    denoised_samples, downsample_state = ratecv(denoised_samples, self.sample_rate, sample_rate, downsample_state)
+                try:
+                    write(denoised_samples.astype('<i2', copy=False))
+                except BrokenPipeError:
+                    # The encoder has exited, its error is reported below
+                    decoder.kill()
+                    break
+
+            decoder.wait()
+            if f_denoised is not None:
+                f_denoised.close()
+                f_denoised = None
+            if encoder is not None:
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+                encoder.wait()
+            for drain_thread in drain_threads:
+                drain_thread.join()
+
+            # The encoder is checked first: if it fails, the decoder is killed
+            for process, messages in reversed(processes):
+                if process.returncode != 0:
+                    raise RuntimeError("ffmpeg failed to {} '{}' (exit code {}): {}".format('decode' if process is decoder else 'encode',
+                                       f_name_source if process is decoder else f_name_denoised, process.returncode, ' '.join(messages)))
+        finally:
+            if f_denoised is not None:
+                f_denoised.close()
+            for process, messages in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                for f_pipe in (process.stdin, process.stdout):
+                    if f_pipe is not None and not f_pipe.closed:
+                        try:
+                            f_pipe.close()
+                        except BrokenPipeError:
+                            pass
+
+        return number_of_bytes / self.sample_width / self.channels / self.sample_rate
+
+
+    def __filter_with_cache(self, audio, sample_rate=None, voice_prob_threshold=0.0, save_source_sample_rate=True, silence_floor_db=None,
+                            encoding='pcm'):
+        ''' Same as filter(), but the result is taken from self.cache if the same audio has already been denoised with the same model and
+        arguments. On a miss, the audio is denoised from the initial state of the neural network with a temporary RNNoise object in the library,
+        so the result depends only on the key and the streaming state in self.rnnoise_obj is not changed. '''
+
+        if isinstance(audio, AudioSegment):
+            audio_bytes, audio_sample_rate, audio_sample_width = audio.raw_data, audio.frame_rate, audio.sample_width
+        elif isinstance(audio, bytes):
+            if not sample_rate:
+                raise ValueError("when type(audio) = 'bytes', 'sample_rate' can not be None")
+            audio_bytes, audio_sample_rate, audio_sample_width = audio, sample_rate, self.sample_width
+        else:
+            raise TypeError("'audio' can only be AudioSegment or bytes")
+
+        key_hash = hashlib.sha256('{}:{}:{}:{!r}:{}:{!r}:{}:{}:'.format(self.__get_lib_hash(), audio_sample_rate, audio_sample_width,
+                                                                       float(voice_prob_threshold), bool(save_source_sample_rate), silence_floor_db,
+                                                                       self.silence_reprime_frames, encoding).encode('utf-8'))
+        key_hash.update(audio_bytes)
+        key = key_hash.hexdigest()
+
+        value = self.cache.get(key)
+        if value is not None:
+            denoised_sample_rate = struct.unpack('<I', value[:4])[0]
+            denoised_audio_bytes = value[4:]
+        else:
+            streaming_rnnoise_obj = self.rnnoise_obj
+            self.rnnoise_obj = self.rnnoise_lib.rnnoise_create(None)
+            try:
+                if encoding != 'pcm':
+                    denoised_audio_bytes = self.__filter_g711(audio, sample_rate, voice_prob_threshold, save_source_sample_rate, silence_floor_db,
+                                                              encoding)
+                    denoised_sample_rate = sample_rate if save_source_sample_rate else self.sample_rate
+                else:
+                    frames, source_sample_rate = self.__get_frames(audio, sample_rate)
+                    denoised_audio = self.__filter_frames(frames, voice_prob_threshold, source_sample_rate if save_source_sample_rate else None,
+                                                          silence_floor_db)
+                    denoised_sample_rate = denoised_audio.frame_rate
+                    denoised_audio_bytes = denoised_audio.raw_data
+            finally:
+                self.rnnoise_lib.rnnoise_destroy(self.rnnoise_obj)
+                self.rnnoise_obj = streaming_rnnoise_obj
+
+            self.cache.put(key, struct.pack('<I', denoised_sample_rate) + denoised_audio_bytes)
+
+        if isinstance(audio, AudioSegment):
+            return AudioSegment(data=denoised_audio_bytes, sample_width=self.sample_width, frame_rate=denoised_sample_rate, channels=self.channels)
+        else:
+            return denoised_audio_bytes
+
+
+    def __filter_frames(self, frames, voice_prob_threshold=0.0, sample_rate=None, silence_floor_db=None):
         ''' Clearing frames from noise. RNNoise is used for noise reduction.
 
         RNNoise additionally for each frame returns the probability of having a vote in this frame (as a number from 0 to 1) and
@@ -199,19 +918,151 @@ class RNNoise(object):
         1. frames - a list of frames with a length of 10 milliseconds
         2. voice_prob_threshold - threshold for the probability of having a voice in each frame (value from 0 to 1, if 0 - use all frames)
         3. sample_rate - the desired sampling rate of the cleared audio recording (if None - do not change the sampling rate)
-        4. returns a pydub.AudioSegment object with the denoised audio recording'''
+        4. silence_floor_db - energy floor of silence in dBFS (if None - all frames are passed through the neural network)
+        5. returns a pydub.AudioSegment object with the denoised audio recording'''
 
-        denoised_frames_with_probability = [self.filter_frame(frame) for frame in frames]
-        denoised_frames = [frame_with_prob[1] for frame_with_prob in denoised_frames_with_probability if frame_with_prob[0] >= voice_prob_threshold]
-        denoised_audio_bytes = b''.join(denoised_frames)
+        frame_length = int(self.sample_rate * self.frame_duration_ms / 1000)
+        frames = np.frombuffer(b''.join(frames), dtype=np.int16).reshape(-1, frame_length).astype(ctypes.c_float)
+        denoised_audio_bytes = self.__denoise_frames(frames, voice_prob_threshold, silence_floor_db).tobytes()
 
         denoised_audio = AudioSegment(data=denoised_audio_bytes, sample_width=self.sample_width, frame_rate=self.sample_rate, channels=self.channels)
 
         if sample_rate:
-            denoised_audio = denoised_audio.set_frame_rate(sample_rate)
+            denoised_audio = self.__trace_resample(denoised_audio, sample_rate)
         return denoised_audio
 
 
+    def __filter_g711(self, audio, sample_rate, voice_prob_threshold=0.0, save_source_sample_rate=True, silence_floor_db=None, encoding='ulaw'):
+        ''' Same as filter() for a byte string with G.711 audio: decoding with a lookup table, resampling to 48 kHz, denoising, resampling back
+        and encoding with a lookup table are performed in np.ndarray. The result is bit-exact with decoding by audioop, denoising 16 bit audio
+        with filter() and encoding by audioop.
+        1. audio - byte string with G.711 audio data
+        2. sample_rate - sample rate of audio
+        3. voice_prob_threshold, save_source_sample_rate, silence_floor_db - see filter()
+        4. encoding - 'ulaw' or 'alaw'
+        5. returns a byte string with the denoised G.711 audio '''
+
+        if not sample_rate:
+            raise ValueError("when type(audio) = 'bytes', 'sample_rate' can not be None")
+
+        samples = g711_decode(audio, encoding)
+        if sample_rate != self.sample_rate:
+            samples = ratecv(samples, sample_rate, self.sample_rate)[0]
+
+        frame_length = int(self.sample_rate * self.frame_duration_ms / 1000)
+        frames = np.zeros((-(-len(samples) // frame_length), frame_length), dtype=ctypes.c_float)
+        frames.reshape(-1)[:len(samples)] = samples
+        denoised_samples = self.__denoise_frames(frames, voice_prob_threshold, silence_floor_db)
+
+        if save_source_sample_rate and sample_rate != self.sample_rate:
+            denoised_samples = ratecv(denoised_samples, self.sample_rate, sample_rate)[0]
+        return g711_encode(denoised_samples, encoding).tobytes()
+
+
+    def __denoise_frames(self, frames, voice_prob_threshold=0.0, silence_floor_db=None):
+        ''' Denoising frames in place and converting them to 16 bit samples (frames with the probability of having a voice lower than
+        voice_prob_threshold are removed).
+        1. frames - np.ndarray with shape (number_of_frames, 480) and type float32 (samples in 16 bit range), C-contiguous
+        2. voice_prob_threshold, silence_floor_db - see filter()
+        3. returns np.ndarray with int16 samples of the denoised frames '''
+
+        if silence_floor_db is None:
+            vad_probabilities = self.__process_frames(frames)
+        else:
+            vad_probabilities = self.__process_frames_skipping_silence(frames, silence_floor_db)
+        denoised_frames = frames.astype(ctypes.c_short)
+
+        if voice_prob_threshold > 0.0:
+            denoised_frames = denoised_frames[vad_probabilities >= voice_prob_threshold]
+        return denoised_frames.reshape(-1)
+
+
+    def __process_frames(self, frames):
+        ''' Denoising frames in place with RNNoise (in one call of the native shim, if it is loaded).
+        1. frames - np.ndarray with shape (number_of_frames, 480) and type float32 (samples in 16 bit range), C-contiguous
+        2. returns np.ndarray with the probability of having a voice in each frame '''
+
+        frame_size = frames.shape[1] * frames.itemsize
+        address = frames.ctypes.data
+        vad_probabilities = np.zeros(len(frames), dtype=np.float32)
+        if self.tracer is not None:
+            return self.__process_frames_traced(frames, vad_probabilities)
+        if self.batch_lib is not None:
+            self.batch_lib.rnnoise_batch_process_frames(self.process_frame_address, self.rnnoise_obj, address, len(frames), frames.shape[1],
+                                                        vad_probabilities.ctypes.data)
+            return vad_probabilities
+
+        for i in range(len(frames)):
+            frame_ptr = ctypes.cast(address + i*frame_size, ctypes.POINTER(ctypes.c_float))
+            vad_probabilities[i] = self.rnnoise_lib.rnnoise_process_frame(self.rnnoise_obj, frame_ptr, frame_ptr)
+        return vad_probabilities
+
+
+    def __process_frames_traced(self, frames, vad_probabilities):
+        ''' The same as __process_frames(), but the native call for each frame is recorded in self.tracer as a 'native' event. It is a separate
+        loop so that the loop without tracing has no extra checks. '''
+
+        frame_size = frames.shape[1] * frames.itemsize
+        address = frames.ctypes.data
+        add_event = self.tracer.add
+        perf_counter = time.perf_counter
+        first_frame = self.number_of_traced_frames
+        for i in range(len(frames)):
+            frame_ptr = ctypes.cast(address + i*frame_size, ctypes.POINTER(ctypes.c_float))
+            start_time = perf_counter()
+            vad_probabilities[i] = self.rnnoise_lib.rnnoise_process_frame(self.rnnoise_obj, frame_ptr, frame_ptr)
+            add_event('native', start_time, perf_counter(), self.trace_name, first_frame + i)
+        self.number_of_traced_frames += len(frames)
+        return vad_probabilities
+
+
+    def __trace_resample(self, audio, sample_rate):
+        ''' pydub.AudioSegment.set_frame_rate() recorded in self.tracer as a 'resample' event (if there is a tracer).
+        1. audio - pydub.AudioSegment object
+        2. sample_rate - new sample rate
+        3. returns pydub.AudioSegment object '''
+
+        return self.__call_traced('resample', audio.set_frame_rate, sample_rate)
+
+
+    def __call_traced(self, name, function, *args):
+        ''' Calling function(*args), the call is recorded in self.tracer as an event with the given name (if there is a tracer). '''
+
+        if self.tracer is None:
+            return function(*args)
+        with self.tracer.span(name, self.trace_name):
+            return function(*args)
+
+
+    def __process_frames_skipping_silence(self, frames, silence_floor_db):
+        ''' Denoising frames in place with RNNoise, long runs of frames with energy below silence_floor_db are replaced by silence without
+        running the neural network. In each run, the first frame (its output contains the end of the previous frame due to overlap) and the last
+        self.silence_reprime_frames frames (to re-prime the state before the following audio) are processed as usual.
+        1. frames - np.ndarray with shape (number_of_frames, 480) and type float32 (samples in 16 bit range), C-contiguous
+        2. silence_floor_db - energy floor of silence in dBFS
+        3. returns np.ndarray with the probability of having a voice in each frame '''
+
+        energy_floor = 10 ** (silence_floor_db / 10) * 32768.0**2
+        is_silent = np.mean(np.square(frames, dtype=np.float64), axis=1) <= energy_floor
+
+        # Boundaries of runs of silent frames: starts[i] <= frame < ends[i]
+        boundaries = np.diff(np.concatenate(([0], is_silent.view(np.int8), [0])))
+        starts = np.flatnonzero(boundaries == 1)
+        ends = np.flatnonzero(boundaries == -1)
+
+        vad_probabilities = np.zeros(len(frames), dtype=np.float32)
+        position = 0
+        for start, end in zip(starts, ends):
+            skip_start, skip_end = start + 1, end - self.silence_reprime_frames
+            if skip_end <= skip_start:
+                continue
+            vad_probabilities[position:skip_start] = self.__process_frames(frames[position:skip_start])
+            frames[skip_start:skip_end] = 0.0
+            position = skip_end
+        vad_probabilities[position:] = self.__process_frames(frames[position:])
+        return vad_probabilities
+
+
     def __get_frames(self, audio, sample_rate=None):
         '''Get frames from an audio recording. Frames are byte strings of fixed length audio data.
         RNNoise only supports 10 millisecond frames.
@@ -227,7 +1078,7 @@ class RNNoise(object):
         if isinstance(audio, AudioSegment):
             sample_rate = source_sample_rate = audio.frame_rate
             if sample_rate != self.sample_rate:
-                audio = audio.set_frame_rate(self.sample_rate)
+                audio = self.__trace_resample(audio, self.sample_rate)
             audio_bytes = audio.raw_data
         elif isinstance(audio, bytes):
             if not sample_rate:
@@ -236,7 +1087,7 @@ class RNNoise(object):
             source_sample_rate = sample_rate
             if sample_rate != self.sample_rate:
                 audio = AudioSegment(data=audio_bytes, sample_width=self.sample_width, frame_rate=sample_rate, channels=self.channels)
-                audio = audio.set_frame_rate(self.sample_rate)
+                audio = self.__trace_resample(audio, self.sample_rate)
                 audio_bytes = audio.raw_data
         else:
             raise TypeError("'audio' can only be AudioSegment or bytes")
@@ -254,38 +1105,48 @@ class RNNoise(object):
         return frames, source_sample_rate
 
 
-    def read_wav(self, f_name_wav, sample_rate=None):
-        '''Download .wav audio recording. Only 2-byte/16-bit mono audio recordings are supported. If the parameters of the downloaded audio recording
-        different from those specified - it will be converted to the required format.
-        1. f_name_wav - name of the .wav audio recording or BytesIO
+    def read_wav(self, f_name_wav, sample_rate=None, channel=None):
+        '''Download .wav audio recording. 8, 16, 24, 32 bit int and 32, 64 bit float audio with any number of channels is supported: the header
+        is parsed and the audio is brought to 16 bit mono with the desired sample rate in one pass in np.ndarray (see
+        audio_utils.read_wav_samples(), the result is the same as conversions with pydub, except for rounding of resampled audio that is not
+        16 bit mono).
+        1. f_name_wav - name of the .wav audio recording, BytesIO or byte string with .wav audio
         2. sample_rate - the desired sampling rate (if None - do not change the sampling rate)
-        3. returns a pydub.AudioSegment object with an audio recording'''
+        3. channel - index of the channel to keep (if None - all channels are mixed down)
+        4. returns a pydub.AudioSegment object with an audio recording'''
 
-        if isinstance(f_name_wav, str) and f_name_wav.rfind('.wav') == -1:
-            raise ValueError("'f_name_wav' must contain the name .wav audio recording")
+        samples, _, source_sample_rate = read_wav_samples(self.__read_wav_data(f_name_wav), sample_rate, channel)
+        return AudioSegment(data=samples.tobytes(), sample_width=self.sample_width, frame_rate=sample_rate or source_sample_rate,
+                            channels=self.channels)
 
-        audio = AudioSegment.from_wav(f_name_wav)
 
-        if sample_rate:
-            audio = audio.set_frame_rate(sample_rate)
-        if audio.sample_width != self.sample_width:
-            audio = audio.set_sample_width(self.sample_width)
-        if audio.channels != self.channels:
-            audio = audio.set_channels(self.channels)
-        return audio
+    def __read_wav_data(self, f_name_wav):
+        ''' Contents of .wav audio for read_wav() and filter_wav().
+        1. f_name_wav - name of the .wav audio recording, file-like object with read() or byte string
+        2. returns a byte string (or the passed object with the buffer protocol) '''
+
+        if isinstance(f_name_wav, (bytes, bytearray, memoryview)):
+            return f_name_wav
+        if hasattr(f_name_wav, 'read'):
+            return f_name_wav.read()
+        if isinstance(f_name_wav, str) and f_name_wav.lower().rfind('.wav') == -1:
+            raise ValueError("'f_name_wav' must contain the name .wav audio recording")
+        with open(f_name_wav, 'rb') as f_wav:
+            return f_wav.read()
 
 
     def write_wav(self, f_name_wav, audio_data, sample_rate=None):
         '''Save .wav audio recording.
         1. f_name_wav - the name of the .wav audio recording where the audio recording or BytesIO will be saved
-        2. audio_data - pydub.AudioSegment object with audio recording or byte string with audio data (no wav header)
+        2. audio_data - pydub.AudioSegment object with audio recording or byte string (memoryview, np.ndarray with int16 samples) with audio data
+           (no wav header)
         3. sample_rate - audio sample rate:
             when audio_data is a byte string, must match the actual sample rate of the audio recording
             in other cases, the sampling rate will be reduced to the specified one (if None - do not change the sampling rate)'''
 
         if isinstance(audio_data, AudioSegment):
             self.write_wav_from_audiosegment(f_name_wav, audio_data, sample_rate)
-        elif isinstance(audio_data, bytes):
+        elif isinstance(audio_data, (bytes, bytearray, memoryview, np.ndarray)):
             if not sample_rate:
                 raise ValueError("when type(audio_data) = 'bytes', 'sample_rate' can not be None")
             self.write_wav_from_bytes(f_name_wav, audio_data, sample_rate)
@@ -303,21 +1164,279 @@ class RNNoise(object):
 
         if desired_sample_rate:
             audio = audio.set_frame_rate(desired_sample_rate)
-        audio.export(f_name_wav, format='wav')
+        with WavWriter(f_name_wav, audio.frame_rate, audio.channels, audio.sample_width, int(audio.frame_count())) as wav_writer:
+            wav_writer.write(audio.raw_data)
 
 
     def write_wav_from_bytes(self, f_name_wav, audio_bytes, sample_rate, desired_sample_rate=None):
         '''Save .wav audio recording.
         1. f_name_wav - the name of the .wav file where the audio recording or BytesIO will be saved
-        2. audio_bytes - byte string with audio recording (without wav headers)
+        2. audio_bytes - byte string, memoryview or np.ndarray with audio recording (without wav headers), written without copying
         3. sample_rate - sample rate
         4. desired_sample_rate - the desired sample rate (if None - do not change the sample rate)'''
 
-        audio = AudioSegment(data=audio_bytes, sample_width=self.sample_width, frame_rate=sample_rate, channels=self.channels)
         if desired_sample_rate and desired_sample_rate != sample_rate:
-            audio = audio.set_frame_rate(desired_sample_rate)
+            audio_bytes = ratecv(np.frombuffer(audio_bytes, dtype=np.int16), sample_rate, desired_sample_rate)[0]
+            sample_rate = desired_sample_rate
+
+        with WavWriter(f_name_wav, sample_rate, self.channels, self.sample_width) as wav_writer:
+            wav_writer.write(audio_bytes)
+
+
+
+
+class RNNoiseStream(object):
+    """Denoising of a continuous stream of raw PCM or G.711 audio (for example, from stdin) with constant memory. The state of the neural network
+    and of the resampling is carried between blocks, so the result is the same as for denoising the whole audio with RNNoise.filter():
+    - process(): denoise the next block of audio, returns the denoised audio available so far
+    - process_streams(): denoise the next block of each of several streams together (frames of all streams in one native call)
+    - flush(): denoise the remaining audio at the end of the stream (the last incomplete frame is padded with zeros)
+    - get_state(): snapshot of the stream state (to continue the stream in another process)
+    - set_state(): restore the stream state from a snapshot
+
+    The stream can also be pickled as a whole (the state of each channel is included, the tracer is dropped).
+
+    Audio is denoised with a delay of one frame (10 ms): output is returned as soon as a whole 10 ms frame has been received.
+    Each channel is denoised with its own RNNoise object. The probability of having a voice in the last denoised frame of each channel is
+    available in the vad_probabilities attribute. Decoding, resampling, denoising and encoding are performed on np.ndarray without intermediate
+    byte strings.
+
+    1. sample_rate - sample rate of the stream
+    2. channels - number of channels (samples are interleaved)
+    3. sample_format - format of samples: 's16le' (16 bit signed integer), 'f32le' (32 bit float in range [-1, 1]), 'ulaw' or 'alaw'
+       (G.711, 8 bit, for example 8 kHz telephony)
+    4. f_name_lib - path to the library (see RNNoise)
+    5. tracer - rnnoise_wrapper.FrameTracer object to record enqueue, resampling, native calls of RNNoise, flush and emit of the stream
+       (if None - nothing is recorded)
+    6. stream_name - name of the stream in recorded events, channels are named '<stream_name>:<channel>' (if None - 'stream')
+    """
+    sample_formats = {'s16le': '<i2', 'f32le': '<f4', 'ulaw': 'u1', 'alaw': 'u1'}
+
+    def __init__(self, sample_rate=48000, channels=1, sample_format='s16le', f_name_lib=None, tracer=None, stream_name=None):
+        if sample_format not in self.sample_formats:
+            raise ValueError("unsupported 'sample_format' '{}', supported: {}".format(sample_format, ', '.join(sorted(self.sample_formats))))
+        if channels < 1:
+            raise ValueError("'channels' must be at least 1")
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.sample_dtype = np.dtype(self.sample_formats[sample_format])
+
+        self.tracer = tracer
+        self.stream_name = stream_name or 'stream'
+        self.denoisers = [RNNoise(f_name_lib, tracer=tracer) for i in range(channels)]
+        for i, denoiser in enumerate(self.denoisers):
+            denoiser.trace_name = '{}:{}'.format(self.stream_name, i)
+            denoiser.pickle_state = True
+        self.frame_length = int(RNNoise.sample_rate * RNNoise.frame_duration_ms / 1000)
+
+        self.remainder = b''
+        self.buffers = [np.zeros(0, dtype=np.int16)] * channels
+        self.upsample_states = [None] * channels
+        self.downsample_states = [None] * channels
+        self.vad_probabilities = [0.0] * channels
+
+
+    def process(self, data):
+        ''' Denoising the next block of audio. The block can be of any length, incomplete frames and samples are kept until the next call.
+        1. data - byte string with raw audio in the stream format
+        2. returns a byte string with the denoised audio in the stream format (may be empty) '''
+
+        if self.tracer is not None:
+            self.tracer.add('enqueue', time.perf_counter(), stream=self.stream_name)
+
+        frames_of_channels = self.__get_frames(data)
+        for channel, frames in enumerate(frames_of_channels):
+            if len(frames):
+                self.vad_probabilities[channel] = float(self.denoisers[channel].filter_frames(frames)[-1])
+        return self.__emit(frames_of_channels)
+
+
+    @staticmethod
+    def process_streams(streams, blocks):
+        ''' Denoising the next block of each of several streams, the result is the same as of process() of each stream. Frames of all channels
+        of all streams are denoised together: the k-th new frame of every channel in one call of RNNoise.filter_frames_of_streams() (one native
+        call with the native shim), so many concurrent streams with short blocks do not pay a ctypes call per frame of each stream.
+        1. streams - list of RNNoiseStream objects (each stream can be passed only once)
+        2. blocks - list of byte strings with raw audio in the format of each stream
+        3. returns a list of byte strings with the denoised audio of each stream '''
+
+        if len(set(id(stream) for stream in streams)) != len(streams):
+            raise ValueError("each stream can be passed to 'streams' only once")
+
+        for stream in streams:
+            if stream.tracer is not None:
+                stream.tracer.add('enqueue', time.perf_counter(), stream=stream.stream_name)
+        frames_of_streams = [stream.__get_frames(data) for stream, data in zip(streams, blocks)]
+
+        # Pairs of (stream, channel) with new frames, the longest first, so that the pairs with the k-th frame are always a prefix
+        pairs = [(stream, channel, frames) for stream, frames_of_channels in zip(streams, frames_of_streams)
+                 for channel, frames in enumerate(frames_of_channels) if len(frames)]
+        pairs.sort(key=lambda pair: -len(pair[2]))
+        if pairs:
+            numbers_of_frames = np.array([len(frames) for stream, channel, frames in pairs])
+            all_frames = np.zeros((len(pairs), numbers_of_frames[0], pairs[0][0].frame_length), dtype=ctypes.c_float)
+            for i, (stream, channel, frames) in enumerate(pairs):
+                all_frames[i, :len(frames)] = frames
+
+            denoisers = [stream.denoisers[channel] for stream, channel, frames in pairs]
+            vad_probabilities = np.zeros(len(pairs), dtype=np.float32)
+            for k in range(numbers_of_frames[0]):
+                number_of_pairs = int(np.count_nonzero(numbers_of_frames > k))
+                frames_k = np.ascontiguousarray(all_frames[:number_of_pairs, k])
+                vad_probabilities[:number_of_pairs] = RNNoise.filter_frames_of_streams(denoisers[:number_of_pairs], frames_k)
+                all_frames[:number_of_pairs, k] = frames_k
+
+            for i, (stream, channel, frames) in enumerate(pairs):
+                frames[:] = all_frames[i, :len(frames)]
+                stream.vad_probabilities[channel] = float(vad_probabilities[i])
+
+        return [stream.__emit(frames_of_channels) for stream, frames_of_channels in zip(streams, frames_of_streams)]
+
+
+    def flush(self):
+        ''' Denoising the remaining audio at the end of the stream. The last incomplete frame is padded with zeros, but only the denoised samples
+        that correspond to the received audio are returned. After that the stream can be reused for a new audio.
+        1. returns a byte string with the denoised audio in the stream format '''
+
+        start_time = time.perf_counter()
+        denoised_channels = []
+        for i in range(self.channels):
+            number_of_samples = len(self.buffers[i])
+            denoised_samples = np.zeros(0, dtype=np.int16)
+            if number_of_samples:
+                frames = np.zeros((1, self.frame_length), dtype=ctypes.c_float)
+                frames[0, :number_of_samples] = self.buffers[i]
+                self.vad_probabilities[i] = float(self.denoisers[i].filter_frames(frames)[-1])
+                denoised_samples = frames[0, :number_of_samples].astype(ctypes.c_short)
+                if self.sample_rate != RNNoise.sample_rate:
+                    denoised_samples, self.downsample_states[i] = self.__resample(i, denoised_samples, RNNoise.sample_rate, self.sample_rate,
+                                                                                  self.downsample_states[i])
+            denoised_channels.append(denoised_samples)
+
+        self.remainder = b''
+        self.buffers = [np.zeros(0, dtype=np.int16)] * self.channels
+        self.upsample_states = [None] * self.channels
+        self.downsample_states = [None] * self.channels
+        denoised_data = self.__join_channels(denoised_channels)
+
+        if self.tracer is not None:
+            self.tracer.add('flush', start_time, time.perf_counter(), self.stream_name)
+        return denoised_data
+
+
+    def __getstate__(self):
+        ''' Pickling the stream with the states of its RNNoise objects, the tracer is not pickled. '''
+
+        state = dict(self.__dict__)
+        state['tracer'] = None
+        return state
+
+
+    def get_state(self):
+        ''' Snapshot of the stream state: native states of RNNoise for each channel, buffered audio and states of resampling. Can be serialized
+        (for example, with pickle) to continue the stream in another process with the same model.
+        1. returns a dict with the state '''
+
+        return {'sample_rate': self.sample_rate, 'channels': self.channels, 'sample_format': self.sample_format,
+                'remainder': self.remainder, 'buffers': [buffer.tobytes() for buffer in self.buffers], 'upsample_states': list(self.upsample_states),
+                'downsample_states': list(self.downsample_states), 'vad_probabilities': list(self.vad_probabilities),
+                'native_states': [denoiser.get_state() for denoiser in self.denoisers]}
+
+
+    def set_state(self, state):
+        ''' Restore the stream state from a snapshot made by get_state().
+        1. state - dict from get_state() of a stream with the same sample rate, number of channels and sample format '''
+
+        if (state['sample_rate'], state['channels'], state['sample_format']) != (self.sample_rate, self.channels, self.sample_format):
+            raise ValueError("'state' was made for a stream with different parameters: {} Hz, {} channel(-s), {}".format(
+                             state['sample_rate'], state['channels'], state['sample_format']))
+
+        for denoiser, native_state in zip(self.denoisers, state['native_states']):
+            denoiser.set_state(native_state)
+        self.remainder = state['remainder']
+        self.buffers = [np.frombuffer(buffer, dtype=np.int16).copy() for buffer in state['buffers']]
+        self.upsample_states = list(state['upsample_states'])
+        self.downsample_states = list(state['downsample_states'])
+        self.vad_probabilities = list(state.get('vad_probabilities', [0.0] * self.channels))
+
+
+    def __decode(self, samples):
+        ''' Converting samples in the stream format to int16. '''
+
+        if self.sample_format == 'f32le':
+            return np.clip(np.round(samples * 32768.0), -32768, 32767).astype(np.int16)
+        if self.sample_format in G711_ENCODINGS:
+            return g711_decode(samples, self.sample_format)
+        return samples.astype(np.int16)
+
+
+    def __get_frames(self, data):
+        ''' Decoding the next block, resampling each channel to 48 kHz and splitting it into complete frames (the rest is kept in buffers).
+        1. data - byte string with raw audio in the stream format
+        2. returns a list with np.ndarray of frames (float32, shape (number_of_frames, 480)) for each channel '''
+
+        data = self.remainder + data
+        block_width = self.sample_dtype.itemsize * self.channels
+        tail_length = len(data) % block_width
+        self.remainder = data[len(data)-tail_length:] if tail_length else b''
+        samples = self.__decode(np.frombuffer(data[:len(data)-tail_length], dtype=self.sample_dtype).reshape(-1, self.channels))
+
+        frames_of_channels = []
+        for channel in range(self.channels):
+            channel_samples = samples[:, channel]
+            if self.sample_rate != RNNoise.sample_rate:
+                channel_samples, self.upsample_states[channel] = self.__resample(channel, channel_samples, self.sample_rate, RNNoise.sample_rate,
+                                                                                 self.upsample_states[channel])
+            channel_samples = np.concatenate((self.buffers[channel], channel_samples))
+
+            number_of_frames = len(channel_samples) // self.frame_length
+            self.buffers[channel] = channel_samples[number_of_frames*self.frame_length:].copy()
+            frames = channel_samples[:number_of_frames*self.frame_length].reshape(number_of_frames, self.frame_length)
+            frames_of_channels.append(frames.astype(ctypes.c_float))
+        return frames_of_channels
+
+
+    def __emit(self, frames_of_channels):
+        ''' Resampling denoised frames of each channel back to the stream sample rate and converting them to the stream format.
+        1. frames_of_channels - list from __get_frames() with denoised frames
+        2. returns a byte string with the denoised audio in the stream format '''
+
+        denoised_channels = []
+        for channel, frames in enumerate(frames_of_channels):
+            denoised_samples = frames.astype(ctypes.c_short).reshape(-1)
+            if len(frames) and self.sample_rate != RNNoise.sample_rate:
+                denoised_samples, self.downsample_states[channel] = self.__resample(channel, denoised_samples, RNNoise.sample_rate,
+                                                                                    self.sample_rate, self.downsample_states[channel])
+            denoised_channels.append(denoised_samples)
+        denoised_data = self.__join_channels(denoised_channels)
+
+        if self.tracer is not None:
+            self.tracer.add('emit', time.perf_counter(), stream=self.stream_name)
+        return denoised_data
+
+
+    def __resample(self, channel, samples, in_rate, out_rate, state):
+        ''' ratecv() of one channel, recorded as a 'resample' event if there is a tracer. '''
+
+        if self.tracer is None:
+            return ratecv(samples, in_rate, out_rate, state)
+        with self.tracer.span('resample', self.denoisers[channel].trace_name):
+            return ratecv(samples, in_rate, out_rate, state)
+
+
+    def __join_channels(self, denoised_channels):
+        ''' Interleaving denoised channels and converting them to the stream format. '''
+
+        length = min(len(denoised_samples) for denoised_samples in denoised_channels)
+        samples = np.stack([denoised_samples[:length] for denoised_samples in denoised_channels], axis=1)
 
-        audio.export(f_name_wav, format='wav')
+        if self.sample_format == 'f32le':
+            return (samples / 32768.0).astype(self.sample_dtype).tobytes()
+        if self.sample_format in G711_ENCODINGS:
+            return g711_encode(samples, self.sample_format).tobytes()
+        return samples.astype(self.sample_dtype).tobytes()
 
 
 
@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Deadline-aware scheduler for many real-time streams on a fixed number of worker threads.
+
+Each pushed 10 ms block of a stream gets a deadline (arrival time plus the latency budget of the stream). Worker threads always take the block
+with the earliest deadline among all streams (earliest deadline first), blocks of one stream are processed strictly in order. ctypes releases
+the GIL while RNNoise is running, so worker threads run in parallel.
+
+Under overload, when a block of a low-priority stream can no longer be denoised before its deadline, it is processed by the degradation policy
+instead of the neural network:
+    - 'passthrough' - the original audio is returned
+    - 'vad_only' - the original audio is returned if the last voice probability of the stream is not lower than vad_threshold, else silence
+    - 'silence' - silence is returned
+    - 'none' - no degradation, all blocks are denoised (even late)
+Blocks of streams with a priority higher than low_priority are never degraded. Lateness of each stream is available in get_metrics().
+
+Contains the RealtimeScheduler and ScheduledStream classes.
+'''
+
+import time
+import heapq
+import queue
+import threading
+import collections
+import multiprocessing
+import numpy as np
+
+from .rnnoise_wrapper import RNNoiseStream
+from .audio_utils import G711_ENCODINGS, g711_encode
+from .cpu_affinity import get_cpu_layout, pin_current_worker, limit_library_threads, get_current_cpus
+from .host_profile import get_model_settings
+
+
+class _Block(object):
+    __slots__ = ('data', 'arrival_time', 'deadline')
+
+    def __init__(self, data, arrival_time, deadline):
+        self.data = data
+        self.arrival_time = arrival_time
+        self.deadline = deadline
+
+
+class ScheduledStream(object):
+    """Stream of RealtimeScheduler (created with RealtimeScheduler.add_stream()):
+    - push(): submit the next block of raw audio (usually 10 ms)
+    - get(): get the next result (if the stream was created without callback)
+    - close(): remove the stream from the scheduler
+
+    Results are tuples (denoised_data, vad_probability, is_degraded), where vad_probability is the last voice probability of the stream.
+    """
+
+    def __init__(self, scheduler, stream_id, stream, priority, latency_budget_ms, callback):
+        self.scheduler = scheduler
+        self.stream_id = stream_id
+        self.stream = stream
+        self.priority = priority
+        self.latency_budget = latency_budget_ms / 1000
+        self.callback = callback
+        self.results = queue.Queue() if callback is None else None
+
+        self.pending = collections.deque()
+        self.is_busy = False
+        self.is_closed = False
+
+        self.lateness_ms = collections.deque(maxlen=1000)
+        self.counters = {'blocks_total': 0, 'blocks_denoised': 0, 'blocks_degraded': 0, 'blocks_late': 0, 'max_lateness_ms': 0.0}
+
+
+    def push(self, data):
+        ''' Submitting the next block of raw PCM in the stream format. Its deadline is the current time plus the latency budget of the stream. '''
+
+        arrival_time = time.time()
+        self.scheduler._submit(self, _Block(data, arrival_time, arrival_time + self.latency_budget))
+
+
+    def get(self, timeout=None):
+        ''' Getting the next result (only for streams without callback).
+        1. timeout - maximum waiting time in seconds (if None - wait without limit)
+        2. returns a tuple of denoised data, last voice probability and a flag of degraded processing (raises queue.Empty on timeout) '''
+
+        return self.results.get(timeout=timeout)
+
+
+    def close(self):
+        self.scheduler.remove_stream(self)
+
+
+    def get_metrics(self):
+        ''' Metrics of the stream: numbers of blocks (total, denoised, degraded, late) and lateness (finish time minus deadline) in ms. '''
+
+        metrics = dict(self.counters)
+        metrics['priority'] = self.priority
+        metrics['pending_blocks'] = len(self.pending)
+        lateness_ms = np.array(self.lateness_ms)
+        metrics['mean_lateness_ms'] = float(np.mean(lateness_ms)) if len(lateness_ms) else 0.0
+        metrics['p99_lateness_ms'] = float(np.percentile(lateness_ms, 99)) if len(lateness_ms) else 0.0
+        return metrics
+
+
+class RealtimeScheduler(object):
+    """Earliest-deadline-first scheduler of 10 ms blocks of many streams on a fixed number of worker threads (see the module description):
+    - add_stream(): add a stream with its own RNNoise state, priority and latency budget
+    - remove_stream(): remove a stream
+    - start(), shutdown(): start and stop worker threads
+    - get_metrics(): metrics of all streams and of the scheduler
+
+    1. workers - number of worker threads (if None - from the host profile made by rnnoise_wrapper.autotune, else number of CPU cores)
+    2. f_name_lib - path to the library (see RNNoise)
+    3. degradation_policy - 'passthrough', 'vad_only', 'silence' or 'none'
+    4. low_priority - streams with priority not higher than this value are degraded under overload
+    5. vad_threshold - voice probability threshold for the 'vad_only' policy
+    6. cpus - list of cores for worker threads, one core per worker (string like '0-3,8' or an iterable of numbers, if None - not pinned)
+    7. numa - True: spread worker threads over NUMA nodes, each worker is pinned to the cores of its node (only the computation is placed:
+       RNNoise objects of a stream are created by the thread that calls add_stream(), and any worker processes any stream, so their memory is
+       not placed on the node of the worker)
+    """
+    degradation_policies = ('passthrough', 'vad_only', 'silence', 'none')
+
+    def __init__(self, workers=None, f_name_lib=None, degradation_policy='passthrough', low_priority=0, vad_threshold=0.5, cpus=None, numa=False):
+        if degradation_policy not in self.degradation_policies:
+            raise ValueError("unsupported 'degradation_policy' '{}', supported: {}".format(degradation_policy, ', '.join(self.degradation_policies)))
+
+        self.workers = workers or get_model_settings(f_name_lib).get('threads') or multiprocessing.cpu_count()
+        self.f_name_lib = f_name_lib
+        self.degradation_policy = degradation_policy
+        self.low_priority = low_priority
+        self.vad_threshold = vad_threshold
+        self.cpu_layout = get_cpu_layout(self.workers, cpus, numa)
+
+        self.condition = threading.Condition()
+        self.ready_streams = []
+        self.sequence_number = 0
+        self.streams = {}
+        self.threads = []
+        self.worker_metrics = []
+        self.is_running = False
+
+        # Exponential moving average of the time of denoising one block, used to predict whether a block will finish before its deadline
+        self.block_time_estimate = 0.0
+
+
+    def add_stream(self, stream_id, sample_rate=48000, channels=1, sample_format='s16le', priority=1, latency_budget_ms=10.0, callback=None):
+        ''' Adding a stream.
+        1. stream_id - identifier of the stream (used in metrics)
+        2. sample_rate - sample rate of the stream
+        3. channels - number of channels
+        4. sample_format - 's16le', 'f32le', 'ulaw' or 'alaw'
+        5. priority - priority of the stream (streams with priority not higher than low_priority can be degraded)
+        6. latency_budget_ms - time from pushing a block to its deadline in milliseconds
+        7. callback - function callback(stream_id, denoised_data, vad_probability, is_degraded) called by a worker thread for each result
+           in the order of blocks (if None - results are taken with ScheduledStream.get())
+        8. returns ScheduledStream object '''
+
+        stream = ScheduledStream(self, stream_id, RNNoiseStream(sample_rate, channels, sample_format, self.f_name_lib), priority,
+                                 latency_budget_ms, callback)
+        with self.condition:
+            if stream_id in self.streams:
+                raise ValueError("stream '{}' already exists".format(stream_id))
+            self.streams[stream_id] = stream
+        return stream
+
+
+    def remove_stream(self, stream):
+        with self.condition:
+            stream.is_closed = True
+            stream.pending.clear()
+            self.streams.pop(stream.stream_id, None)
+
+
+    def start(self):
+        limit_library_threads(1)
+        self.is_running = True
+        self.worker_metrics = [{'cpus': None, 'blocks': 0, 'busy_time_s': 0.0, 'audio_seconds': 0.0} for i in range(self.workers)]
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.__worker_loop, args=(i,), name='rnnoise_edf_worker_{}'.format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def shutdown(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+    def _submit(self, stream, block):
+        with self.condition:
+            if stream.is_closed:
+                raise ValueError("stream '{}' is closed".format(stream.stream_id))
+            stream.pending.append(block)
+            if not stream.is_busy and len(stream.pending) == 1:
+                self.__make_ready(stream)
+            self.condition.notify()
+
+
+    def __make_ready(self, stream):
+        ''' Putting the stream in the queue of ready streams by the deadline of its first pending block (the condition must be held). '''
+
+        self.sequence_number += 1
+        heapq.heappush(self.ready_streams, (stream.pending[0].deadline, self.sequence_number, stream))
+
+
+    def __worker_loop(self, worker_index):
+        worker_metrics = self.worker_metrics[worker_index]
+        if self.cpu_layout is not None and pin_current_worker(self.cpu_layout[worker_index]):
+            worker_metrics['cpus'] = get_current_cpus()
+
+        while True:
+            with self.condition:
+                while self.is_running and not self.ready_streams:
+                    self.condition.wait()
+                if not self.is_running:
+                    return
+                deadline, sequence_number, stream = heapq.heappop(self.ready_streams)
+                if stream.is_closed or not stream.pending:
+                    continue
+                block = stream.pending.popleft()
+                stream.is_busy = True
+                block_time_estimate = self.block_time_estimate
+
+            start_time = time.time()
+            is_degraded = self.degradation_policy != 'none' and stream.priority <= self.low_priority and \
+                          start_time + block_time_estimate > block.deadline
+            if is_degraded:
+                denoised_data = self.__degrade(stream, block.data)
+            else:
+                denoised_data = stream.stream.process(block.data)
+            finish_time = time.time()
+            lateness_ms = (finish_time - block.deadline) * 1000
+
+            # The result is delivered while the stream is still busy, so that no other worker can deliver the next block of the stream before it
+            result = (denoised_data, max(stream.stream.vad_probabilities), is_degraded)
+            if stream.callback is not None:
+                stream.callback(stream.stream_id, *result)
+            else:
+                stream.results.put(result)
+
+            with self.condition:
+                if not is_degraded:
+                    self.block_time_estimate = 0.9 * self.block_time_estimate + 0.1 * (finish_time - start_time)
+                worker_metrics['blocks'] += 1
+                worker_metrics['busy_time_s'] += finish_time - start_time
+                worker_metrics['audio_seconds'] += len(block.data) / (stream.stream.channels * stream.stream.sample_dtype.itemsize *
+                                                                      stream.stream.sample_rate)
+                stream.counters['blocks_total'] += 1
+                stream.counters['blocks_degraded' if is_degraded else 'blocks_denoised'] += 1
+                if lateness_ms > 0:
+                    stream.counters['blocks_late'] += 1
+                stream.counters['max_lateness_ms'] = max(stream.counters['max_lateness_ms'], lateness_ms)
+                stream.lateness_ms.append(lateness_ms)
+
+                stream.is_busy = False
+                if stream.pending and not stream.is_closed:
+                    self.__make_ready(stream)
+                    self.condition.notify()
+
+
+    def __degrade(self, stream, data):
+        ''' Processing a block without the neural network according to the degradation policy. '''
+
+        if self.degradation_policy == 'passthrough':
+            return data
+        if self.degradation_policy == 'vad_only' and max(stream.stream.vad_probabilities) >= self.vad_threshold:
+            return data
+        if stream.stream.sample_format in G711_ENCODINGS:
+            return g711_encode(np.zeros(len(data), dtype=np.int16), stream.stream.sample_format).tobytes()
+        return b'\x00' * len(data)
+
+
+    def get_metrics(self):
+        ''' Metrics of the scheduler and all streams.
+        1. returns a dict with the number of ready streams, estimated time of denoising one block, a list of metrics of each worker thread
+           (its cores, numbers of blocks, busy time and throughput in seconds of audio per busy second) and a dict of metrics of each stream '''
+
+        with self.condition:
+            streams = list(self.streams.values())
+            metrics = {'ready_streams': len(self.ready_streams), 'block_time_estimate_ms': self.block_time_estimate * 1000}
+            metrics['workers'] = [dict(worker_metrics) for worker_metrics in self.worker_metrics]
+        for worker_metrics in metrics['workers']:
+            busy_time = worker_metrics['busy_time_s']
+            worker_metrics['throughput_rt'] = worker_metrics['audio_seconds'] / busy_time if busy_time else 0.0
+        metrics['streams'] = {stream.stream_id: stream.get_metrics() for stream in streams}
+        return metrics
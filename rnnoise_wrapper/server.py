@@ -0,0 +1,522 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Local denoising server for rnnoise_wrapper.RNNoise() without external dependencies (only the standard library).
+
+Supports:
+    - HTTP: POST /denoise with .wav audio in the body returns denoised .wav audio (optional query argument silence_floor_db),
+      GET /health and GET /metrics return JSON
+    - TCP: framed protocol for streams. Each message is a 4 byte big-endian length followed by the payload. The first message from the client is
+      a JSON config {"sample_rate": 16000, "channels": 1, "sample_format": "s16le"}, the server replies with JSON {"status": "ok"} (or
+      {"status": "error", "message": "..."}). After that, each message with raw PCM is answered with a message with the denoised PCM available
+      so far (may be empty). An empty message ends the stream: the server replies with the rest of the denoised audio and an empty message.
+
+Blocks of concurrent streams are put in one bounded queue, worker threads take all blocks that have arrived during a short window and process
+them in one tick: frames of all streams of the tick are denoised together with RNNoiseStream.process_streams(), the k-th frame of every stream in
+one native call (with the native shim). ctypes releases the GIL while RNNoise is running, so worker threads run in parallel.
+
+Contains the DenoiseServer and DenoiseStreamClient classes.
+'''
+
+import io
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import collections
+import socketserver
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from .rnnoise_wrapper import RNNoise, RNNoiseStream
+from .cpu_affinity import get_cpu_layout, pin_current_worker, limit_library_threads, get_current_cpus
+from .host_profile import get_model_settings
+
+
+def _recv_exact(sock, size):
+    ''' Receiving exactly size bytes from socket. Returns None if the connection has been closed. '''
+
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    ''' Receiving one message of the framed protocol. Returns None if the connection has been closed. '''
+
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    return _recv_exact(sock, struct.unpack('>I', header)[0])
+
+
+def send_message(sock, payload):
+    ''' Sending one message of the framed protocol. '''
+
+    sock.sendall(struct.pack('>I', len(payload)) + payload)
+
+
+class _StreamJob(object):
+    ''' One block of a stream waiting for processing by the scheduler. If data is None - flush the stream. '''
+
+    __slots__ = ('stream', 'data', 'done', 'result', 'error', 'enqueue_time')
+
+    def __init__(self, stream, data):
+        self.stream = stream
+        self.data = data
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueue_time = time.time()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    ''' HTTP API: POST /denoise, GET /health, GET /metrics. '''
+
+    def do_GET(self):
+        denoise_server = self.server.denoise_server
+        path = urlparse(self.path).path
+        if path == '/health':
+            self.__send_json(200, {'status': 'ok' if denoise_server.is_running else 'stopping'})
+        elif path == '/metrics':
+            self.__send_json(200, denoise_server.get_metrics())
+        else:
+            self.__send_json(404, {'status': 'error', 'message': "unknown path '{}'".format(path)})
+
+
+    def do_POST(self):
+        denoise_server = self.server.denoise_server
+        url = urlparse(self.path)
+        if url.path != '/denoise':
+            self.__send_json(404, {'status': 'error', 'message': "unknown path '{}'".format(url.path)})
+            return
+
+        try:
+            query = parse_qs(url.query)
+            silence_floor_db = float(query['silence_floor_db'][0]) if 'silence_floor_db' in query else None
+            audio_wav = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            denoised_audio_wav = denoise_server.denoise_file(audio_wav, silence_floor_db)
+        except OverflowError as e:
+            self.__send_json(503, {'status': 'error', 'message': str(e)})
+            return
+        except Exception as e:
+            self.__send_json(400, {'status': 'error', 'message': '{}: {}'.format(type(e).__name__, e)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Content-Length', str(len(denoised_audio_wav)))
+        self.end_headers()
+        self.wfile.write(denoised_audio_wav)
+
+
+    def __send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StreamHandler(socketserver.BaseRequestHandler):
+    ''' Framed TCP protocol for streams (see the module description). '''
+
+    def handle(self):
+        denoise_server = self.server.denoise_server
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        config = recv_message(sock)
+        if config is None:
+            return
+        try:
+            config = json.loads(config.decode('utf-8'))
+            stream = denoise_server.open_stream(config.get('sample_rate', 48000), config.get('channels', 1), config.get('sample_format', 's16le'))
+        except Exception as e:
+            send_message(sock, json.dumps({'status': 'error', 'message': '{}: {}'.format(type(e).__name__, e)}).encode('utf-8'))
+            return
+        send_message(sock, json.dumps({'status': 'ok'}).encode('utf-8'))
+
+        try:
+            while True:
+                data = recv_message(sock)
+                if data is None:
+                    break
+                if not data:
+                    send_message(sock, denoise_server.process_stream(stream, None))
+                    send_message(sock, b'')
+                    break
+                send_message(sock, denoise_server.process_stream(stream, data))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            denoise_server.close_stream(stream)
+
+
+class DenoiseServer(object):
+    """Local denoising server with HTTP API for whole audio and framed TCP protocol for streams (see the module description):
+    - start(): start the servers and worker threads in background threads
+    - serve_forever(): start and wait until KeyboardInterrupt
+    - shutdown(): stop the servers and worker threads
+    - denoise_file(): denoise .wav audio (used by HTTP API)
+    - open_stream(), process_stream(), close_stream(): work with streams (used by TCP protocol)
+    - get_metrics(): counters, queue sizes and latency percentiles
+
+    1. f_name_lib - path to the library (see RNNoise)
+    2. host - host for both servers
+    3. http_port - port of HTTP server (if None - HTTP server is not started)
+    4. tcp_port - port of TCP server for streams (if None - TCP server is not started)
+    5. workers - number of worker threads for streams and size of the pool of RNNoise objects for whole audio (if None - from the host profile
+       made by rnnoise_wrapper.autotune, else 4)
+    6. max_queue_size - maximum number of stream blocks waiting for processing and of whole audio being processed or waiting
+       (when exceeded, stream clients wait and HTTP requests get 503)
+    7. max_streams - maximum number of concurrent streams
+    8. batch_window_ms - how long a worker waits for blocks of other streams to denoise them together in the same tick (if 0 - a tick takes
+       only the blocks that are already in the queue)
+    9. max_batch_size - maximum number of stream blocks in one tick (if None - from the host profile, else 64)
+    10. cpus - list of cores for worker threads, one core per worker (string like '0-3,8' or an iterable of numbers, if None - not pinned)
+    11. numa - True: spread worker threads over NUMA nodes, each worker is pinned to the cores of its node (only the computation is placed:
+        RNNoise objects are created by the thread that opens a stream or in the constructor, and any worker processes any stream, so their
+        memory is not placed on the node of the worker)
+    """
+
+    def __init__(self, f_name_lib=None, host='127.0.0.1', http_port=8080, tcp_port=8081, workers=None, max_queue_size=256, max_streams=256,
+                 batch_window_ms=1.0, max_batch_size=None, cpus=None, numa=False):
+        settings = get_model_settings(f_name_lib)
+        self.f_name_lib = f_name_lib
+        self.host = host
+        self.http_port = http_port
+        self.tcp_port = tcp_port
+        self.workers = workers or settings.get('threads', 4)
+        self.max_streams = max_streams
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size or settings.get('max_batch_size', 64)
+        self.cpu_layout = get_cpu_layout(self.workers, cpus, numa)
+
+        self.jobs = queue.Queue(max_queue_size)
+        self.file_slots = threading.BoundedSemaphore(max_queue_size)
+        self.denoisers = queue.Queue()
+        for i in range(self.workers):
+            self.denoisers.put(RNNoise(f_name_lib))
+
+        self.lock = threading.Lock()
+        self.latencies_ms = collections.deque(maxlen=10000)
+        self.counters = {'files_total': 0, 'files_rejected': 0, 'files_failed': 0, 'streams_total': 0, 'streams_rejected': 0, 'streams_active': 0,
+                         'stream_blocks_total': 0, 'ticks_total': 0, 'audio_seconds_total': 0.0}
+        self.start_time = None
+        self.is_running = False
+        self.threads = []
+        self.worker_metrics = []
+        self.http_server = None
+        self.tcp_server = None
+
+
+    def start(self):
+        ''' Starting HTTP and TCP servers and worker threads in background threads. '''
+
+        limit_library_threads(1)
+        self.is_running = True
+        self.start_time = time.time()
+        self.worker_metrics = [{'cpus': None, 'ticks': 0, 'busy_time_s': 0.0, 'audio_seconds': 0.0} for i in range(self.workers)]
+        for i in range(self.workers):
+            self.threads.append(threading.Thread(target=self.__worker_loop, args=(i,), name='rnnoise_worker_{}'.format(i), daemon=True))
+
+        if self.http_port is not None:
+            self.http_server = _ThreadingHTTPServer((self.host, self.http_port), _HTTPHandler)
+            self.http_server.denoise_server = self
+            self.http_port = self.http_server.server_address[1]
+            self.threads.append(threading.Thread(target=self.http_server.serve_forever, name='rnnoise_http', daemon=True))
+        if self.tcp_port is not None:
+            self.tcp_server = _ThreadingTCPServer((self.host, self.tcp_port), _StreamHandler)
+            self.tcp_server.denoise_server = self
+            self.tcp_port = self.tcp_server.server_address[1]
+            self.threads.append(threading.Thread(target=self.tcp_server.serve_forever, name='rnnoise_tcp', daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+
+    def serve_forever(self):
+        ''' Starting the servers and waiting until KeyboardInterrupt. '''
+
+        self.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+
+    def shutdown(self):
+        ''' Stopping the servers and worker threads. '''
+
+        self.is_running = False
+        for server in [self.http_server, self.tcp_server]:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+    def denoise_file(self, audio_wav, silence_floor_db=None):
+        ''' Denoising whole .wav audio with one of the RNNoise objects from the pool (from the initial state).
+        1. audio_wav - byte string with .wav audio
+        2. silence_floor_db - energy floor of silence in dBFS (see RNNoise.filter())
+        3. returns a byte string with denoised .wav audio
+        Raises OverflowError if the admission queue is full. '''
+
+        if not self.file_slots.acquire(blocking=False):
+            with self.lock:
+                self.counters['files_rejected'] += 1
+            raise OverflowError('admission queue is full')
+
+        start_time = time.time()
+        try:
+            denoiser = self.denoisers.get()
+            try:
+                denoiser.reset()
+                denoised_audio = denoiser.filter_wav(audio_wav, silence_floor_db=silence_floor_db)
+            finally:
+                self.denoisers.put(denoiser)
+
+            denoised_audio_wav = io.BytesIO()
+            denoiser.write_wav(denoised_audio_wav, denoised_audio)
+        except Exception:
+            with self.lock:
+                self.counters['files_failed'] += 1
+            raise
+        finally:
+            self.file_slots.release()
+
+        with self.lock:
+            self.counters['files_total'] += 1
+            self.counters['audio_seconds_total'] += len(denoised_audio) / 1000
+            self.latencies_ms.append((time.time() - start_time) * 1000)
+        return denoised_audio_wav.getvalue()
+
+
+    def open_stream(self, sample_rate=48000, channels=1, sample_format='s16le'):
+        ''' Creating a new stream (see RNNoiseStream). Raises OverflowError if the number of streams exceeds max_streams. '''
+
+        with self.lock:
+            if self.counters['streams_active'] >= self.max_streams:
+                self.counters['streams_rejected'] += 1
+                raise OverflowError('too many streams')
+            self.counters['streams_active'] += 1
+            self.counters['streams_total'] += 1
+
+        try:
+            return RNNoiseStream(sample_rate, channels, sample_format, self.f_name_lib)
+        except Exception:
+            self.close_stream(None)
+            raise
+
+
+    def process_stream(self, stream, data):
+        ''' Denoising the next block of a stream in a scheduler tick. Blocks while the queue is full.
+        1. stream - RNNoiseStream object from open_stream()
+        2. data - byte string with raw PCM (if None - flush the stream)
+        3. returns a byte string with the denoised PCM available so far '''
+
+        job = _StreamJob(stream, data)
+        self.jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+
+    def close_stream(self, stream):
+        with self.lock:
+            self.counters['streams_active'] -= 1
+
+
+    def __worker_loop(self, worker_index):
+        ''' Worker thread: takes a batch of stream blocks that have arrived during the batch window and denoises them together in one tick. '''
+
+        worker_metrics = self.worker_metrics[worker_index]
+        if self.cpu_layout is not None and pin_current_worker(self.cpu_layout[worker_index]):
+            worker_metrics['cpus'] = get_current_cpus()
+
+        while self.is_running:
+            try:
+                batch = [self.jobs.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            tick_end_time = time.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = tick_end_time - time.time()
+                try:
+                    batch.append(self.jobs.get(timeout=timeout) if timeout > 0 else self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Blocks of different streams are denoised together, flushes and further blocks of a stream already in the tick are processed after
+            # them one by one in order
+            batched_jobs, other_jobs, streams_in_tick = [], [], set()
+            for job in batch:
+                if job.data is not None and id(job.stream) not in streams_in_tick:
+                    batched_jobs.append(job)
+                else:
+                    other_jobs.append(job)
+                streams_in_tick.add(id(job.stream))
+
+            tick_start_time = time.time()
+            try:
+                results = RNNoiseStream.process_streams([job.stream for job in batched_jobs], [job.data for job in batched_jobs])
+                for job, result in zip(batched_jobs, results):
+                    job.result = result
+            except Exception as e:
+                for job in batched_jobs:
+                    job.error = e
+            for job in other_jobs:
+                try:
+                    job.result = job.stream.process(job.data) if job.data is not None else job.stream.flush()
+                except Exception as e:
+                    job.error = e
+
+            audio_seconds = 0.0
+            for job in batch:
+                if job.result is not None:
+                    audio_seconds += len(job.result) / (job.stream.channels * job.stream.sample_dtype.itemsize * job.stream.sample_rate)
+
+            finish_time = time.time()
+            with self.lock:
+                self.counters['ticks_total'] += 1
+                self.counters['stream_blocks_total'] += len(batch)
+                self.counters['audio_seconds_total'] += audio_seconds
+                self.latencies_ms.extend([(finish_time - job.enqueue_time) * 1000 for job in batch])
+                worker_metrics['ticks'] += 1
+                worker_metrics['busy_time_s'] += finish_time - tick_start_time
+                worker_metrics['audio_seconds'] += audio_seconds
+            for job in batch:
+                job.done.set()
+
+
+    def get_metrics(self):
+        ''' Metrics of the server: counters, queue size, mean tick size, latency percentiles (of the last 10000 requests/stream blocks) and
+        metrics of each worker thread (its cores, number of ticks, busy time and throughput in seconds of audio per busy second).
+        1. returns a dict '''
+
+        with self.lock:
+            metrics = dict(self.counters)
+            latencies_ms = np.array(self.latencies_ms)
+            metrics['workers'] = [dict(worker_metrics) for worker_metrics in self.worker_metrics]
+        for worker_metrics in metrics['workers']:
+            busy_time = worker_metrics['busy_time_s']
+            worker_metrics['throughput_rt'] = worker_metrics['audio_seconds'] / busy_time if busy_time else 0.0
+
+        metrics['uptime_s'] = time.time() - self.start_time if self.start_time else 0.0
+        metrics['queue_size'] = self.jobs.qsize()
+        metrics['mean_tick_size'] = metrics['stream_blocks_total'] / metrics['ticks_total'] if metrics['ticks_total'] else 0.0
+        for percentile in [50, 95, 99]:
+            metrics['latency_p{}_ms'.format(percentile)] = float(np.percentile(latencies_ms, percentile)) if len(latencies_ms) else 0.0
+        return metrics
+
+
+class DenoiseStreamClient(object):
+    """Client of the framed TCP protocol of DenoiseServer:
+    - process(): send the next block of raw PCM and receive the denoised PCM available so far
+    - close(): end the stream and receive the rest of the denoised PCM
+
+    1. host - host of the server
+    2. port - TCP port of the server
+    3. sample_rate - sample rate of the stream
+    4. channels - number of channels
+    5. sample_format - 's16le' or 'f32le'
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081, sample_rate=48000, channels=1, sample_format='s16le'):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_message(self.sock, json.dumps({'sample_rate': sample_rate, 'channels': channels, 'sample_format': sample_format}).encode('utf-8'))
+        reply = json.loads(recv_message(self.sock).decode('utf-8'))
+        if reply['status'] != 'ok':
+            self.sock.close()
+            raise RuntimeError('server refused the stream: {}'.format(reply.get('message')))
+
+
+    def process(self, data):
+        if not data:
+            return b''
+        send_message(self.sock, data)
+        return recv_message(self.sock)
+
+
+    def close(self):
+        send_message(self.sock, b'')
+        denoised_data = recv_message(self.sock)
+        recv_message(self.sock)
+        self.sock.close()
+        return denoised_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local denoising server: HTTP API for whole .wav audio (POST /denoise, GET /health, ' + \
+                                                 'GET /metrics) and framed TCP protocol for streams.')
+    parser.add_argument('-m', '--model', type=str, default=None,
+                        help='Name/path of RNNoise library (default is librnnoise_5h_b_500k)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Host (default is "127.0.0.1")')
+    parser.add_argument('--http_port', type=int, default=8080,
+                        help='Port of HTTP server (default is 8080)')
+    parser.add_argument('--tcp_port', type=int, default=8081,
+                        help='Port of TCP server for streams (default is 8081)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of worker threads (default is from the host profile made by rnnoise_wrapper_autotune, else 4)')
+    parser.add_argument('--max_queue_size', type=int, default=256,
+                        help='Size of the admission queue (default is 256)')
+    parser.add_argument('--max_streams', type=int, default=256,
+                        help='Maximum number of concurrent streams (default is 256)')
+    parser.add_argument('--batch_window_ms', type=float, default=1.0,
+                        help='Window for grouping frames of concurrent streams in one tick in milliseconds (default is 1.0)')
+    parser.add_argument('--cpus', type=str, default=None,
+                        help='Cores for worker threads, one core per worker (for example, "0-3", default is not pinned)')
+    parser.add_argument('--numa', action='store_true',
+                        help='Spread worker threads over NUMA nodes, each worker is pinned to the cores of its node (memory of streams ' + \
+                             'is not placed on the nodes)')
+    args = parser.parse_args()
+
+    server = DenoiseServer(args.model, args.host, args.http_port, args.tcp_port, args.workers, args.max_queue_size, args.max_streams,
+                           args.batch_window_ms, cpus=args.cpus, numa=args.numa)
+    print('[i] HTTP on {}:{}, streams on {}:{}, {} worker(-s), batches of up to {} stream block(-s)'.format(
+        args.host, args.http_port, args.host, args.tcp_port, server.workers, server.max_batch_size))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.8 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Shared memory transport for co-located clients of rnnoise_wrapper.RNNoise(): audio frames are not sent over sockets, but written by the client
+into a ring buffer in shared memory and denoised by the worker in place.
+
+Each stream has its own ring buffer (multiprocessing.shared_memory) with slots of one 10 ms frame (480 samples, float32 in 16 bit range, mono,
+48 kHz) and 3 counters: written by the client, processed by the worker and read by the client. Notifications use named FIFOs as doorbells:
+the client writes a fixed-size record to the doorbell of the worker after writing frames (one write syscall per batch of frames, without copying
+audio) and the worker writes one byte to the doorbell of the client after processing them. One worker serves many streams, each with its own
+RNNoise state.
+
+Contains the SharedMemoryDenoiseWorker and SharedMemoryStream classes.
+'''
+
+import os
+import time
+import uuid
+import errno
+import select
+import argparse
+import ctypes
+import numpy as np
+from multiprocessing import shared_memory
+
+from .rnnoise_wrapper import RNNoise
+
+
+RING_MAGIC = 0x524e4e53484d0001
+FRAME_SIZE = int(RNNoise.sample_rate * RNNoise.frame_duration_ms / 1000)
+RECORD_SIZE = 64
+
+# Header of the ring buffer: uint64 values
+HEADER_MAGIC, HEADER_NUMBER_OF_SLOTS, HEADER_WRITTEN, HEADER_PROCESSED, HEADER_READ = range(5)
+HEADER_SIZE = 8 * 8
+
+
+# Names of ring buffers created by SharedMemoryStream in this process (they stay registered in the resource tracker when attached by a worker
+# in the same process)
+_created_names = set()
+
+
+def _attach_shared_memory(name):
+    ''' Attaching existing shared memory without registering it in the resource tracker of this process (otherwise it would be removed when
+    this process exits, while it belongs to another process). '''
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if name in _created_names:
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+class _Ring(object):
+    ''' Views of the ring buffer in shared memory: header (uint64), voice probabilities (float32) and frames (float32). '''
+
+    def __init__(self, shm, number_of_slots=None):
+        self.shm = shm
+        self.header = np.ndarray((8,), dtype=np.uint64, buffer=shm.buf)
+        if number_of_slots is None:
+            if int(self.header[HEADER_MAGIC]) != RING_MAGIC:
+                raise ValueError("shared memory '{}' is not a ring buffer of rnnoise_wrapper".format(shm.name))
+            number_of_slots = int(self.header[HEADER_NUMBER_OF_SLOTS])
+        self.number_of_slots = number_of_slots
+        self.vad_probabilities = np.ndarray((number_of_slots,), dtype=np.float32, buffer=shm.buf, offset=HEADER_SIZE)
+        self.frames = np.ndarray((number_of_slots, FRAME_SIZE), dtype=np.float32, buffer=shm.buf, offset=HEADER_SIZE + 4*number_of_slots)
+
+
+    @staticmethod
+    def get_size(number_of_slots):
+        return HEADER_SIZE + 4*number_of_slots + 4*FRAME_SIZE*number_of_slots
+
+
+    def release(self):
+        # Views must be removed before closing shared memory
+        self.header = self.vad_probabilities = self.frames = None
+        self.shm.close()
+
+
+def _make_record(command, name):
+    record = command + name.encode('utf-8')
+    if len(record) > RECORD_SIZE:
+        raise ValueError("name '{}' is too long".format(name))
+    return record.ljust(RECORD_SIZE, b'\x00')
+
+
+def _open_fifo(f_name_fifo):
+    ''' Opening FIFO for reading without blocking. A writer is also opened, so that reading never gets EOF when there are no clients. '''
+
+    fd_read = os.open(f_name_fifo, os.O_RDONLY | os.O_NONBLOCK)
+    fd_write = os.open(f_name_fifo, os.O_WRONLY | os.O_NONBLOCK)
+    return fd_read, fd_write
+
+
+def _ring_doorbell(fd, data):
+    try:
+        os.write(fd, data)
+    except OSError as e:
+        # The doorbell is full, so the other side has not read previous notifications yet and will see the new frames anyway
+        if e.errno != errno.EAGAIN:
+            raise
+
+
+class SharedMemoryDenoiseWorker(object):
+    """Worker that denoises frames of local streams in their shared memory ring buffers:
+    - serve_forever(): wait for notifications and process frames until stop() (or KeyboardInterrupt)
+    - poll(): process all pending notifications once
+    - stop(): stop serve_forever()
+    - close(): stop serving and remove the doorbell
+    - get_metrics(): number of streams (also of streams dropped because their clients had closed or died), frames and notifications
+
+    1. f_name_doorbell - name of FIFO of the worker doorbell (created if it does not exist)
+    2. f_name_lib - path to the library (see RNNoise)
+    """
+
+    def __init__(self, f_name_doorbell='/tmp/rnnoise_wrapper.doorbell', f_name_lib=None):
+        self.f_name_doorbell = f_name_doorbell
+        self.f_name_lib = f_name_lib
+        if not os.path.exists(f_name_doorbell):
+            os.mkfifo(f_name_doorbell)
+        self.fd_doorbell, self.fd_doorbell_writer = _open_fifo(f_name_doorbell)
+
+        self.streams = {}
+        self.is_running = False
+        self.counters = {'streams_total': 0, 'streams_dropped': 0, 'frames_total': 0, 'notifications_total': 0, 'processing_time_s': 0.0}
+
+
+    def serve_forever(self, poll_interval=0.5):
+        ''' Waiting for notifications from clients and processing their frames until stop() is called. '''
+
+        self.is_running = True
+        poller = select.poll()
+        poller.register(self.fd_doorbell, select.POLLIN)
+        try:
+            while self.is_running:
+                if poller.poll(poll_interval * 1000):
+                    self.poll()
+        except KeyboardInterrupt:
+            pass
+
+
+    def stop(self):
+        self.is_running = False
+
+
+    def poll(self):
+        ''' Processing all pending notifications: registration and removal of streams and new frames in their ring buffers. '''
+
+        try:
+            data = os.read(self.fd_doorbell, RECORD_SIZE * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        names_with_frames = []
+        for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+            record = data[offset:offset+RECORD_SIZE]
+            command, name = record[:1], record[1:].rstrip(b'\x00').decode('utf-8', errors='replace')
+            if command == b'R':
+                self.__register(name)
+            elif command == b'U':
+                self.__unregister(name)
+            elif command == b'D' and name not in names_with_frames:
+                names_with_frames.append(name)
+        self.counters['notifications_total'] += len(data) // RECORD_SIZE
+
+        for name in names_with_frames:
+            if name in self.streams:
+                self.__process(name)
+
+
+    def __register(self, name):
+        ''' Attaching the ring buffer and the doorbell of a new stream. A client which has already closed or died (its shared memory or doorbell
+        does not exist) is skipped, so that it can not stop serving of other streams. '''
+
+        if name in self.streams:
+            return
+        ring = None
+        try:
+            ring = _Ring(_attach_shared_memory(name))
+            fd_client_doorbell = os.open(os.path.join(os.path.dirname(self.f_name_doorbell), name + '.doorbell'), os.O_WRONLY | os.O_NONBLOCK)
+        except (OSError, ValueError):
+            if ring is not None:
+                ring.release()
+            self.counters['streams_dropped'] += 1
+            return
+        self.streams[name] = (ring, RNNoise(self.f_name_lib), fd_client_doorbell)
+        self.counters['streams_total'] += 1
+
+
+    def __unregister(self, name):
+        if name not in self.streams:
+            return
+        ring, denoiser, fd_client_doorbell = self.streams.pop(name)
+        os.close(fd_client_doorbell)
+        ring.release()
+
+
+    def __process(self, name):
+        ''' Denoising all written but not yet processed frames of the stream in place. A stream whose client has died (its doorbell is closed)
+        or has corrupted the ring buffer is removed, other streams are served further. '''
+
+        ring, denoiser, fd_client_doorbell = self.streams[name]
+        start_time = time.time()
+        try:
+            processed = int(ring.header[HEADER_PROCESSED])
+            written = int(ring.header[HEADER_WRITTEN])
+            if written < processed or written - processed > ring.number_of_slots:
+                raise ValueError("invalid counters in the ring buffer of stream '{}'".format(name))
+            # Frames are processed in at most 2 runs of consecutive slots (before and after the wrap of the ring)
+            index = processed
+            while index < written:
+                slot = index % ring.number_of_slots
+                number_of_frames = min(written - index, ring.number_of_slots - slot)
+                ring.vad_probabilities[slot:slot+number_of_frames] = denoiser.filter_frames(ring.frames[slot:slot+number_of_frames])
+                index += number_of_frames
+            ring.header[HEADER_PROCESSED] = written
+            _ring_doorbell(fd_client_doorbell, b'\x01')
+        except (OSError, ValueError):
+            self.__unregister(name)
+            self.counters['streams_dropped'] += 1
+            return
+
+        self.counters['frames_total'] += written - processed
+        self.counters['processing_time_s'] += time.time() - start_time
+
+
+    def get_metrics(self):
+        metrics = dict(self.counters)
+        metrics['streams_active'] = len(self.streams)
+        return metrics
+
+
+    def close(self):
+        self.stop()
+        for name in list(self.streams):
+            self.__unregister(name)
+        os.close(self.fd_doorbell)
+        os.close(self.fd_doorbell_writer)
+        if os.path.exists(self.f_name_doorbell):
+            os.remove(self.f_name_doorbell)
+
+
+class SharedMemoryStream(object):
+    """Client stream of SharedMemoryDenoiseWorker. Audio must be 16 bit, mono, 48 kHz and is passed in whole 10 ms frames:
+    - write(): write frames to the ring buffer and notify the worker
+    - read(): read denoised frames that have been processed by the worker
+    - process(): write frames and wait until all of them are denoised
+    - close(): remove the stream from the worker and free shared memory
+
+    1. f_name_doorbell - name of FIFO of the worker doorbell
+    2. number_of_slots - size of the ring buffer in frames
+    """
+
+    def __init__(self, f_name_doorbell='/tmp/rnnoise_wrapper.doorbell', number_of_slots=64):
+        self.name = 'rnnoise_{}_{}'.format(os.getpid(), uuid.uuid4().hex[:12])
+        self.ring = _Ring(shared_memory.SharedMemory(name=self.name, create=True, size=_Ring.get_size(number_of_slots)), number_of_slots)
+        _created_names.add(self.name)
+        self.ring.header[:] = 0
+        self.ring.header[HEADER_NUMBER_OF_SLOTS] = number_of_slots
+        self.ring.header[HEADER_MAGIC] = RING_MAGIC
+
+        self.f_name_client_doorbell = os.path.join(os.path.dirname(f_name_doorbell), self.name + '.doorbell')
+        os.mkfifo(self.f_name_client_doorbell)
+        self.fd_client_doorbell, self.fd_client_doorbell_writer = _open_fifo(self.f_name_client_doorbell)
+        self.fd_doorbell = os.open(f_name_doorbell, os.O_WRONLY)
+        self.poller = select.poll()
+        self.poller.register(self.fd_client_doorbell, select.POLLIN)
+
+        os.write(self.fd_doorbell, _make_record(b'R', self.name))
+        self.data_record = _make_record(b'D', self.name)
+
+
+    def write(self, audio_bytes):
+        ''' Writing frames to the ring buffer and notifying the worker.
+        1. audio_bytes - byte string with whole 10 ms frames (16 bit, mono, 48 kHz)
+        2. returns the number of written frames
+        Raises BufferError if there are not enough free slots (denoised frames must be read first). '''
+
+        frames = np.frombuffer(audio_bytes, dtype=np.int16)
+        if len(frames) % FRAME_SIZE != 0:
+            raise ValueError("'audio_bytes' must contain whole frames of {} samples".format(FRAME_SIZE))
+        frames = frames.reshape(-1, FRAME_SIZE)
+
+        header = self.ring.header
+        written = int(header[HEADER_WRITTEN])
+        if written + len(frames) - int(header[HEADER_READ]) > self.ring.number_of_slots:
+            raise BufferError('not enough free slots in the ring buffer, read denoised frames first')
+
+        self.ring.frames[np.arange(written, written + len(frames)) % self.ring.number_of_slots] = frames
+        header[HEADER_WRITTEN] = written + len(frames)
+        os.write(self.fd_doorbell, self.data_record)
+        return len(frames)
+
+
+    def read(self, timeout=None):
+        ''' Reading frames denoised by the worker.
+        1. timeout - maximum waiting time for at least one denoised frame in seconds (if 0 - do not wait, if None - wait without limit)
+        2. returns a tuple of a byte string with denoised frames (16 bit, mono, 48 kHz) and np.ndarray with voice probabilities '''
+
+        header = self.ring.header
+        read = int(header[HEADER_READ])
+        if int(header[HEADER_PROCESSED]) == read and timeout != 0:
+            deadline = time.time() + timeout if timeout is not None else None
+            while int(header[HEADER_PROCESSED]) == read:
+                wait_ms = -1 if deadline is None else max(0, int((deadline - time.time()) * 1000))
+                if self.poller.poll(wait_ms):
+                    try:
+                        os.read(self.fd_client_doorbell, 4096)
+                    except OSError as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+                elif deadline is not None and time.time() >= deadline:
+                    break
+
+        processed = int(header[HEADER_PROCESSED])
+        slots = np.arange(read, processed) % self.ring.number_of_slots
+        denoised_frames = self.ring.frames[slots].astype(ctypes.c_short)
+        vad_probabilities = self.ring.vad_probabilities[slots].copy()
+        header[HEADER_READ] = processed
+        return denoised_frames.tobytes(), vad_probabilities
+
+
+    def process(self, audio_bytes):
+        ''' Writing frames and waiting until all of them are denoised (the audio can be longer than the ring buffer).
+        1. audio_bytes - byte string with whole 10 ms frames (16 bit, mono, 48 kHz)
+        2. returns a tuple of a byte string with denoised frames and np.ndarray with voice probabilities '''
+
+        frame_width = FRAME_SIZE * RNNoise.sample_width
+        number_of_frames = len(audio_bytes) // frame_width
+        block_size = self.ring.number_of_slots
+        denoised_blocks, vad_blocks = [], []
+        for i in range(0, number_of_frames, block_size):
+            block = audio_bytes[i*frame_width:min(i+block_size, number_of_frames)*frame_width]
+            number_of_frames_in_block = self.write(block)
+            received = 0
+            while received < number_of_frames_in_block:
+                denoised_block, vad_block = self.read()
+                denoised_blocks.append(denoised_block)
+                vad_blocks.append(vad_block)
+                received += len(vad_block)
+        return b''.join(denoised_blocks), np.concatenate(vad_blocks) if vad_blocks else np.zeros(0, dtype=np.float32)
+
+
+    def close(self):
+        try:
+            os.write(self.fd_doorbell, _make_record(b'U', self.name))
+        finally:
+            os.close(self.fd_doorbell)
+            os.close(self.fd_client_doorbell)
+            os.close(self.fd_client_doorbell_writer)
+            os.remove(self.f_name_client_doorbell)
+            shm = self.ring.shm
+            self.ring.release()
+            shm.unlink()
+            _created_names.discard(self.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker of shared memory transport for co-located clients of RNNoise_Wrapper.')
+    parser.add_argument('-d', '--doorbell', type=str, default='/tmp/rnnoise_wrapper.doorbell',
+                        help='Name of FIFO of the worker doorbell (default is "/tmp/rnnoise_wrapper.doorbell")')
+    parser.add_argument('-m', '--model', type=str, default=None,
+                        help='Name/path of RNNoise library (default is librnnoise_5h_b_500k)')
+    args = parser.parse_args()
+
+    worker = SharedMemoryDenoiseWorker(args.doorbell, args.model)
+    print("[i] Waiting for streams on '{}'...".format(args.doorbell))
+    try:
+        worker.serve_forever()
+    finally:
+        worker.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+/* Batched entry points for RNNoise (part of RNNoise_Wrapper, https://github.com/Desklop/RNNoise_Wrapper).
+
+   Each frame processed through ctypes costs argument conversion and release/reacquire of the GIL. These functions process many frames in one
+   call: K frames of one stream or K (state, frame) pairs of different streams. The shim does not link against RNNoise: rnnoise_process_frame()
+   of the loaded model library is passed as a function pointer, so one shim works with all model libraries.
+
+   Build (performed by compile_rnnoise.sh):
+       gcc -O2 -shared -fPIC -o rnnoise_wrapper/libs/rnnoise_batch.so rnnoise_wrapper/src/rnnoise_batch.c
+*/
+
+typedef float (*process_frame_fn)(void *st, float *out, const float *in);
+
+/* Version of the interface, checked by the wrapper when the shim is loaded. */
+int rnnoise_batch_version(void)
+{
+  return 1;
+}
+
+/* Denoising number_of_frames consecutive frames of one stream in place.
+   frames - number_of_frames*frame_size floats (samples in 16 bit range), vad_probabilities - number_of_frames floats for the result. */
+void rnnoise_batch_process_frames(process_frame_fn process_frame, void *st, float *frames, int number_of_frames, int frame_size,
+                                  float *vad_probabilities)
+{
+  int i;
+  for (i = 0; i < number_of_frames; i++) {
+    float *frame = frames + (long)i*frame_size;
+    vad_probabilities[i] = process_frame(st, frame, frame);
+  }
+}
+
+/* Denoising number_of_pairs (state, frame) pairs in place: frame i is denoised with states[i] and process_frames[i] (states can belong to
+   different model libraries). frames - number_of_pairs*frame_size floats, vad_probabilities - number_of_pairs floats for the result. */
+void rnnoise_batch_process_pairs(process_frame_fn *process_frames, void **states, float *frames, int number_of_pairs, int frame_size,
+                                 float *vad_probabilities)
+{
+  int i;
+  for (i = 0; i < number_of_pairs; i++) {
+    float *frame = frames + (long)i*frame_size;
+    vad_probabilities[i] = process_frames[i](states[i], frame, frame);
+  }
+}
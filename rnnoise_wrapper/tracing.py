@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Opt-in per-frame tracing for rnnoise_wrapper: timestamps of enqueue, resampling, native calls of RNNoise and emit of each frame are recorded
+in a preallocated ring buffer (the last capacity events are kept) and exported in Chrome trace-event JSON format, which can be opened in
+chrome://tracing or https://ui.perfetto.dev. Garbage collection of the Python interpreter can be traced too, and any other place (for example,
+waiting for a lock) can be traced with span().
+
+Recording one event costs a few list assignments, so tracing can be left enabled on canary hosts.
+
+Contains the FrameTracer class.
+'''
+
+import os
+import gc
+import json
+import time
+import itertools
+import threading
+import contextlib
+
+
+class FrameTracer(object):
+    """Ring buffer of trace events:
+    - add(): record a complete event (with start and end time) or an instant event (without end time)
+    - span(): context manager that records a complete event for a block of code
+    - export_chrome_trace(): save recorded events in Chrome trace-event JSON format
+    - close(): stop tracing of garbage collection
+
+    Pass the object as tracer to RNNoise or RNNoiseStream to trace their frames. One tracer can be shared by several objects and threads.
+    Times are taken with time.perf_counter().
+
+    1. capacity - number of kept events (older events are overwritten)
+    2. trace_gc - True: record garbage collection of the Python interpreter as events
+    """
+
+    def __init__(self, capacity=65536, trace_gc=True):
+        self.capacity = capacity
+        self.names = [None] * capacity
+        self.start_times = [0.0] * capacity
+        self.end_times = [None] * capacity
+        self.thread_ids = [0] * capacity
+        self.streams = [None] * capacity
+        self.frames = [-1] * capacity
+
+        # next() of itertools.count() is atomic, so events from different threads get different slots
+        self.counter = itertools.count()
+        self.number_of_events = 0
+        self.start_time = time.perf_counter()
+
+        self.gc_start_times = {}
+        self.is_tracing_gc = trace_gc
+        if trace_gc:
+            gc.callbacks.append(self.__on_gc)
+
+
+    def add(self, name, start_time, end_time=None, stream=None, frame=-1):
+        ''' Recording an event.
+        1. name - name of the event (for example, 'native')
+        2. start_time - start time from time.perf_counter()
+        3. end_time - end time from time.perf_counter() (if None - instant event)
+        4. stream - name of the stream (shown in the arguments of the event)
+        5. frame - index of the frame (shown in the arguments of the event, if not -1) '''
+
+        i = next(self.counter)
+        self.number_of_events = i + 1
+        i %= self.capacity
+        self.names[i] = name
+        self.start_times[i] = start_time
+        self.end_times[i] = end_time
+        self.thread_ids[i] = threading.get_ident()
+        self.streams[i] = stream
+        self.frames[i] = frame
+
+
+    @contextlib.contextmanager
+    def span(self, name, stream=None, frame=-1):
+        ''' Recording a complete event for the code in the with block (for example, waiting for a lock). '''
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start_time, time.perf_counter(), stream, frame)
+
+
+    def get_events(self):
+        ''' Recorded events in Chrome trace-event format (the oldest first).
+        1. returns a list of dicts '''
+
+        number_of_events = min(self.number_of_events, self.capacity)
+        first_event = self.number_of_events - number_of_events
+        pid = os.getpid()
+
+        events = []
+        for j in range(first_event, first_event + number_of_events):
+            i = j % self.capacity
+            if self.names[i] is None:
+                continue
+            event = {'name': self.names[i], 'cat': 'rnnoise', 'pid': pid, 'tid': self.thread_ids[i],
+                     'ts': round((self.start_times[i] - self.start_time) * 1e6, 3)}
+            if self.end_times[i] is None:
+                event['ph'] = 'i'
+                event['s'] = 't'
+            else:
+                event['ph'] = 'X'
+                event['dur'] = round((self.end_times[i] - self.start_times[i]) * 1e6, 3)
+
+            args = {}
+            if self.streams[i] is not None:
+                args['stream'] = self.streams[i]
+            if self.frames[i] != -1:
+                args['frame'] = self.frames[i]
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+
+    def export_chrome_trace(self, f_name_json):
+        ''' Saving recorded events in Chrome trace-event JSON format.
+        1. f_name_json - name of .json file
+        2. returns the number of saved events '''
+
+        events = self.get_events()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id in sorted(set(event['tid'] for event in events)):
+            if thread_id in thread_names:
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id, 'args': {'name': thread_names[thread_id]}})
+
+        with open(f_name_json, 'w') as f_json:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'number_of_events': self.number_of_events, 'capacity': self.capacity}}, f_json)
+        return len(events)
+
+
+    def close(self):
+        if self.is_tracing_gc:
+            self.is_tracing_gc = False
+            gc.callbacks.remove(self.__on_gc)
+
+
+    def __on_gc(self, phase, info):
+        thread_id = threading.get_ident()
+        if phase == 'start':
+            self.gc_start_times[thread_id] = time.perf_counter()
+        elif thread_id in self.gc_start_times:
+            self.add('gc (generation {})'.format(info.get('generation')), self.gc_start_times.pop(thread_id), time.perf_counter())
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Direct writer of PCM .wav audio without pydub: the RIFF header is built with struct and the caller's buffer (bytes, memoryview, np.ndarray)
+is written as is, together with the header in one os.writev() call for files. Supports incremental appends for streaming, the header is
+finalized on close.
+
+Contains the WavWriter class.
+'''
+
+import os
+import struct
+import numpy as np
+
+
+class WavWriter(object):
+    """Writer of PCM .wav audio with a 44 byte header (the same as written by the wave module and pydub):
+    - write(): append audio data (bytes, bytearray, memoryview or np.ndarray) without copying it in Python
+    - close(): finalize sizes in the header (if the output is seekable) and close the file
+
+    Can be used as a context manager. If the number of frames is known in advance, the header is written with final sizes and is not rewritten
+    on close. If the output is not seekable (for example, a pipe) and the number of frames is unknown, the header is written with the maximum
+    sizes (0xFFFFFFFF), as ffmpeg does for streaming.
+
+    1. f_name_wav - name of the .wav file or a writable binary file object (for example, BytesIO or sys.stdout.buffer)
+    2. sample_rate - sample rate
+    3. channels - number of channels
+    4. sample_width - sample width in bytes
+    5. number_of_frames - number of frames (samples of all channels) that will be written (if None - unknown)
+    """
+    header_size = 44
+    max_data_size = 0xFFFFFFFF - 36
+
+    def __init__(self, f_name_wav, sample_rate, channels=1, sample_width=2, number_of_frames=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+        if isinstance(f_name_wav, str):
+            self.f_wav = open(f_name_wav, 'wb', buffering=0)
+            self.is_own_file = True
+        else:
+            self.f_wav = f_name_wav
+            self.is_own_file = False
+
+        try:
+            self.is_seekable = self.f_wav.seekable()
+        except AttributeError:
+            self.is_seekable = False
+        self.start_position = self.f_wav.tell() if self.is_seekable else 0
+
+        # os.writev() is used only for unbuffered files, so as not to bypass the buffer of a file object
+        self.fd = None
+        if hasattr(os, 'writev') and not hasattr(self.f_wav, 'raw') and hasattr(self.f_wav, 'fileno'):
+            try:
+                self.fd = self.f_wav.fileno()
+            except (OSError, ValueError):
+                self.fd = None
+
+        if number_of_frames is not None:
+            self.header_data_size = number_of_frames * channels * sample_width
+        elif self.is_seekable:
+            self.header_data_size = 0
+        else:
+            self.header_data_size = self.max_data_size
+        self.data_size = 0
+        self.is_header_written = False
+        self.is_closed = False
+
+
+    def get_header(self, data_size):
+        ''' Building the RIFF header of PCM .wav audio.
+        1. data_size - size of audio data in bytes
+        2. returns a byte string with the 44 byte header '''
+
+        data_size = min(data_size, self.max_data_size)
+        block_align = self.channels * self.sample_width
+        return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, self.channels, self.sample_rate,
+                           self.sample_rate * block_align, block_align, self.sample_width * 8, b'data', data_size)
+
+
+    def write(self, data):
+        ''' Appending audio data. The header is written together with the first block.
+        1. data - bytes, bytearray, memoryview or np.ndarray with interleaved samples '''
+
+        if self.is_closed:
+            raise ValueError('write to closed WavWriter')
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+        data = memoryview(data).cast('B')
+
+        buffers = [data]
+        if not self.is_header_written:
+            buffers.insert(0, memoryview(self.get_header(self.header_data_size)))
+            self.is_header_written = True
+        self.__write_buffers(buffers)
+        self.data_size += len(data)
+
+
+    def close(self):
+        ''' Finalizing the header (if the output is seekable and the sizes have changed) and closing the file (if it was opened by the writer). '''
+
+        if self.is_closed:
+            return
+        self.is_closed = True
+        try:
+            if not self.is_header_written:
+                self.__write_buffers([memoryview(self.get_header(self.data_size if self.is_seekable else self.header_data_size))])
+                self.is_header_written = True
+            elif self.is_seekable and self.data_size != self.header_data_size:
+                end_position = self.f_wav.tell()
+                header = self.get_header(self.data_size)
+                self.f_wav.seek(self.start_position + 4)
+                self.__write_buffers([memoryview(header[4:8])])
+                self.f_wav.seek(self.start_position + 40)
+                self.__write_buffers([memoryview(header[40:44])])
+                self.f_wav.seek(end_position)
+        finally:
+            if self.is_own_file:
+                self.f_wav.close()
+            else:
+                self.f_wav.flush()
+
+
+    def __write_buffers(self, buffers):
+        ''' Writing buffers with one os.writev() call (repeated only for partial writes) or with write() of the file object. '''
+
+        if self.fd is None:
+            for buffer in buffers:
+                self.f_wav.write(buffer)
+            return
+
+        while buffers:
+            number_of_bytes = os.writev(self.fd, buffers)
+            while buffers and number_of_bytes >= len(buffers[0]):
+                number_of_bytes -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and number_of_bytes:
+                buffers[0] = buffers[0][number_of_bytes:]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
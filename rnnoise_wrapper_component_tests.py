@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Tests of the components of RNNoise_Wrapper around the RNNoise class (the scheduler, the server, the shared memory transport, the cache,
+the WAV writer and the CLI). Each test prints its checks and 'OK', 'ALL OK' is printed if all tests have passed.
+'''
+
+import io
+import os
+import sys
+import json
+import wave
+import hashlib
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+
+is_whl_test = False
+if is_whl_test:
+    for i, path in enumerate(sys.path):
+        if path == os.getcwd():
+            del sys.path[i]
+            break
+
+from rnnoise_wrapper import RNNoise, RNNoiseStream, DenoiseCache, WavWriter
+from rnnoise_wrapper.scheduler import RealtimeScheduler
+
+
+SEED = 2021
+FRAME_LENGTH = 480
+
+
+def get_test_samples(number_of_frames, seed=SEED):
+    ''' Seeded noisy tone at 48 kHz (int16) of number_of_frames frames of 10 ms. '''
+
+    rng = np.random.RandomState(seed)
+    t = np.arange(number_of_frames * FRAME_LENGTH) / 48000
+    samples = 6000 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 0.5 * t)) / 2 + rng.randn(len(t)) * 1500
+    return np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+def check(name, is_passed):
+    print('\t{:60} {}'.format(name, 'passed' if is_passed else 'FAILED'))
+    return is_passed
+
+
+def test_scheduler_order(number_of_blocks=300, workers=4):
+    ''' Results of one stream of RealtimeScheduler with several workers and a slow callback must be delivered in the order of blocks. '''
+
+    print('RealtimeScheduler, {} workers, slow callback:'.format(workers))
+    blocks = [frame.tobytes() for frame in get_test_samples(number_of_blocks).reshape(-1, FRAME_LENGTH)]
+    reference_stream = RNNoiseStream(48000)
+    reference_results = [reference_stream.process(block) for block in blocks]
+
+    results = []
+    all_delivered = threading.Event()
+    rng = random.Random(SEED)
+    def callback(stream_id, denoised_data, vad_probability, is_degraded):
+        time.sleep(rng.random() * 0.002)
+        results.append(denoised_data)
+        if len(results) == number_of_blocks:
+            all_delivered.set()
+
+    scheduler = RealtimeScheduler(workers=workers, degradation_policy='none')
+    scheduler.start()
+    try:
+        stream = scheduler.add_stream('stream', latency_budget_ms=1000.0, callback=callback)
+        for block in blocks:
+            stream.push(block)
+        is_delivered = all_delivered.wait(60)
+    finally:
+        scheduler.shutdown()
+
+    results_in_order = check('all blocks delivered', is_delivered)
+    number_out_of_order = sum(result != reference_result for result, reference_result in zip(results, reference_results))
+    results_in_order &= check('results in the order of blocks ({} out of order)'.format(number_out_of_order), number_out_of_order == 0)
+    return results_in_order
+
+
+def test_shm_dead_clients():
+    ''' SharedMemoryDenoiseWorker must keep serving when a client closes before its registration is processed or dies after it. '''
+
+    print('SharedMemoryDenoiseWorker, closed and dead clients:')
+    try:
+        from rnnoise_wrapper.shm_transport import SharedMemoryDenoiseWorker, SharedMemoryStream
+    except ImportError:
+        print('\tskipped (Python 3.8+ is required)')
+        return True
+
+    folder_name = tempfile.mkdtemp(prefix='rnnoise_wrapper_tests_')
+    f_name_doorbell = os.path.join(folder_name, 'worker.doorbell')
+    worker = SharedMemoryDenoiseWorker(f_name_doorbell)
+    audio_bytes = get_test_samples(20).tobytes()
+    try:
+        # The client is closed before the worker has processed its registration
+        SharedMemoryStream(f_name_doorbell).close()
+        stream = SharedMemoryStream(f_name_doorbell)
+        is_passed = True
+        try:
+            worker.poll()
+        except (OSError, ValueError) as e:
+            is_passed = False
+            print('\t{}: {}'.format(type(e).__name__, e))
+        is_passed &= check('registration of a closed client is skipped', is_passed and worker.get_metrics()['streams_dropped'] == 1)
+
+        # The client dies after registration: its doorbell is closed without unregistering
+        dead_stream = SharedMemoryStream(f_name_doorbell)
+        worker.poll()
+        dead_stream.write(audio_bytes)
+        os.close(dead_stream.fd_client_doorbell)
+        os.close(dead_stream.fd_client_doorbell_writer)
+        stream.write(audio_bytes)
+        try:
+            worker.poll()
+        except (OSError, ValueError) as e:
+            is_passed = False
+            print('\t{}: {}'.format(type(e).__name__, e))
+        metrics = worker.get_metrics()
+        is_passed &= check('dead client is removed', metrics['streams_dropped'] == 2 and metrics['streams_active'] == 1)
+
+        denoised_audio, vad_probabilities = stream.read(timeout=0)
+        is_passed &= check('other stream is served', denoised_audio == RNNoise().filter(audio_bytes, sample_rate=48000))
+        stream.close()
+        worker.poll()
+
+        os.close(dead_stream.fd_doorbell)
+        os.remove(dead_stream.f_name_client_doorbell)
+        shm = dead_stream.ring.shm
+        dead_stream.ring.release()
+        shm.unlink()
+    finally:
+        worker.close()
+        shutil.rmtree(folder_name)
+    return is_passed
+
+
+def test_server_streams(number_of_streams=4, sample_rate=16000):
+    ''' Concurrent TCP streams of DenoiseServer, which are denoised together in ticks, must give the same audio as RNNoiseStream. '''
+
+    print('DenoiseServer, {} concurrent TCP streams:'.format(number_of_streams))
+    from rnnoise_wrapper.server import DenoiseServer, DenoiseStreamClient
+
+    datas = [get_test_samples(100, SEED + i)[::3].tobytes() for i in range(number_of_streams)]
+    references = []
+    for data in datas:
+        reference_stream = RNNoiseStream(sample_rate)
+        references.append(reference_stream.process(data) + reference_stream.flush())
+
+    results = [None] * number_of_streams
+    def run_client(i):
+        client = DenoiseStreamClient('127.0.0.1', server.tcp_port, sample_rate=sample_rate)
+        rng = random.Random(SEED + i)
+        denoised_blocks = []
+        position = 0
+        while position < len(datas[i]):
+            block_size = 2 * rng.randint(1, 800)
+            denoised_blocks.append(client.process(datas[i][position:position+block_size]))
+            position += block_size
+        denoised_blocks.append(client.close())
+        results[i] = b''.join(denoised_blocks)
+
+    server = DenoiseServer(http_port=None, tcp_port=0, workers=2, batch_window_ms=5.0)
+    server.start()
+    try:
+        threads = [threading.Thread(target=run_client, args=(i,)) for i in range(number_of_streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        metrics = server.get_metrics()
+    finally:
+        server.shutdown()
+
+    is_passed = check('all streams are denoised as with RNNoiseStream', results == references)
+    print('\tmean tick size {:.2f} block(-s)'.format(metrics['mean_tick_size']))
+    return is_passed
+
+
+def test_server_http(sample_rate=16000):
+    ''' POST /denoise of DenoiseServer must return the same .wav audio as RNNoise.filter_wav(), errors must be returned as JSON. '''
+
+    print('DenoiseServer, HTTP API:')
+    from rnnoise_wrapper.server import DenoiseServer
+
+    denoiser = RNNoise()
+    audio_wav = io.BytesIO()
+    denoiser.write_wav(audio_wav, get_test_samples(100)[::3], sample_rate=sample_rate)
+    audio_wav = audio_wav.getvalue()
+    reference_wav = io.BytesIO()
+    denoiser.write_wav(reference_wav, denoiser.filter_wav(audio_wav))
+    reference_wav = reference_wav.getvalue()
+
+    def request(path, data=None):
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:{}{}'.format(server.http_port, path), data=data, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    server = DenoiseServer(http_port=0, tcp_port=None, workers=1)
+    server.start()
+    try:
+        status, denoised_audio_wav = request('/denoise', audio_wav)
+        is_passed = check('POST /denoise', status == 200 and denoised_audio_wav == reference_wav)
+        status, body = request('/denoise', b'not a wav audio')
+        is_passed &= check('POST /denoise with invalid audio', status == 400 and json.loads(body.decode('utf-8'))['status'] == 'error')
+        status, body = request('/unknown')
+        is_passed &= check('unknown path', status == 404)
+        status, body = request('/health')
+        is_passed &= check('GET /health', status == 200 and json.loads(body.decode('utf-8'))['status'] == 'ok')
+        status, body = request('/metrics')
+        metrics = json.loads(body.decode('utf-8'))
+        is_passed &= check('GET /metrics', status == 200 and (metrics['files_total'], metrics['files_failed']) == (1, 1))
+    finally:
+        server.shutdown()
+    return is_passed
+
+
+def test_batch_cli_output_inside_source():
+    ''' Batch mode of the CLI with the output folder inside the source folder must not denoise its outputs or temporary files of
+    an interrupted run, neither on the first run nor on reruns. '''
+
+    print('CLI batch mode, output folder inside the source folder:')
+    folder_name = tempfile.mkdtemp(prefix='rnnoise_wrapper_tests_')
+    output_folder_name = os.path.join(folder_name, 'denoised')
+    try:
+        denoiser = RNNoise()
+        for i in range(2):
+            denoiser.write_wav(os.path.join(folder_name, 'audio_{}.WAV'.format(i)), get_test_samples(50, SEED + i), sample_rate=48000)
+        denoiser.write_wav(os.path.join(folder_name, 'audio_2.123.tmp.wav'), get_test_samples(50), sample_rate=48000)
+        with open(os.path.join(folder_name, 'notes.wav.txt'), 'w') as f_notes:
+            f_notes.write('not audio')
+
+        command_line = [sys.executable, '-m', 'rnnoise_wrapper.cli', '-i', folder_name, '-o', output_folder_name, '-j', '1']
+        outputs = []
+        for _ in range(2):
+            outputs.append(subprocess.run(command_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True))
+
+        is_passed = check('runs finished', all(output.returncode == 0 for output in outputs))
+        f_names_denoised = sorted(os.path.relpath(os.path.join(path, f_name), output_folder_name)
+                                  for path, _, f_names in os.walk(output_folder_name) for f_name in f_names if f_name != '.rnnoise_wrapper_journal')
+        is_passed &= check('only source audio is denoised', f_names_denoised == ['audio_0.WAV', 'audio_1.WAV'])
+        is_passed &= check('rerun finds only source audio', '[i] Found 2 audio, 2 are up to date' in outputs[1].stdout)
+        if not is_passed:
+            print(''.join(output.stdout for output in outputs))
+    finally:
+        shutil.rmtree(folder_name)
+    return is_passed
+
+
+def test_cache(value_size=1000):
+    ''' DenoiseCache must evict the least recently used values from memory and disk, count hits and misses, and restore the on-disk tier
+    (in the order of last use) from an existing folder. '''
+
+    print('DenoiseCache, eviction, counters and restart:')
+    folder_name = tempfile.mkdtemp(prefix='rnnoise_wrapper_tests_')
+    keys = {name: hashlib.sha1(name.encode('utf-8')).hexdigest() for name in 'abcde'}
+    values = {name: name.encode('utf-8') * value_size for name in 'abcde'}
+    megabyte = 1024 * 1024
+    try:
+        cache = DenoiseCache(max_memory_size_mb=2.5*value_size/megabyte, folder_name=folder_name, max_disk_size_mb=3.5*value_size/megabyte)
+        cache.put(keys['a'], values['a'])
+        cache.put(keys['b'], values['b'])
+        is_passed = check('value from memory', cache.get(keys['a']) == values['a'])
+        cache.put(keys['c'], values['c'])
+        is_passed &= check('least recently used value is evicted from memory', list(cache.memory_values) == [keys['a'], keys['c']])
+
+        is_passed &= check('evicted value is read from disk', cache.get(keys['b']) == values['b'])
+        cache.put(keys['d'], values['d'])
+        is_passed &= check('least recently used value is evicted from disk', list(cache.disk_files) == [keys['c'], keys['b'], keys['d']] and
+                           sorted(f_name for path, _, f_names in os.walk(folder_name) for f_name in f_names) == \
+                           sorted(keys[name] + '.bin' for name in 'bcd'))
+        is_passed &= check('miss', cache.get(hashlib.sha1(b'x').hexdigest()) is None)
+
+        stats = cache.stats()
+        is_passed &= check('counters', (stats['memory_hits'], stats['disk_hits'], stats['misses']) == (1, 1, 1) and
+                           (stats['memory_evictions'], stats['disk_evictions']) == (3, 1) and abs(stats['hit_rate'] - 2/3) < 1e-9)
+        is_passed &= check('sizes', (stats['memory_items'], stats['memory_size'], stats['disk_items'], stats['disk_size']) == \
+                           (2, 2*value_size, 3, 3*value_size))
+
+        # The order of last use is restored from modification times
+        for i, name in enumerate('cbd'):
+            f_name = os.path.join(folder_name, keys[name][:2], keys[name] + '.bin')
+            os.utime(f_name, (1000000000 + i, 1000000000 + i))
+        cache = DenoiseCache(max_memory_size_mb=2.5*value_size/megabyte, folder_name=folder_name, max_disk_size_mb=3.5*value_size/megabyte)
+        is_passed &= check('on-disk tier is restored from the folder', list(cache.disk_files) == [keys['c'], keys['b'], keys['d']] and
+                           cache.stats()['disk_size'] == 3*value_size)
+        is_passed &= check('restored value is read from disk', cache.get(keys['c']) == values['c'] and cache.stats()['disk_hits'] == 1)
+        cache.put(keys['e'], values['e'])
+        is_passed &= check('least recently used restored value is evicted', list(cache.disk_files) == [keys['d'], keys['c'], keys['e']] and
+                           not os.path.exists(os.path.join(folder_name, keys['b'][:2], keys['b'] + '.bin')))
+    finally:
+        shutil.rmtree(folder_name)
+    return is_passed
+
+
+def test_pipe_trace_reader_exits():
+    ''' Pipe mode of the CLI with --trace must save the trace and exit without errors when the reader of stdout (head) exits early. '''
+
+    print('CLI pipe mode with --trace, reader exits early:')
+    folder_name = tempfile.mkdtemp(prefix='rnnoise_wrapper_tests_')
+    f_name_trace = os.path.join(folder_name, 'trace.json')
+    # 20 s of audio do not fit in the buffer of the pipe, so writing to it fails after head has exited
+    audio_bytes = np.tile(get_test_samples(100)[::3], 20).tobytes()
+    try:
+        denoiser = subprocess.Popen([sys.executable, '-m', 'rnnoise_wrapper.cli', '-i', '-', '-o', '-', '-r', '16000', '--trace', f_name_trace],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        head = subprocess.Popen(['head', '-c', '100'], stdin=denoiser.stdout, stdout=subprocess.PIPE)
+        denoiser.stdout.close()
+        try:
+            denoiser.stdin.write(audio_bytes)
+        except BrokenPipeError:
+            pass
+        denoiser.stdin.close()
+        output = head.communicate(timeout=60)[0]
+        messages = denoiser.stderr.read().decode('utf-8', errors='replace')
+        denoiser.stderr.close()
+        returncode = denoiser.wait(timeout=60)
+
+        is_passed = check('reader gets the first bytes', len(output) == 100)
+        is_passed &= check('exits without errors', returncode == 0 and 'Error' not in messages and 'lost sys.stderr' not in messages)
+        is_trace_saved = os.path.isfile(f_name_trace)
+        if is_trace_saved:
+            with open(f_name_trace, 'r') as f_trace:
+                is_trace_saved = len(json.load(f_trace)['traceEvents']) > 0
+        is_passed &= check('trace is saved', is_trace_saved)
+        if not is_passed:
+            print(messages)
+    finally:
+        shutil.rmtree(folder_name)
+    return is_passed
+
+
+class _UnseekableOutput(object):
+    ''' Output without seek() and fileno(), like a pipe wrapped in a file object. '''
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+
+def test_wav_writer(number_of_frames=30):
+    ''' WavWriter must write the same .wav audio as the wave module for files and seekable objects (with and without a known number of
+    frames), and the maximum sizes in the header for unseekable outputs. '''
+
+    print('WavWriter, files, seekable and unseekable outputs:')
+    samples = get_test_samples(number_of_frames)
+    blocks = [samples[:1000].tobytes(), memoryview(samples[1000:5000].tobytes()), samples[5000:]]
+
+    reference_wav = io.BytesIO()
+    with wave.open(reference_wav, 'wb') as f_wav:
+        f_wav.setnchannels(1)
+        f_wav.setsampwidth(2)
+        f_wav.setframerate(48000)
+        f_wav.writeframes(samples.tobytes())
+    reference_wav = reference_wav.getvalue()
+
+    folder_name = tempfile.mkdtemp(prefix='rnnoise_wrapper_tests_')
+    try:
+        f_name_wav = os.path.join(folder_name, 'audio.wav')
+        with WavWriter(f_name_wav, 48000) as wav_writer:
+            for block in blocks:
+                wav_writer.write(block)
+        with open(f_name_wav, 'rb') as f_wav:
+            is_passed = check('file, unknown number of frames', f_wav.read() == reference_wav)
+    finally:
+        shutil.rmtree(folder_name)
+
+    output = io.BytesIO()
+    with WavWriter(output, 48000, number_of_frames=len(samples)) as wav_writer:
+        for block in blocks:
+            wav_writer.write(block)
+    is_passed &= check('BytesIO, known number of frames', output.getvalue() == reference_wav)
+
+    output = _UnseekableOutput()
+    with WavWriter(output, 48000) as wav_writer:
+        for block in blocks:
+            wav_writer.write(block)
+    is_passed &= check('unseekable output, maximum sizes in the header', bytes(output.data[44:]) == samples.tobytes() and
+                       bytes(output.data[:44]) == wav_writer.get_header(WavWriter.max_data_size) and
+                       bytes(output.data[4:8]) == b'\xff\xff\xff\xff')
+
+    output = io.BytesIO()
+    WavWriter(output, 48000).close()
+    with wave.open(io.BytesIO(output.getvalue()), 'rb') as f_wav:
+        is_passed &= check('empty audio', f_wav.getnframes() == 0 and f_wav.getframerate() == 48000)
+    return is_passed
+
+
+def main():
+    tests = [test_scheduler_order, test_shm_dead_clients, test_server_streams, test_server_http, test_batch_cli_output_inside_source,
+             test_pipe_trace_reader_exits, test_cache, test_wav_writer]
+
+    result_tests = []
+    for test in tests:
+        is_passed = test()
+        result_tests.append(is_passed)
+        print('OK\n' if is_passed else 'FAIL\n')
+
+    if all(result_tests):
+        print('\nALL OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,580 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Conformance tests for RNNoise_Wrapper: every processing path must produce the same audio as the reference path (resampling with pydub and
+a loop over RNNoise.filter_frame()) on the same input.
+
+Inputs are the audio from test_audio/functional_tests and seeded synthetic audio (tones and noise with runs of digital silence), converted
+to several sample rates. Each path is run with each model from rnnoise_wrapper/libs and compared with the reference sample by sample: most paths
+must be bit-exact, paths with a documented approximation must have at least a minimum SNR relative to the reference. A new path
+(for example, an alternative inference backend) is added to get_paths().
+
+Usage: python3 rnnoise_wrapper_conformance_tests.py [-m MODEL ...] [-r SAMPLE_RATE ...] [-d MAX_DURATION]
+'''
+
+import os
+import sys
+import glob
+import time
+import io
+import wave
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+from pydub import AudioSegment
+
+is_whl_test = False
+if is_whl_test:
+    for i, path in enumerate(sys.path):
+        if path == os.getcwd():
+            del sys.path[i]
+            break
+
+from rnnoise_wrapper import RNNoise, RNNoiseStream, DenoiseCache, CallbackAdapter
+from rnnoise_wrapper.audio_utils import ratecv, g711_decode, g711_encode
+
+
+SAMPLE_RATES = [8000, 16000, 44100, 48000]
+SEED = 43
+FRAME_LENGTH = int(RNNoise.sample_rate * RNNoise.frame_duration_ms / 1000)
+
+# Skipping silence is bit-exact on audio without digital silence, after runs of digital silence the state of the neural network is only
+# re-primed, so audio right after them differs (the synthetic audio switches from silence to loud noise many times)
+SILENCE_FLOOR_DB = -80.0
+SILENCE_FLOOR_MIN_SNR_DB = 15.0
+
+
+# Test inputs
+
+def load_test_audio(folder_name_with_audio='test_audio/functional_tests', max_duration=None):
+    ''' Loading source audio for tests (denoised audio is skipped).
+    1. folder_name_with_audio - folder with 16 bit mono .wav audio
+    2. max_duration - maximum duration of each audio in seconds (if None - without limit)
+    3. returns a list of tuples of a name, np.ndarray with int16 samples and a sample rate '''
+
+    test_audio = []
+    for f_name_audio in sorted(glob.glob(os.path.join(folder_name_with_audio, '*.wav'))):
+        if f_name_audio.rfind('denoised') != -1:
+            continue
+        with wave.open(f_name_audio, 'rb') as f_audio:
+            sample_rate = f_audio.getframerate()
+            samples = np.frombuffer(f_audio.readframes(f_audio.getnframes()), dtype=np.int16)
+        if max_duration:
+            samples = samples[:int(max_duration * sample_rate)]
+        test_audio.append((os.path.basename(f_name_audio), samples, sample_rate))
+    return test_audio
+
+
+def generate_synthetic_audio(seed=SEED, duration=6.0, sample_rate=48000):
+    ''' Seeded synthetic audio: segments of white noise, tones with noise, clipping-level bursts and digital silence (for silence skipping).
+    1. seed - seed of the random generator
+    2. duration - duration in seconds
+    3. sample_rate - sample rate
+    4. returns np.ndarray with int16 samples '''
+
+    random_state = np.random.RandomState(seed)
+    segments = []
+    number_of_samples = 0
+    while number_of_samples < duration * sample_rate:
+        segment_length = int(random_state.uniform(0.1, 0.8) * sample_rate)
+        segment_type = random_state.randint(4)
+        t = np.arange(segment_length) / sample_rate
+        if segment_type == 0:
+            segment = random_state.normal(0, random_state.uniform(100, 3000), segment_length)
+        elif segment_type == 1:
+            segment = random_state.uniform(2000, 12000) * np.sin(2 * np.pi * random_state.uniform(100, 3000) * t)
+            segment += random_state.normal(0, 500, segment_length)
+        elif segment_type == 2:
+            segment = random_state.normal(0, 20000, segment_length)
+        else:
+            segment = np.zeros(segment_length)
+        segments.append(np.clip(np.round(segment), -32768, 32767).astype(np.int16))
+        number_of_samples += segment_length
+    return np.concatenate(segments)[:int(duration * sample_rate)]
+
+
+def convert_sample_rate(samples, sample_rate, desired_sample_rate):
+    if sample_rate == desired_sample_rate:
+        return samples
+    return ratecv(samples, sample_rate, desired_sample_rate)[0]
+
+
+# Reference path
+
+def reference_filter(denoiser, audio_bytes, sample_rate):
+    ''' Reference path: resampling to 48 kHz with pydub, loop over filter_frame() from the initial state, resampling back with pydub.
+    1. denoiser - RNNoise object (its state is reset)
+    2. audio_bytes - byte string with 16 bit mono audio
+    3. sample_rate - sample rate of the audio
+    4. returns a tuple of a byte string with the denoised audio and np.ndarray with the probability of having a voice in each frame '''
+
+    denoiser.reset()
+    audio = AudioSegment(data=audio_bytes, sample_width=2, frame_rate=sample_rate, channels=1)
+    if sample_rate != RNNoise.sample_rate:
+        audio = audio.set_frame_rate(RNNoise.sample_rate)
+
+    audio_bytes_48k = audio.raw_data
+    frame_width = FRAME_LENGTH * 2
+    if len(audio_bytes_48k) % frame_width:
+        audio_bytes_48k += b'\x00' * (frame_width - len(audio_bytes_48k) % frame_width)
+
+    vad_probabilities = []
+    denoised_frames = []
+    for i in range(0, len(audio_bytes_48k), frame_width):
+        vad_probability, denoised_frame = denoiser.filter_frame(audio_bytes_48k[i:i+frame_width])
+        vad_probabilities.append(vad_probability)
+        denoised_frames.append(denoised_frame)
+
+    denoised_audio = AudioSegment(data=b''.join(denoised_frames), sample_width=2, frame_rate=RNNoise.sample_rate, channels=1)
+    if sample_rate != RNNoise.sample_rate:
+        denoised_audio = denoised_audio.set_frame_rate(sample_rate)
+    denoiser.reset()
+    return denoised_audio.raw_data, np.array(vad_probabilities, dtype=np.float32)
+
+
+# Paths under test. Each path gets (f_name_lib, audio_bytes, sample_rate, rng) and returns a byte string with the denoised audio, which is
+# compared with the reference (a shorter result is compared with the beginning of the reference, up to the padding of the last frame),
+# or None if the path is not applicable
+
+def path_filter_bytes(f_name_lib, audio_bytes, sample_rate, rng):
+    return RNNoise(f_name_lib).filter(audio_bytes, sample_rate=sample_rate)
+
+
+def path_filter_audiosegment(f_name_lib, audio_bytes, sample_rate, rng):
+    audio = AudioSegment(data=audio_bytes, sample_width=2, frame_rate=sample_rate, channels=1)
+    return RNNoise(f_name_lib).filter(audio).raw_data
+
+
+def path_filter_frames(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' Batched filter_frames() at 48 kHz with random batch sizes. '''
+
+    if sample_rate != RNNoise.sample_rate:
+        return None
+    samples = np.frombuffer(audio_bytes, dtype=np.int16)
+    samples = np.concatenate((samples, np.zeros(-len(samples) % FRAME_LENGTH, dtype=np.int16)))
+    frames = samples.reshape(-1, FRAME_LENGTH).astype(np.float32)
+
+    denoiser = RNNoise(f_name_lib)
+    position = 0
+    while position < len(frames):
+        batch_size = rng.randint(1, 64)
+        denoiser.filter_frames(frames[position:position+batch_size])
+        position += batch_size
+    return frames.astype(np.int16).tobytes()
+
+
+def path_filter_native_batch(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter() with the native shim for batched processing (skipped if the shim has not been built). '''
+
+    denoiser = RNNoise(f_name_lib)
+    if denoiser.batch_lib is None:
+        return None
+    return denoiser.filter(audio_bytes, sample_rate=sample_rate)
+
+
+def path_filter_per_frame(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter() with one ctypes call per frame (the fallback when the native shim is missing). '''
+
+    denoiser = RNNoise(f_name_lib)
+    denoiser.batch_lib = None
+    return denoiser.filter(audio_bytes, sample_rate=sample_rate)
+
+
+def path_filter_frames_of_streams(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter_frames_of_streams() at 48 kHz: the audio and synthetic audio in 2 streams, frame by frame. Streams must not affect each other. '''
+
+    if sample_rate != RNNoise.sample_rate:
+        return None
+    samples = np.frombuffer(audio_bytes, dtype=np.int16)
+    samples = np.concatenate((samples, np.zeros(-len(samples) % FRAME_LENGTH, dtype=np.int16)))
+    other_samples = generate_synthetic_audio(SEED + 1, len(samples) / sample_rate + 1, sample_rate)[:len(samples)]
+    frames = np.stack((samples, other_samples)).reshape(2, -1, FRAME_LENGTH).astype(np.float32)
+
+    denoisers = [RNNoise(f_name_lib), RNNoise(f_name_lib)]
+    for i in range(frames.shape[1]):
+        pair_frames = np.ascontiguousarray(frames[:, i])
+        RNNoise.filter_frames_of_streams(denoisers, pair_frames)
+        frames[:, i] = pair_frames
+
+    other_reference = np.frombuffer(reference_filter(RNNoise(f_name_lib), other_samples.tobytes(), sample_rate)[0], dtype=np.int16)
+    if not np.array_equal(frames[1].reshape(-1).astype(np.int16), other_reference[:len(other_samples)]):
+        return b''
+    return frames[0].reshape(-1).astype(np.int16).tobytes()
+
+
+def path_filter_with_cache(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter() with a cache: the first call is a miss, the second is a hit, both must be the same. '''
+
+    denoiser = RNNoise(f_name_lib, cache=DenoiseCache(max_memory_size_mb=16))
+    denoised_audio_miss = denoiser.filter(audio_bytes, sample_rate=sample_rate)
+    denoised_audio_hit = denoiser.filter(audio_bytes, sample_rate=sample_rate)
+    return denoised_audio_hit if denoised_audio_hit == denoised_audio_miss else b''
+
+
+def path_filter_skipping_silence(f_name_lib, audio_bytes, sample_rate, rng):
+    return RNNoise(f_name_lib).filter(audio_bytes, sample_rate=sample_rate, silence_floor_db=SILENCE_FLOOR_DB)
+
+
+def path_filter_g711(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' Fused G.711 path: must be the same as G.711 coding of the reference for the decoded input (the reference is computed here). '''
+
+    results = []
+    for encoding in ('ulaw', 'alaw'):
+        codes = g711_encode(np.frombuffer(audio_bytes, dtype=np.int16), encoding).tobytes()
+        denoised_codes = RNNoise(f_name_lib).filter(codes, sample_rate=sample_rate, encoding=encoding)
+        reference_audio = reference_filter(RNNoise(f_name_lib), g711_decode(codes, encoding).tobytes(), sample_rate)[0]
+        results.append(denoised_codes == g711_encode(np.frombuffer(reference_audio, dtype=np.int16), encoding).tobytes())
+    return path_filter_bytes(f_name_lib, audio_bytes, sample_rate, rng) if all(results) else b''
+
+
+def path_filter_wav(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter_wav() with .wav audio in a random format which holds the 16 bit samples exactly: 16, 24, 32 bit int, 32 bit float, or 2 channels
+    (the same channel twice or another channel selected with 'channel'). '''
+
+    samples = np.frombuffer(audio_bytes, dtype=np.int16)
+    wav_format = rng.choice(['int16', 'int24', 'int32', 'float32', 'stereo mixdown', 'stereo channel'])
+    channels, sample_width, wav_data = 1, 2, samples.tobytes()
+    if wav_format == 'int24':
+        sample_width = 3
+        wav_data = np.left_shift(samples.astype('<i4'), 8).view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    elif wav_format == 'int32':
+        sample_width, wav_data = 4, np.left_shift(samples.astype('<i4'), 16).tobytes()
+    elif wav_format == 'float32':
+        sample_width, wav_data = 4, (samples / 32768.0).astype('<f4').tobytes()
+    elif wav_format.startswith('stereo'):
+        other_samples = samples if wav_format == 'stereo mixdown' else samples[::-1]
+        channels, wav_data = 2, np.stack((other_samples, samples), axis=1).tobytes()
+
+    f_wav = io.BytesIO()
+    with wave.open(f_wav, 'wb') as wav_writer:
+        wav_writer.setnchannels(channels)
+        wav_writer.setsampwidth(sample_width)
+        wav_writer.setframerate(sample_rate)
+        wav_writer.writeframes(wav_data)
+    wav_data = bytearray(f_wav.getvalue())
+    if wav_format == 'float32':
+        wav_data[20:22] = (3).to_bytes(2, 'little')
+
+    channel = 1 if wav_format == 'stereo channel' else None
+    return RNNoise(f_name_lib).filter_wav(bytes(wav_data), channel=channel).raw_data
+
+
+def path_iter_filter(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' iter_filter() from an iterable with random chunk sizes and random block duration. '''
+
+    chunks = []
+    position = 0
+    while position < len(audio_bytes):
+        chunk_size = rng.randint(1, 5000)
+        chunks.append(audio_bytes[position:position+chunk_size])
+        position += chunk_size
+    block_duration_ms = 10 * rng.randint(1, 20)
+    return b''.join(block for vad_probability, block in RNNoise(f_name_lib).iter_filter(iter(chunks), sample_rate, block_duration_ms))
+
+
+def path_stream(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' RNNoiseStream with random chunk sizes (including chunks with an incomplete sample). '''
+
+    stream = RNNoiseStream(sample_rate, 1, 's16le', f_name_lib)
+    denoised_chunks = []
+    position = 0
+    while position < len(audio_bytes):
+        chunk_size = rng.randint(1, 3000)
+        denoised_chunks.append(stream.process(audio_bytes[position:position+chunk_size]))
+        position += chunk_size
+    denoised_chunks.append(stream.flush())
+    return b''.join(denoised_chunks)
+
+
+def path_stream_multichannel(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' RNNoiseStream with 3 interleaved f32le channels: the audio, synthetic audio and the audio again. Channels must not affect each other. '''
+
+    samples = np.frombuffer(audio_bytes, dtype=np.int16)
+    other_samples = generate_synthetic_audio(SEED + 1, len(samples) / sample_rate + 1, sample_rate)[:len(samples)]
+    interleaved_samples = np.stack((samples, other_samples, samples), axis=1).astype('<f4') / 32768.0
+
+    stream = RNNoiseStream(sample_rate, 3, 'f32le', f_name_lib)
+    data = interleaved_samples.tobytes()
+    denoised_chunks = []
+    position = 0
+    while position < len(data):
+        chunk_size = rng.randint(1, 12000)
+        denoised_chunks.append(stream.process(data[position:position+chunk_size]))
+        position += chunk_size
+    denoised_chunks.append(stream.flush())
+
+    denoised_samples = np.round(np.frombuffer(b''.join(denoised_chunks), dtype='<f4').reshape(-1, 3) * 32768.0).astype(np.int16)
+    other_reference = np.frombuffer(reference_filter(RNNoise(f_name_lib), other_samples.tobytes(), sample_rate)[0], dtype=np.int16)
+    if not np.array_equal(denoised_samples[:, 0], denoised_samples[:, 2]) or \
+       not np.array_equal(denoised_samples[:, 1], other_reference[:len(denoised_samples)]):
+        return b''
+    return denoised_samples[:, 0].tobytes()
+
+
+def path_process_streams(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' RNNoiseStream.process_streams() with 3 streams (the audio, synthetic audio and the audio again) and random block sizes of each stream
+    in each call. Streams must not affect each other. '''
+
+    samples = np.frombuffer(audio_bytes, dtype=np.int16)
+    other_samples = generate_synthetic_audio(SEED + 2, len(samples) / sample_rate + 1, sample_rate)[:len(samples)]
+    other_audio_bytes = other_samples.tobytes()
+
+    streams = [RNNoiseStream(sample_rate, 1, 's16le', f_name_lib) for i in range(3)]
+    datas = [audio_bytes, other_audio_bytes, audio_bytes]
+    positions = [0, 0, 0]
+    denoised_chunks = [[], [], []]
+    while any(position < len(data) for position, data in zip(positions, datas)):
+        blocks = []
+        for i, data in enumerate(datas):
+            chunk_size = rng.randint(0, 4000)
+            blocks.append(data[positions[i]:positions[i]+chunk_size])
+            positions[i] += chunk_size
+        for i, denoised_chunk in enumerate(RNNoiseStream.process_streams(streams, blocks)):
+            denoised_chunks[i].append(denoised_chunk)
+    denoised_audio = [b''.join(chunks) + stream.flush() for chunks, stream in zip(denoised_chunks, streams)]
+
+    other_reference = reference_filter(RNNoise(f_name_lib), other_audio_bytes, sample_rate)[0]
+    if denoised_audio[0] != denoised_audio[2] or denoised_audio[1] != other_reference[:len(denoised_audio[1])]:
+        return b''
+    return denoised_audio[0]
+
+
+def path_stream_state_migration(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' RNNoiseStream, whose state is moved to a new stream (as to another process) at a random position. '''
+
+    split_position = rng.randint(0, len(audio_bytes))
+    stream = RNNoiseStream(sample_rate, 1, 's16le', f_name_lib)
+    denoised_audio = stream.process(audio_bytes[:split_position])
+    state = stream.get_state()
+
+    new_stream = RNNoiseStream(sample_rate, 1, 's16le', f_name_lib)
+    new_stream.set_state(state)
+    return denoised_audio + new_stream.process(audio_bytes[split_position:]) + new_stream.flush()
+
+
+def path_threads(f_name_lib, audio_bytes, sample_rate, rng, number_of_threads=4):
+    ''' filter() in several threads at the same time (RNNoise runs without the GIL), each with its own RNNoise object. '''
+
+    results = [None] * number_of_threads
+    def denoise(i):
+        results[i] = RNNoise(f_name_lib).filter(audio_bytes, sample_rate=sample_rate)
+
+    threads = [threading.Thread(target=denoise, args=(i,)) for i in range(number_of_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results[0] if all(result == results[0] for result in results) else b''
+
+
+_process_pool = None
+
+def _denoise_in_process(task):
+    f_name_lib, audio_bytes, sample_rate = task
+    return RNNoise(f_name_lib).filter(audio_bytes, sample_rate=sample_rate)
+
+
+def path_processes(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter() in worker processes. '''
+
+    results = _process_pool.map(_denoise_in_process, [(f_name_lib, audio_bytes, sample_rate)] * 2)
+    return results[0] if results[0] == results[1] else b''
+
+
+def _denoise_pickled_in_process(task):
+    denoiser, audio_bytes, sample_rate = task
+    return denoiser.filter(audio_bytes, sample_rate=sample_rate)
+
+
+def path_pickled_processes(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter() of a pickled RNNoise object in worker processes (the object is restored lazily in each task). '''
+
+    results = _process_pool.map(_denoise_pickled_in_process, [(RNNoise(f_name_lib), audio_bytes, sample_rate)] * 2)
+    return results[0] if results[0] == results[1] else b''
+
+
+def _continue_stream_in_process(task):
+    stream, data = task
+    return stream.process(data) + stream.flush()
+
+
+def path_pickled_stream(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' RNNoiseStream, which is pickled at a random position and continued in a worker process. '''
+
+    split_position = rng.randint(0, len(audio_bytes))
+    stream = RNNoiseStream(sample_rate, 1, 's16le', f_name_lib)
+    denoised_audio = stream.process(audio_bytes[:split_position])
+    return denoised_audio + _process_pool.apply(_continue_stream_in_process, ((stream, audio_bytes[split_position:]),))
+
+
+def path_callback_adapter(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' CallbackAdapter with random float32 block sizes at 48 kHz: the output is delayed by the buffering latency (at other sample rates
+    the adapter uses its own resampler, so it is not compared). float32 blocks are used, because for int16 blocks the adapter clips
+    the output instead of the wrap-around of filter_frame(). '''
+
+    if sample_rate != RNNoise.sample_rate:
+        return None
+    samples = np.frombuffer(audio_bytes, dtype=np.int16)
+    number_of_samples = len(samples) + (-len(samples) % FRAME_LENGTH)
+    samples = np.concatenate((samples, np.zeros(2 * FRAME_LENGTH, dtype=np.int16))).astype(np.float32) / 32768.0
+    adapter = CallbackAdapter(sample_rate, 1, 1024, None, f_name_lib)
+
+    denoised_samples = np.zeros_like(samples)
+    position = 0
+    while position < len(samples):
+        block_size = min(rng.randint(1, 1024), len(samples) - position)
+        adapter.process(samples[position:position+block_size], out=denoised_samples[position:position+block_size])
+        position += block_size
+    denoised_samples = (denoised_samples * 32768.0).astype(np.int16)
+    return denoised_samples[adapter.buffering_latency:adapter.buffering_latency+number_of_samples].tobytes()
+
+
+def path_filter_file(f_name_lib, audio_bytes, sample_rate, rng):
+    ''' filter_file() with ffmpeg (only at 48 kHz, because ffmpeg resamples in its own way; skipped if ffmpeg is not installed). '''
+
+    if sample_rate != RNNoise.sample_rate or not shutil.which('ffmpeg'):
+        return None
+    folder_name = tempfile.mkdtemp()
+    try:
+        f_name_source = os.path.join(folder_name, 'source.wav')
+        f_name_denoised = os.path.join(folder_name, 'denoised.wav')
+        RNNoise(f_name_lib).write_wav(f_name_source, audio_bytes, sample_rate)
+        RNNoise(f_name_lib).filter_file(f_name_source, f_name_denoised, block_duration_ms=10 * rng.randint(1, 100))
+        with wave.open(f_name_denoised, 'rb') as f_denoised:
+            return f_denoised.readframes(f_denoised.getnframes())
+    finally:
+        shutil.rmtree(folder_name)
+
+
+def get_paths():
+    ''' Paths under test: tuples of a name, a function and a minimum SNR in dB relative to the reference (None - bit-exact). '''
+
+    return [('filter() bytes', path_filter_bytes, None),
+            ('filter() AudioSegment', path_filter_audiosegment, None),
+            ('filter_frames() batches', path_filter_frames, None),
+            ('filter() native batch', path_filter_native_batch, None),
+            ('filter() per-frame ctypes', path_filter_per_frame, None),
+            ('filter_frames_of_streams()', path_filter_frames_of_streams, None),
+            ('filter() with cache', path_filter_with_cache, None),
+            ('filter() silence_floor_db', path_filter_skipping_silence, SILENCE_FLOOR_MIN_SNR_DB),
+            ('filter() G.711', path_filter_g711, None),
+            ('filter_wav() formats', path_filter_wav, None),
+            ('iter_filter() chunks', path_iter_filter, None),
+            ('RNNoiseStream chunks', path_stream, None),
+            ('RNNoiseStream 3 channels', path_stream_multichannel, None),
+            ('RNNoiseStream.process_streams()', path_process_streams, None),
+            ('RNNoiseStream state migration', path_stream_state_migration, None),
+            ('filter() 4 threads', path_threads, None),
+            ('filter() processes', path_processes, None),
+            ('filter() pickled RNNoise', path_pickled_processes, None),
+            ('RNNoiseStream pickled', path_pickled_stream, None),
+            ('CallbackAdapter blocks', path_callback_adapter, None),
+            ('filter_file() ffmpeg', path_filter_file, None)]
+
+
+def compare(reference_audio, denoised_audio, sample_rate):
+    ''' Comparing the result of a path with the reference.
+    1. reference_audio - byte string with the reference result
+    2. denoised_audio - byte string with the result of the path
+    3. sample_rate - sample rate of the audio
+    4. returns a tuple of the maximum difference in LSB and SNR in dB relative to the reference (None if lengths do not match) '''
+
+    reference_samples = np.frombuffer(reference_audio, dtype=np.int16).astype(np.float64)
+    denoised_samples = np.frombuffer(denoised_audio, dtype=np.int16).astype(np.float64)
+
+    # The result can be shorter than the reference only by the padding of the last frame
+    max_padding = int(np.ceil(FRAME_LENGTH * sample_rate / RNNoise.sample_rate)) + 1
+    if len(denoised_samples) > len(reference_samples) or len(denoised_samples) < len(reference_samples) - max_padding:
+        return None
+    if not len(denoised_samples):
+        return 0, float('inf')
+
+    difference = denoised_samples - reference_samples[:len(denoised_samples)]
+    max_difference = int(np.max(np.abs(difference)))
+    if max_difference == 0:
+        return 0, float('inf')
+    snr_db = 10 * np.log10(max(np.sum(reference_samples[:len(denoised_samples)]**2), 1.0) / np.sum(difference**2))
+    return max_difference, snr_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Conformance tests of all processing paths of RNNoise_Wrapper.')
+    parser.add_argument('-m', '--models', type=str, nargs='+', default=None,
+                        help='Names/paths of RNNoise libraries (default is all libraries from rnnoise_wrapper/libs)')
+    parser.add_argument('-r', '--sample_rates', type=int, nargs='+', default=SAMPLE_RATES,
+                        help='Sample rates of inputs (default is {})'.format(' '.join(str(rate) for rate in SAMPLE_RATES)))
+    parser.add_argument('-d', '--max_duration', type=float, default=None,
+                        help='Maximum duration of each test audio in seconds (default is without limit)')
+    args = parser.parse_args()
+
+    f_names_libs = args.models or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rnnoise_wrapper', 'libs', 'librnnoise*')))
+    test_audio = load_test_audio(max_duration=args.max_duration)
+    test_audio.append(('synthetic_{}'.format(SEED), generate_synthetic_audio(SEED, args.max_duration or 6.0), 48000))
+
+    global _process_pool
+    _process_pool = multiprocessing.Pool(2)
+
+    paths = get_paths()
+    statistics = {name: {'cases': 0, 'skipped': 0, 'failed': 0, 'max_difference': 0, 'min_snr_db': float('inf')} for name, path, min_snr_db in paths}
+    rng = random.Random(SEED)
+    start_time = time.time()
+    try:
+        for f_name_lib in f_names_libs:
+            for name_audio, samples, source_sample_rate in test_audio:
+                for sample_rate in args.sample_rates:
+                    audio_bytes = convert_sample_rate(samples, source_sample_rate, sample_rate).tobytes()
+                    reference_audio = reference_filter(RNNoise(f_name_lib), audio_bytes, sample_rate)[0]
+
+                    for name_path, path, min_snr_db in paths:
+                        denoised_audio = path(f_name_lib, audio_bytes, sample_rate, rng)
+                        if denoised_audio is None:
+                            statistics[name_path]['skipped'] += 1
+                            continue
+
+                        path_statistics = statistics[name_path]
+                        path_statistics['cases'] += 1
+                        result = compare(reference_audio, denoised_audio, sample_rate)
+                        if result is None:
+                            path_statistics['failed'] += 1
+                            print("[E] {}: model '{}', audio '{}', {} Hz: length {} instead of {}".format(name_path, os.path.basename(f_name_lib),
+                                  name_audio, sample_rate, len(denoised_audio)//2, len(reference_audio)//2))
+                            continue
+
+                        max_difference, snr_db = result
+                        path_statistics['max_difference'] = max(path_statistics['max_difference'], max_difference)
+                        path_statistics['min_snr_db'] = min(path_statistics['min_snr_db'], snr_db)
+                        if (min_snr_db is None and max_difference > 0) or (min_snr_db is not None and snr_db < min_snr_db):
+                            path_statistics['failed'] += 1
+                            print("[E] {}: model '{}', audio '{}', {} Hz: difference up to {} LSB, SNR {:.1f} dB".format(name_path,
+                                  os.path.basename(f_name_lib), name_audio, sample_rate, max_difference, snr_db))
+                print("[i] Model '{}' checked".format(os.path.basename(f_name_lib)))
+    finally:
+        _process_pool.terminate()
+
+    print('\nModels: {}, audio: {}, sample rates: {}, time: {:.1f} s'.format(len(f_names_libs), len(test_audio),
+                                                                          ', '.join(str(rate) for rate in args.sample_rates), time.time() - start_time))
+    for name_path, path, min_snr_db in paths:
+        path_statistics = statistics[name_path]
+        status = 'SKIPPED' if not path_statistics['cases'] else 'FAIL' if path_statistics['failed'] else 'OK'
+        print('\t{:32} {:8} cases {:4}, skipped {:4}, failed {:4}, max difference {:5} LSB, min SNR {:6.1f} dB (required: {})'.format(
+              name_path, status, path_statistics['cases'], path_statistics['skipped'], path_statistics['failed'], path_statistics['max_difference'],
+              path_statistics['min_snr_db'], 'bit-exact' if min_snr_db is None else '{:.1f} dB'.format(min_snr_db)))
+
+    if not any(path_statistics['failed'] for path_statistics in statistics.values()):
+        print('\nALL OK')
+    else:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Parallel evaluation of several RNNoise models on a set of audio recordings with objective metrics.
+
+Each pair (model, audio) is processed in a process pool, each worker process keeps one RNNoise object per model. For each pair the following
+metrics are computed:
+    - si_sdr_db - scale-invariant signal-to-distortion ratio relative to the clean reference (only if the reference is available)
+    - seg_snr_db - segmental SNR relative to the clean reference, 10 ms segments limited to [-10, 35] dB (only if the reference is available)
+    - vad_agreement - share of frames where the voice decision of the model (probability >= 0.5) matches the energy VAD of the reference
+      (of the clean reference, if it is available, otherwise of the source audio)
+    - mean_rms - mean RMS of denoised audio
+    - rt_factor - audio length divided by processing time
+    - frames_per_second - number of 10 ms frames denoised per second of processing time (on one core, all frames are denoised with one
+      RNNoise.filter_frames() call)
+
+The summary of each model also contains its architecture read from the library (layer sizes and number of weights), so lighter models trained
+with smaller layers (see training_utils/rnn_train_mod.py) can be compared with the original ones by speed against quality.
+
+Source-side analyses (conversion to 48 kHz, reference alignment, energy VAD and metrics of the source audio) are cached by the content hash
+of the audio, so repeated runs only perform noise reduction. The result is saved as one .csv and one .json report.
+
+Dependencies: pydub, numpy.
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+
+is_whl_test = False
+if is_whl_test:
+    for i, path in enumerate(sys.path):
+        if path == os.getcwd():
+            del sys.path[i]
+            break
+
+from rnnoise_wrapper import RNNoise
+
+
+ANALYSIS_VERSION = 1
+SAMPLE_RATE = RNNoise.sample_rate
+FRAME_SIZE = int(RNNoise.sample_rate * RNNoise.frame_duration_ms / 1000)
+
+# RNNoise output is delayed by one frame (overlap of the analysis window), the denoised audio is shifted back before computing metrics
+ALGORITHMIC_DELAY = FRAME_SIZE
+
+# Energy VAD: frame is voiced if its energy is not lower than the maximum frame energy minus this value
+ENERGY_VAD_RANGE_DB = 30.0
+VAD_THRESHOLD = 0.5
+
+
+def hash_audio(f_name_audio):
+    with open(f_name_audio, 'rb') as f_audio:
+        return hashlib.sha1(f_audio.read()).hexdigest()
+
+
+def frame_energies_db(audio_data):
+    ''' Energy of each 10 ms frame in dB. '''
+
+    number_of_frames = len(audio_data) // FRAME_SIZE
+    frames = audio_data[:number_of_frames*FRAME_SIZE].reshape(number_of_frames, FRAME_SIZE)
+    return 10 * np.log10(np.mean(frames**2, axis=1) + 1e-9)
+
+
+def energy_vad(audio_data):
+    ''' Simple energy VAD for each 10 ms frame. '''
+
+    energies = frame_energies_db(audio_data)
+    if len(energies) == 0:
+        return np.zeros(0, dtype=bool)
+    return energies >= max(energies.max() - ENERGY_VAD_RANGE_DB, -60.0)
+
+
+def si_sdr(estimate, reference):
+    ''' Scale-invariant signal-to-distortion ratio in dB. '''
+
+    length = min(len(estimate), len(reference))
+    estimate = estimate[:length] - np.mean(estimate[:length])
+    reference = reference[:length] - np.mean(reference[:length])
+    alpha = np.dot(estimate, reference) / (np.dot(reference, reference) + 1e-9)
+    target = alpha * reference
+    distortion = estimate - target
+    return 10 * np.log10((np.dot(target, target) + 1e-9) / (np.dot(distortion, distortion) + 1e-9))
+
+
+def segmental_snr(estimate, reference, min_db=-10.0, max_db=35.0):
+    ''' Segmental SNR in dB with 10 ms segments, each segment value is limited to [min_db, max_db]. '''
+
+    number_of_frames = min(len(estimate), len(reference)) // FRAME_SIZE
+    estimate = estimate[:number_of_frames*FRAME_SIZE].reshape(number_of_frames, FRAME_SIZE)
+    reference = reference[:number_of_frames*FRAME_SIZE].reshape(number_of_frames, FRAME_SIZE)
+    snr = 10 * np.log10((np.sum(reference**2, axis=1) + 1e-9) / (np.sum((reference - estimate)**2, axis=1) + 1e-9))
+    return float(np.mean(np.clip(snr, min_db, max_db)))
+
+
+def read_audio_48k(f_name_audio, denoiser):
+    ''' Reading audio and converting it to 16 bit, mono, 48 kHz. Returns np.ndarray with float64 samples. '''
+
+    audio = denoiser.read_wav(f_name_audio, sample_rate=SAMPLE_RATE)
+    return np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float64)
+
+
+_denoisers = {}
+
+
+def get_denoiser(f_name_lib):
+    ''' RNNoise object for the model, one per worker process and model. '''
+
+    if f_name_lib not in _denoisers:
+        _denoisers[f_name_lib] = RNNoise(f_name_lib=f_name_lib)
+    return _denoisers[f_name_lib]
+
+
+def analyze_source(task):
+    ''' Process pool task: source-side analysis of one audio with caching by content hash.
+
+    1. task - tuple of source audio name, clean reference audio name (or None) and cache folder name
+    2. returns the name of the .npz file with the analysis '''
+
+    f_name_audio, f_name_reference_audio, cache_folder = task
+
+    key = hash_audio(f_name_audio)
+    if f_name_reference_audio:
+        key = hashlib.sha1('{}:{}'.format(key, hash_audio(f_name_reference_audio)).encode('utf-8')).hexdigest()
+    f_name_analysis = os.path.join(cache_folder, 'source_v{}_{}.npz'.format(ANALYSIS_VERSION, key))
+    if os.path.isfile(f_name_analysis):
+        return f_name_analysis
+
+    denoiser = get_denoiser(None)
+    audio_data = read_audio_48k(f_name_audio, denoiser)
+    analysis = {'audio': audio_data.astype(np.int16), 'duration': len(audio_data) / SAMPLE_RATE}
+
+    if f_name_reference_audio:
+        reference_data = read_audio_48k(f_name_reference_audio, denoiser)
+        analysis['reference'] = reference_data.astype(np.int16)
+        analysis['vad'] = energy_vad(reference_data)
+        analysis['source_si_sdr_db'] = si_sdr(audio_data, reference_data)
+        analysis['source_seg_snr_db'] = segmental_snr(audio_data, reference_data)
+    else:
+        analysis['vad'] = energy_vad(audio_data)
+    analysis['source_mean_rms'] = np.sqrt(np.mean(audio_data**2)) / 32768
+
+    f_name_analysis_tmp = f_name_analysis[:-len('.npz')] + '.{}.tmp.npz'.format(os.getpid())
+    np.savez(f_name_analysis_tmp, **analysis)
+    os.replace(f_name_analysis_tmp, f_name_analysis)
+    return f_name_analysis
+
+
+def evaluate(task):
+    ''' Process pool task: noise reduction of one audio with one model and computation of metrics.
+
+    1. task - tuple of model (library name), source audio name and the name of the .npz file with the source analysis
+    2. returns a dict with metrics '''
+
+    f_name_lib, f_name_audio, f_name_analysis = task
+    analysis = np.load(f_name_analysis)
+    audio_data = analysis['audio']
+
+    denoiser = get_denoiser(f_name_lib)
+    denoiser.reset()
+
+    number_of_frames = -(-(len(audio_data) + ALGORITHMIC_DELAY) // FRAME_SIZE)
+    padded_audio_data = np.zeros(number_of_frames*FRAME_SIZE, dtype=np.int16)
+    padded_audio_data[:len(audio_data)] = audio_data
+    frames = padded_audio_data.reshape(number_of_frames, FRAME_SIZE).astype(np.float32)
+
+    # All frames are denoised in place with one filter_frames() call (the same audio as with filter_frame() for each frame), so the speed
+    # is measured without the overhead of a Python loop over frames
+    start_time = time.time()
+    vad_probabilities = denoiser.filter_frames(frames)
+    elapsed_time = time.time() - start_time
+
+    denoised_data = frames.reshape(-1).astype(np.int16)
+    denoised_data = denoised_data[ALGORITHMIC_DELAY:ALGORITHMIC_DELAY+len(audio_data)].astype(np.float64)
+    reference_vad = analysis['vad']
+    model_vad = vad_probabilities[ALGORITHMIC_DELAY//FRAME_SIZE:][:len(reference_vad)] >= VAD_THRESHOLD
+
+    result = {
+        'model': f_name_lib,
+        'audio': f_name_audio,
+        'duration_s': float(analysis['duration']),
+        'si_sdr_db': float('nan'),
+        'seg_snr_db': float('nan'),
+        'source_si_sdr_db': float('nan'),
+        'source_seg_snr_db': float('nan'),
+        'vad_agreement': float(np.mean(model_vad == reference_vad[:len(model_vad)])) if len(model_vad) else float('nan'),
+        'mean_rms': float(np.sqrt(np.mean(denoised_data**2)) / 32768),
+        'source_mean_rms': float(analysis['source_mean_rms']),
+        'processing_time_s': elapsed_time,
+        'rt_factor': float(analysis['duration']) / max(elapsed_time, 1e-9),
+        'number_of_frames': number_of_frames,
+        'frames_per_second': number_of_frames / max(elapsed_time, 1e-9),
+    }
+    if 'reference' in analysis:
+        reference_data = analysis['reference'].astype(np.float64)
+        result['si_sdr_db'] = float(si_sdr(denoised_data, reference_data))
+        result['seg_snr_db'] = segmental_snr(denoised_data, reference_data)
+        result['source_si_sdr_db'] = float(analysis['source_si_sdr_db'])
+        result['source_seg_snr_db'] = float(analysis['source_seg_snr_db'])
+    return result
+
+
+def get_model_infos(models):
+    ''' Architecture of each model: sizes of layers as a string like '24/24/48/96' (input dense, VAD GRU, noise GRU, denoise GRU) and
+    the number of weights. '''
+
+    model_infos = {}
+    for f_name_lib in models:
+        model_info = RNNoise(f_name_lib=f_name_lib).get_model_info()
+        model_infos[f_name_lib] = {'layer_sizes': '/'.join(str(model_info[layer_name + '_size']) for layer_name in
+                                                           ['input_dense', 'vad_gru', 'noise_gru', 'denoise_gru']),
+                                   'number_of_weights': model_info['number_of_weights']}
+    return model_infos
+
+
+def summarize(results, models, model_infos=None):
+    ''' Aggregated metrics for each model: mean over all audio (NaN values are ignored), total RT factor and frames per second, architecture
+    of the model (if model_infos is passed). '''
+
+    summary = []
+    for f_name_lib in models:
+        model_results = [result for result in results if result['model'] == f_name_lib]
+        if not model_results:
+            continue
+        row = {'model': f_name_lib, 'number_of_audio': len(model_results)}
+        if model_infos:
+            row.update(model_infos[f_name_lib])
+        for metric in ['si_sdr_db', 'seg_snr_db', 'source_si_sdr_db', 'source_seg_snr_db', 'vad_agreement', 'mean_rms']:
+            values = np.array([result[metric] for result in model_results])
+            row[metric] = float(np.nanmean(values)) if np.isfinite(values).any() else float('nan')
+        total_duration = sum(result['duration_s'] for result in model_results)
+        total_time = sum(result['processing_time_s'] for result in model_results)
+        row['duration_s'] = total_duration
+        row['processing_time_s'] = total_time
+        row['rt_factor'] = total_duration / max(total_time, 1e-9)
+        row['frames_per_second'] = sum(result['number_of_frames'] for result in model_results) / max(total_time, 1e-9)
+        summary.append(row)
+    return summary
+
+
+def search_audio(folder_names):
+    ''' Recursive search of source .wav audio (denoised audio from comparative tests are skipped). '''
+
+    f_names_audio = []
+    for folder_name in folder_names:
+        for path, folder_names_in_path, f_names in os.walk(folder_name):
+            for f_name in f_names:
+                if f_name.rfind('.wav') != -1 and f_name.rfind('denoised') == -1 and f_name.rfind('rnnoise') == -1:
+                    f_names_audio.append(os.path.join(path, f_name))
+    return sorted(f_names_audio)
+
+
+def create_and_parse_args():
+    parser = argparse.ArgumentParser(description='Parallel evaluation of RNNoise models on audio recordings with objective metrics ' + \
+                                                 '(SI-SDR, segmental SNR, VAD agreement, RT factor). Saves one .csv and one .json report.')
+    parser.add_argument('-m', '--models', type=str, default='librnnoise_default,librnnoise_5h_b_500k,librnnoise_5h_ru_500k',
+                        help='Names/paths of RNNoise libraries, separated by commas (default is ' + \
+                             '"librnnoise_default,librnnoise_5h_b_500k,librnnoise_5h_ru_500k")')
+    parser.add_argument('-f', '--folders', type=str, default='test_audio/comparative_tests',
+                        help='Folders with source .wav audio, separated by commas (default is "test_audio/comparative_tests")')
+    parser.add_argument('-r', '--reference_folder', type=str, default=None,
+                        help='Folder with clean reference .wav audio with the same names as source audio (SI-SDR and segmental SNR ' + \
+                             'are computed only for audio with reference)')
+    parser.add_argument('-o', '--report', type=str, default='evaluation_report',
+                        help='Report name without extension, .csv and .json are saved (default is "evaluation_report")')
+    parser.add_argument('-c', '--cache_folder', type=str, default='.evaluation_cache',
+                        help='Folder for cached source-side analyses (default is ".evaluation_cache")')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes (default is the number of CPU cores)')
+    return parser.parse_args()
+
+
+def main():
+    args = create_and_parse_args()
+
+    models = [model.strip() for model in args.models.split(',')]
+    f_names_audio = search_audio([folder_name.strip() for folder_name in args.folders.split(',')])
+    print('[i] Evaluation of {} model(-s) on {} audio'.format(len(models), len(f_names_audio)))
+
+    if not os.path.exists(args.cache_folder):
+        os.makedirs(args.cache_folder)
+
+    analysis_tasks = []
+    for f_name_audio in f_names_audio:
+        f_name_reference_audio = None
+        if args.reference_folder:
+            f_name_reference_audio = os.path.join(args.reference_folder, os.path.basename(f_name_audio))
+            if not os.path.isfile(f_name_reference_audio):
+                f_name_reference_audio = None
+        analysis_tasks.append((f_name_audio, f_name_reference_audio, args.cache_folder))
+
+    start_time = time.time()
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        f_names_analysis = pool.map(analyze_source, analysis_tasks)
+        print('[i] Source-side analyses are ready in {:.1f} s'.format(time.time() - start_time))
+
+        tasks = [(f_name_lib, f_name_audio, f_name_analysis) for f_name_lib in models
+                                                             for f_name_audio, f_name_analysis in zip(f_names_audio, f_names_analysis)]
+        results = []
+        for i, result in enumerate(pool.imap_unordered(evaluate, tasks, chunksize=4)):
+            results.append(result)
+            if (i + 1) % 100 == 0 or i + 1 == len(tasks):
+                print('[i] Processed {} of {}'.format(i + 1, len(tasks)))
+    finally:
+        pool.terminate()
+    elapsed_time = time.time() - start_time
+
+    results = sorted(results, key=lambda result: (models.index(result['model']), result['audio']))
+    model_infos = get_model_infos(models)
+    for result in results:
+        result.update(model_infos[result['model']])
+    summary = summarize(results, models, model_infos)
+
+    fieldnames = ['model', 'layer_sizes', 'number_of_weights', 'audio', 'duration_s', 'si_sdr_db', 'seg_snr_db', 'source_si_sdr_db',
+                  'source_seg_snr_db', 'vad_agreement', 'mean_rms', 'source_mean_rms', 'processing_time_s', 'rt_factor', 'frames_per_second']
+    with open(args.report + '.csv', 'w', newline='') as f_report:
+        writer = csv.DictWriter(f_report, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+        for row in summary:
+            row_for_csv = dict(row, audio='ALL')
+            writer.writerow(row_for_csv)
+
+    with open(args.report + '.json', 'w') as f_report:
+        json.dump({'summary': summary, 'results': results}, f_report, indent=1)
+
+    print('\n[i] Summary (wall time {:.1f} s):'.format(elapsed_time))
+    for row in summary:
+        print("\tmodel '{}' ({}, {} weights): SI-SDR {:.2f} dB, seg. SNR {:.2f} dB, VAD agreement {:.3f}, mean RMS {:.4f}, speed {:.1f} RT, " \
+              "{:.0f} frames/s".format(row['model'], row['layer_sizes'], row['number_of_weights'], row['si_sdr_db'], row['seg_snr_db'],
+                                       row['vad_agreement'], row['mean_rms'], row['rt_factor'], row['frames_per_second']))
+    print("[i] Report saved in '{}.csv' and '{}.json'".format(args.report, args.report))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,7 +30,9 @@ setup(
     include_package_data=True,
     entry_points={
         'console_scripts':
-            ['rnnoise_wrapper = rnnoise_wrapper.cli:denoise']
+            ['rnnoise_wrapper = rnnoise_wrapper.cli:denoise',
+             'rnnoise_wrapper_server = rnnoise_wrapper.server:main',
+             'rnnoise_wrapper_autotune = rnnoise_wrapper.autotune:main']
         },
     classifiers=[
         'Intended Audience :: Developers',
@@ -16,12 +16,26 @@ import time
 import platform
 import signal
 import curses
+import json
 import argparse
 from random import shuffle
 from itertools import chain
 from shutil import copyfile, rmtree
 
 
+FOLDER_NAMES_WITH_SPEECH = [
+    'russian_speech',
+    'read_speech',
+    'french_data',
+    'german_speech',
+    'italian_speech',
+    'spanish_speech'
+]
+
+# Saved in the folder with balanced speech: the name of the source folder (language) of each copied .wav audio
+F_NAME_LANGUAGE_FOLDERS = 'language_folders.json'
+
+
 def create_and_parse_args(root_folder, folder_names_with_speech, folder_name_for_balanced_speech):
     ''' Creating and parsing command line arguments. Returns updated `root_folder`, `folder_names_with_speech` and `folder_name_for_balanced_speech`. '''
 
@@ -56,14 +70,7 @@ def main():
     curses.setupterm()
 
     root_folder = '/home/vlad/172.16.10.10/NSNet_dataset/datasets/clean/'
-    folder_names_with_speech = [
-        'russian_speech',
-        'read_speech',
-        'french_data',
-        'german_speech',
-        'italian_speech',
-        'spanish_speech'
-    ]
+    folder_names_with_speech = list(FOLDER_NAMES_WITH_SPEECH)
     folder_name_for_balanced_speech = 'all_balanced_speech/'
 
     root_folder, folder_names_with_speech, folder_name_for_balanced_speech = create_and_parse_args(root_folder, folder_names_with_speech,
@@ -131,6 +138,8 @@ def main():
 
     f_names_all_wavs = [f_name_wav for f_name in folder_info for f_name_wav, f_size_wav in folder_info[f_name]['wavs']]
     f_names_all_wavs = list(chain(f_names_all_wavs))
+    language_folders = {f_name_wav[f_name_wav.rfind('/')+1:]: folder_name for folder_name in folder_info
+                        for f_name_wav, f_size_wav in folder_info[folder_name]['wavs']}
     elapsed_time_per_file = 0.0
     print("\n[i] Copying each remaining .wav audio to '{}'... 0 of {}".format(folder_name_for_balanced_speech, len(f_names_all_wavs)))
     for i, f_name_wav in enumerate(f_names_all_wavs):
@@ -148,6 +157,9 @@ def main():
     print("[i] Copying each remaining .wav audio to '{}'... {} of {}                ".format(
             folder_name_for_balanced_speech, len(f_names_all_wavs), len(f_names_all_wavs)))
 
+    with open(root_folder + folder_name_for_balanced_speech + F_NAME_LANGUAGE_FOLDERS, 'w') as f_language_folders:
+        json.dump(language_folders, f_language_folders, indent=1)
+
 
 if __name__ == '__main__':
     main()
@@ -19,16 +19,9 @@ def printVector(f, vector, name):
     v = np.reshape(vector, (-1));
     #print('static const float ', name, '[', len(v), '] = \n', file=f)
     f.write('static const rnn_weight {}[{}] = {{\n  '.format(name, len(v)))
-    for i in range(0, len(v)):
-        f.write('{}'.format(min(127, int(round(256*v[i])))))
-        if (i!=len(v)-1):
-            f.write(',')
-        else:
-            break;
-        if (i%8==7):
-            f.write("\n  ")
-        else:
-            f.write(" ")
+    # Formatting of the whole vector at once: 8 values per line (the same output as writing element by element)
+    values = [str(value) for value in np.minimum(127, np.round(256*v)).astype(np.int64)]
+    f.write(',\n  '.join(', '.join(values[i:i+8]) for i in range(0, len(values), 8)))
     #print(v, file=f)
     f.write('\n};\n\n')
     return;
@@ -90,38 +83,43 @@ class WeightClip(Constraint):
         return {'name': self.__class__.__name__, 'c': self.c}
 
 
-model = load_model(sys.argv[1], custom_objects={'msse': msse, 'mean_squared_sqrt_error': mean_squared_sqrt_error, 'my_crossentropy': my_crossentropy, 'mycost': mycost, 'WeightClip': WeightClip})
+def dump_model(f_name_weights, f_name_c, f_name_h):
+    model = load_model(f_name_weights, custom_objects={'msse': msse, 'mean_squared_sqrt_error': mean_squared_sqrt_error, 'my_crossentropy': my_crossentropy, 'mycost': mycost, 'WeightClip': WeightClip})
 
-weights = model.get_weights()
+    weights = model.get_weights()
 
-f = open(sys.argv[2], 'w')
-hf = open(sys.argv[3], 'w')
+    f = open(f_name_c, 'w')
+    hf = open(f_name_h, 'w')
 
-f.write('/*This file is automatically generated from a Keras model*/\n\n')
-f.write('#ifdef HAVE_CONFIG_H\n#include "config.h"\n#endif\n\n#include "rnn.h"\n#include "rnn_data.h"\n\n')
+    f.write('/*This file is automatically generated from a Keras model*/\n\n')
+    f.write('#ifdef HAVE_CONFIG_H\n#include "config.h"\n#endif\n\n#include "rnn.h"\n#include "rnn_data.h"\n\n')
 
-hf.write('/*This file is automatically generated from a Keras model*/\n\n')
-hf.write('#ifndef RNN_DATA_H\n#define RNN_DATA_H\n\n#include "rnn.h"\n\n')
+    hf.write('/*This file is automatically generated from a Keras model*/\n\n')
+    hf.write('#ifndef RNN_DATA_H\n#define RNN_DATA_H\n\n#include "rnn.h"\n\n')
 
-hf.write('struct RNNModel {\n')
-layer_list = []
-struct_rnnmodel_buf = ['const struct RNNModel rnnoise_model_orig = {\n']
-for i, layer in enumerate(model.layers):
-    if len(layer.get_weights()) > 0:
-        printLayer(f, hf, struct_rnnmodel_buf, layer)
-    if len(layer.get_weights()) > 2:
-        layer_list.append(layer.name)
-struct_rnnmodel_buf[-1] = struct_rnnmodel_buf[-1].replace(',\n', '')
-struct_rnnmodel_buf.append('};\n')
-f.writelines(struct_rnnmodel_buf)
-hf.write('};\n\n')
+    hf.write('struct RNNModel {\n')
+    layer_list = []
+    struct_rnnmodel_buf = ['const struct RNNModel rnnoise_model_orig = {\n']
+    for i, layer in enumerate(model.layers):
+        if len(layer.get_weights()) > 0:
+            printLayer(f, hf, struct_rnnmodel_buf, layer)
+        if len(layer.get_weights()) > 2:
+            layer_list.append(layer.name)
+    struct_rnnmodel_buf[-1] = struct_rnnmodel_buf[-1].replace(',\n', '')
+    struct_rnnmodel_buf.append('};\n')
+    f.writelines(struct_rnnmodel_buf)
+    hf.write('};\n\n')
 
-hf.write('struct RNNState {\n  const RNNModel *model;\n')
-for i, name in enumerate(layer_list):
-    hf.write('  float *{}_state;\n'.format(name)) 
-hf.write('};\n\n')
+    hf.write('struct RNNState {\n  const RNNModel *model;\n')
+    for i, name in enumerate(layer_list):
+        hf.write('  float *{}_state;\n'.format(name)) 
+    hf.write('};\n\n')
 
-hf.write('\n#endif\n')
+    hf.write('\n#endif\n')
 
-f.close()
-hf.close()
+    f.close()
+    hf.close()
+
+
+if __name__ == '__main__':
+    dump_model(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Export of trained weights to a compiled RNNoise library with a content-addressed build cache.
+
+The cache key is a hash of the weights file, the RNNoise source archive and `dump_rnn_mod.py`. If a library with the same key has already been
+built, it is reused. Otherwise the weights are dumped to C and only the generated `rnn_data.c`/`rnn_data.h` are recompiled in a persistent,
+already configured RNNoise build tree (unzip, autogen and configure are performed once per source archive). The resulting library is registered
+in `rnnoise_wrapper/libs` as `librnnoise_<name>.so.0.4.1`.
+
+Models with any layer sizes are supported (see the layer size arguments of rnn_train_mod.py): the RNNoise source keeps buffers of MAX_NEURONS
+(128) values for each layer, so for larger layers MAX_NEURONS in `rnn.h` is increased to fit the dumped model.
+'''
+
+import os
+import re
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import subprocess
+
+
+F_NAME_LIB = 'librnnoise.so.0.4.1'
+F_NAME_DUMP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dump_rnn_mod.py')
+DEFAULT_MAX_NEURONS = 128
+
+
+def hash_file(f_name, block_size=1 << 20):
+    ''' SHA-256 of file contents. '''
+
+    file_hash = hashlib.sha256()
+    with open(f_name, 'rb') as f_data:
+        for block in iter(lambda: f_data.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def replace_if_changed(f_name_new, f_name_target):
+    ''' Replacing `f_name_target` with `f_name_new` only if their contents differ (so that make does not rebuild unchanged files).
+    Returns True if the file has been replaced. '''
+
+    if os.path.isfile(f_name_target):
+        with open(f_name_new, 'rb') as f_new, open(f_name_target, 'rb') as f_target:
+            if f_new.read() == f_target.read():
+                return False
+    shutil.copyfile(f_name_new, f_name_target)
+    return True
+
+
+def get_max_neurons(f_name_c):
+    ''' Minimum value of MAX_NEURONS from rnn.h for the model dumped to rnn_data.c: each layer must fit in MAX_NEURONS values, inputs of the
+    noise and denoise GRU layers (concatenations of other layers and features) - in 3*MAX_NEURONS values.
+
+    1. f_name_c - name of rnn_data.c generated by dump_rnn_mod.py
+    2. returns MAX_NEURONS (not less than the default 128) '''
+
+    with open(f_name_c, 'r') as f_c:
+        layer_sizes = [(int(nb_inputs), int(nb_neurons)) for nb_inputs, nb_neurons in re.findall(r'(\d+), (\d+), ACTIVATION_', f_c.read())]
+    if not layer_sizes:
+        raise ValueError("no layers found in '{}'".format(f_name_c))
+
+    max_neurons = max(max(nb_neurons for nb_inputs, nb_neurons in layer_sizes), max(-(-nb_inputs // 3) for nb_inputs, nb_neurons in layer_sizes))
+    return max(DEFAULT_MAX_NEURONS, max_neurons)
+
+
+def set_max_neurons(f_name_rnn_h, max_neurons):
+    ''' Setting MAX_NEURONS in rnn.h of the build tree (the file is rewritten only if the value changes).
+    1. f_name_rnn_h - name of rnn.h
+    2. max_neurons - new value
+    3. returns True if the file has been changed '''
+
+    with open(f_name_rnn_h, 'r') as f_rnn_h:
+        rnn_h = f_rnn_h.read()
+    new_rnn_h = re.sub(r'#define MAX_NEURONS \d+', '#define MAX_NEURONS {}'.format(max_neurons), rnn_h)
+    if new_rnn_h == rnn_h:
+        return False
+    with open(f_name_rnn_h, 'w') as f_rnn_h:
+        f_rnn_h.write(new_rnn_h)
+    return True
+
+
+def prepare_build_tree(f_name_rnnoise_source, cache_folder, source_hash):
+    ''' Preparation of a persistent RNNoise build tree: unzip, autogen and configure are performed only once for each source archive.
+
+    1. f_name_rnnoise_source - .zip archive with RNNoise source
+    2. cache_folder - folder of the build cache
+    3. source_hash - hash of the source archive
+    4. returns the build tree folder name '''
+
+    folder_name_build = os.path.join(cache_folder, 'rnnoise-{}'.format(source_hash[:12]))
+    f_name_configured = os.path.join(folder_name_build, '.configured')
+    if os.path.isfile(f_name_configured):
+        return folder_name_build
+
+    print("[i] Preparing build tree '{}'...".format(folder_name_build))
+    if os.path.exists(folder_name_build):
+        shutil.rmtree(folder_name_build)
+
+    folder_name_tmp = tempfile.mkdtemp(dir=cache_folder)
+    try:
+        subprocess.check_call(['unzip', '-q', os.path.abspath(f_name_rnnoise_source), '-d', folder_name_tmp])
+        os.rename(os.path.join(folder_name_tmp, 'rnnoise-master'), folder_name_build)
+    finally:
+        shutil.rmtree(folder_name_tmp, ignore_errors=True)
+
+    subprocess.check_call(['./autogen.sh'], cwd=folder_name_build)
+    subprocess.check_call(['./configure'], cwd=folder_name_build)
+    open(f_name_configured, 'w').close()
+    return folder_name_build
+
+
+def export_model(f_name_weights, model_name=None, f_name_rnnoise_source='rnnoise_master_20.11.2020.zip', cache_folder='train_logs/build_cache',
+                 libs_folder='rnnoise_wrapper/libs', python=sys.executable):
+    ''' Converting trained weights to a compiled RNNoise library and registering it in the wrapper libraries.
+
+    1. f_name_weights - .hdf5 file with trained weights (for example, "train_logs/weights_5h_b_500k.hdf5")
+    2. model_name - name of the model in the library name librnnoise_<model_name>.so.0.4.1 (if None - taken from the weights file name
+       without the 'weights_' prefix)
+    3. f_name_rnnoise_source - .zip archive with RNNoise source
+    4. cache_folder - folder of the build cache
+    5. libs_folder - folder where the library is registered
+    6. python - Python interpreter with keras for dump_rnn_mod.py
+    7. returns the name of the registered library '''
+
+    if not model_name:
+        model_name = os.path.basename(f_name_weights)
+        model_name = model_name[:model_name.rfind('.')] if model_name.rfind('.') != -1 else model_name
+        if model_name.find('weights_') == 0:
+            model_name = model_name[len('weights_'):]
+
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    source_hash = hash_file(f_name_rnnoise_source)
+    key = hashlib.sha256('{}:{}:{}'.format(hash_file(f_name_weights), source_hash, hash_file(F_NAME_DUMP_SCRIPT)).encode('utf-8')).hexdigest()
+    f_name_cached_lib = os.path.join(cache_folder, 'libs', key[:2], key, F_NAME_LIB)
+
+    if os.path.isfile(f_name_cached_lib):
+        print("[i] Weights '{}' have already been compiled, using cached '{}'".format(f_name_weights, f_name_cached_lib))
+    else:
+        folder_name_build = prepare_build_tree(f_name_rnnoise_source, cache_folder, source_hash)
+        folder_name_src = os.path.join(folder_name_build, 'src')
+
+        print("[i] Dump '{}' to rnn_data.c and rnn_data.h...".format(f_name_weights))
+        folder_name_tmp = tempfile.mkdtemp(dir=cache_folder)
+        try:
+            f_name_c = os.path.join(folder_name_tmp, 'rnn_data.c')
+            f_name_h = os.path.join(folder_name_tmp, 'rnn_data.h')
+            subprocess.check_call([python, F_NAME_DUMP_SCRIPT, f_name_weights, f_name_c, f_name_h])
+            max_neurons = get_max_neurons(f_name_c)
+            replace_if_changed(f_name_c, os.path.join(folder_name_src, 'rnn_data.c'))
+            replace_if_changed(f_name_h, os.path.join(folder_name_src, 'rnn_data.h'))
+            if set_max_neurons(os.path.join(folder_name_src, 'rnn.h'), max_neurons):
+                print('[i] MAX_NEURONS in rnn.h is set to {}'.format(max_neurons))
+        finally:
+            shutil.rmtree(folder_name_tmp, ignore_errors=True)
+
+        print('[i] Compiling (only changed files are rebuilt)...')
+        subprocess.check_call(['make'], cwd=folder_name_build)
+
+        os.makedirs(os.path.dirname(f_name_cached_lib), exist_ok=True)
+        shutil.copyfile(os.path.join(folder_name_build, '.libs', F_NAME_LIB), f_name_cached_lib + '.tmp')
+        os.replace(f_name_cached_lib + '.tmp', f_name_cached_lib)
+
+    if not os.path.exists(libs_folder):
+        os.makedirs(libs_folder)
+    f_name_registered_lib = os.path.join(libs_folder, 'librnnoise_{}.so.0.4.1'.format(model_name))
+    shutil.copyfile(f_name_cached_lib, f_name_registered_lib)
+    return f_name_registered_lib
+
+
+def create_and_parse_args():
+    ''' Creating and parsing command line arguments. '''
+
+    parser = argparse.ArgumentParser(description='Export of trained weights to a compiled RNNoise library with a build cache. The library is ' + \
+                                                 'registered in "rnnoise_wrapper/libs" as "librnnoise_<name>.so.0.4.1".')
+    parser.add_argument('-w', '--weights', type=str, required=True,
+                        help='Name .hdf5 file with trained weights (for example, "train_logs/weights_5h_b_500k.hdf5")')
+    parser.add_argument('-n', '--name', type=str, default=None,
+                        help='Model name for the library name (default: weights file name without "weights_" prefix)')
+    parser.add_argument('-s', '--rnnoise_source', type=str, default='rnnoise_master_20.11.2020.zip',
+                        help='Archive with RNNoise source (default is "rnnoise_master_20.11.2020.zip")')
+    parser.add_argument('-c', '--cache_folder', type=str, default='train_logs/build_cache',
+                        help='Folder of the build cache (default is "train_logs/build_cache")')
+    parser.add_argument('-l', '--libs_folder', type=str, default='rnnoise_wrapper/libs',
+                        help='Folder where the library is registered (default is "rnnoise_wrapper/libs")')
+    return parser.parse_args()
+
+
+def main():
+    args = create_and_parse_args()
+
+    start_time = time.time()
+    f_name_registered_lib = export_model(args.weights, args.name, args.rnnoise_source, args.cache_folder, args.libs_folder)
+    print("[i] Library registered as '{}' in {:.1f} s".format(f_name_registered_lib, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,655 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+On-the-fly mixing of clean speech and noise with computation of RNNoise training features (a NumPy port of `denoise_training` from
+rnnoise-master/src/denoise.c).
+
+Each row of the result contains 87 float32 values, as expected by `rnn_train_mod.py`:
+    - 42 input features
+    - 22 band gains (targets)
+    - 22 log band energies of noise
+    - 1 VAD value
+
+Clean and noise audio are read directly from their folders, mixed at random SNRs and converted to features in a process pool. The result is
+either streamed into the training loader (see `training_batches()`) or saved as sharded .npy files, so the intermediate `all_clean.raw`,
+`all_noise.raw` and `.f32` files are no longer needed.
+
+Dependencies: numpy, scipy, pydub.
+'''
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from collections import deque
+import numpy as np
+import pydub
+from scipy.signal import lfilter
+
+
+TARGET_SAMPLE_RATE = 48000
+TARGET_SAMPLE_WIDTH = 2
+
+FRAME_SIZE = 480
+WINDOW_SIZE = 2 * FRAME_SIZE
+FREQ_SIZE = FRAME_SIZE + 1
+
+PITCH_MIN_PERIOD = 60
+PITCH_MAX_PERIOD = 768
+PITCH_FRAME_SIZE = 960
+PITCH_BUF_SIZE = PITCH_MAX_PERIOD + PITCH_FRAME_SIZE
+
+NB_BANDS = 22
+CEPS_MEM = 8
+NB_DELTA_CEPS = 6
+NB_FEATURES = NB_BANDS + 3*NB_DELTA_CEPS + 2
+NB_COLUMNS = NB_FEATURES + 2*NB_BANDS + 1
+
+EBAND_5MS = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 14, 16, 20, 24, 28, 34, 40, 48, 60, 78, 100])
+SECOND_CHECK = [0, 0, 3, 2, 3, 2, 5, 2, 3, 2, 3, 2, 5, 2, 3, 2]
+
+HP_B = [1.0, -2.0, 1.0]
+HP_A = [1.0, -1.99599, 0.99600]
+
+# Number of frames with the same random mixing parameters (the value from denoise_training)
+GAIN_CHANGE_FRAMES = 2821
+
+
+def _create_band_matrix():
+    ''' Matrix for computing band energies: each frequency bin is split between two adjacent bands with triangular weights
+    (as in compute_band_energy() in denoise.c). '''
+
+    band_matrix = np.zeros((FREQ_SIZE, NB_BANDS))
+    for i in range(NB_BANDS-1):
+        band_size = (EBAND_5MS[i+1] - EBAND_5MS[i]) << 2
+        for j in range(band_size):
+            frac = j / band_size
+            band_matrix[(EBAND_5MS[i] << 2) + j, i] += 1 - frac
+            band_matrix[(EBAND_5MS[i] << 2) + j, i+1] += frac
+    band_matrix[:, 0] *= 2
+    band_matrix[:, NB_BANDS-1] *= 2
+    return band_matrix
+
+
+def _create_dct_matrix():
+    ''' DCT matrix as in dct() in denoise.c (including the sqrt(2/22) normalization). '''
+
+    dct_matrix = np.cos((np.arange(NB_BANDS)[:, None] + 0.5) * np.arange(NB_BANDS)[None, :] * np.pi / NB_BANDS)
+    dct_matrix[:, 0] *= np.sqrt(0.5)
+    return dct_matrix * np.sqrt(2.0 / NB_BANDS)
+
+
+HALF_WINDOW = np.sin(0.5*np.pi * np.sin(0.5*np.pi*(np.arange(FRAME_SIZE)+0.5)/FRAME_SIZE)**2)
+WINDOW = np.concatenate([HALF_WINDOW, HALF_WINDOW[::-1]])
+BAND_MATRIX = _create_band_matrix()
+DCT_MATRIX = _create_dct_matrix()
+
+
+def read_audio(f_name_audio):
+    ''' Reading audio with pydub and converting it to 16 bit, mono, 48 kHz (as in prepare_dataset_for_training.py).
+
+    1. f_name_audio - audio name
+    2. returns np.ndarray with int16 samples '''
+
+    audio = pydub.AudioSegment.from_wav(f_name_audio)
+    audio = audio.set_frame_rate(TARGET_SAMPLE_RATE)
+    audio = audio.set_sample_width(TARGET_SAMPLE_WIDTH)
+    audio = audio.set_channels(1)
+    return np.frombuffer(audio.raw_data, dtype=np.int16)
+
+
+def frame_spectrum(signal):
+    ''' Windowed spectrum of each 10 ms frame with the previous frame as overlap (frame_analysis() in denoise.c), vectorized over all frames.
+
+    1. signal - np.ndarray with number of samples multiple of FRAME_SIZE
+    2. returns complex np.ndarray with shape (number of frames, FREQ_SIZE) '''
+
+    padded_signal = np.concatenate([np.zeros(FRAME_SIZE), signal])
+    number_of_frames = len(signal) // FRAME_SIZE
+    index = np.arange(number_of_frames)[:, None] * FRAME_SIZE + np.arange(WINDOW_SIZE)[None, :]
+    return np.fft.rfft(padded_signal[index] * WINDOW, axis=1) / WINDOW_SIZE
+
+
+def band_energy(spectrum):
+    ''' Energy of each band for each frame. '''
+
+    return (spectrum.real**2 + spectrum.imag**2) @ BAND_MATRIX
+
+
+def _find_best_pitch(xcorr, y, length, max_pitch):
+    ''' Vectorized find_best_pitch() from pitch.c: returns two lags with the best normalized correlation. '''
+
+    y_energy = y * y
+    cumsum_y_energy = np.concatenate([[0.0], np.cumsum(y_energy)])
+    syy = np.maximum(1.0, 1.0 + cumsum_y_energy[length:length+max_pitch] - cumsum_y_energy[:max_pitch])
+
+    xcorr = xcorr[:max_pitch]
+    score = np.where(xcorr > 0, (xcorr*1e-12)**2 / syy, -np.inf)
+    if not np.isfinite(score).any():
+        return [0, 1]
+
+    order = np.argsort(-score, kind='stable')
+    best_pitch = [int(order[0]), 1]
+    if len(order) > 1 and np.isfinite(score[order[1]]):
+        best_pitch[1] = int(order[1])
+    return best_pitch
+
+
+def _pitch_downsample(pitch_buf):
+    ''' pitch_downsample() from pitch.c for one channel: 2x decimation followed by a 4th order LPC whitening filter. '''
+
+    half_len = len(pitch_buf) >> 1
+    x_lp = np.empty(half_len)
+    x_lp[1:] = 0.5 * (0.5*(pitch_buf[1:2*half_len-1:2] + pitch_buf[3:2*half_len+1:2]) + pitch_buf[2:2*half_len:2])
+    x_lp[0] = 0.5 * (0.5*pitch_buf[1] + pitch_buf[0])
+
+    ac = np.array([np.dot(x_lp[k:], x_lp[:half_len-k]) for k in range(5)])
+    ac[0] *= 1.0001
+    ac[1:] -= ac[1:] * (0.008*np.arange(1, 5))**2
+
+    lpc = np.zeros(4)
+    error = ac[0]
+    if ac[0] != 0:
+        for i in range(4):
+            rr = np.dot(lpc[:i], ac[i:0:-1]) + ac[i+1]
+            r = -rr / error
+            lpc_prev = lpc.copy()
+            lpc[i] = r
+            for j in range((i+1) >> 1):
+                lpc[j] = lpc_prev[j] + r*lpc_prev[i-1-j]
+                lpc[i-1-j] = lpc_prev[i-1-j] + r*lpc_prev[j]
+            error = error - r*r*error
+            if error < 0.001*ac[0]:
+                break
+
+    lpc *= 0.9 ** np.arange(1, 5)
+    lpc2 = np.array([lpc[0] + 0.8, lpc[1] + 0.8*lpc[0], lpc[2] + 0.8*lpc[1], lpc[3] + 0.8*lpc[2], 0.8*lpc[3]])
+    return np.convolve(x_lp, np.concatenate([[1.0], lpc2]))[:half_len]
+
+
+def _pitch_search(x_lp, y, length, max_pitch):
+    ''' pitch_search() from pitch.c: coarse search with 4x decimation followed by a finer search with 2x decimation. '''
+
+    lag = length + max_pitch
+    x_lp4 = x_lp[:length >> 1:2][:length >> 2]
+    y_lp4 = y[:lag >> 1:2][:lag >> 2]
+
+    xcorr = np.correlate(y_lp4, x_lp4, mode='valid')[:max_pitch >> 2]
+    best_pitch = _find_best_pitch(xcorr, y_lp4, length >> 2, max_pitch >> 2)
+
+    xcorr = np.zeros(max_pitch >> 1)
+    for i in range(max_pitch >> 1):
+        if abs(i - 2*best_pitch[0]) > 2 and abs(i - 2*best_pitch[1]) > 2:
+            continue
+        xcorr[i] = max(-1.0, np.dot(x_lp[:length >> 1], y[i:i+(length >> 1)]))
+    best_pitch = _find_best_pitch(xcorr, y, length >> 1, max_pitch >> 1)
+
+    offset = 0
+    if 0 < best_pitch[0] < (max_pitch >> 1) - 1:
+        a, b, c = xcorr[best_pitch[0]-1], xcorr[best_pitch[0]], xcorr[best_pitch[0]+1]
+        if (c - a) > 0.7*(b - a):
+            offset = 1
+        elif (a - c) > 0.7*(b - c):
+            offset = -1
+    return 2*best_pitch[0] - offset
+
+
+def _compute_pitch_gain(xy, xx, yy):
+    return xy / np.sqrt(1 + xx*yy)
+
+
+def _remove_doubling(x_lp, maxperiod, minperiod, N, T0, prev_period, prev_gain):
+    ''' remove_doubling() from pitch.c: checks submultiples of the found pitch period. Returns the updated period and the pitch gain. '''
+
+    minperiod0 = minperiod
+    maxperiod //= 2
+    minperiod //= 2
+    T0 //= 2
+    prev_period //= 2
+    N //= 2
+    if T0 >= maxperiod:
+        T0 = maxperiod - 1
+
+    def shifted(delay):
+        return x_lp[maxperiod-delay:maxperiod-delay+N]
+
+    x = shifted(0)
+    xx = np.dot(x, x)
+    xy = np.dot(x, shifted(T0))
+
+    yy_lookup = np.empty(maxperiod+1)
+    yy_lookup[0] = xx
+    yy_lookup[1:] = xx + np.cumsum(x_lp[maxperiod-1::-1]**2 - x_lp[maxperiod+N-1:N-1:-1][:maxperiod]**2)
+    yy_lookup = np.maximum(0, yy_lookup)
+
+    T = T0
+    yy = yy_lookup[T0]
+    best_xy = xy
+    best_yy = yy
+    g = g0 = _compute_pitch_gain(xy, xx, yy)
+
+    for k in range(2, 16):
+        T1 = (2*T0 + k) // (2*k)
+        if T1 < minperiod:
+            break
+        if k == 2:
+            T1b = T0 if T1 + T0 > maxperiod else T0 + T1
+        else:
+            T1b = (2*SECOND_CHECK[k]*T0 + k) // (2*k)
+
+        xy = 0.5 * (np.dot(x, shifted(T1)) + np.dot(x, shifted(T1b)))
+        yy = 0.5 * (yy_lookup[T1] + yy_lookup[T1b])
+        g1 = _compute_pitch_gain(xy, xx, yy)
+
+        if abs(T1 - prev_period) <= 1:
+            cont = prev_gain
+        elif abs(T1 - prev_period) <= 2 and 5*k*k < T0:
+            cont = 0.5 * prev_gain
+        else:
+            cont = 0
+        thresh = max(0.3, 0.7*g0 - cont)
+        if T1 < 3*minperiod:
+            thresh = max(0.4, 0.85*g0 - cont)
+
+        if g1 > thresh:
+            best_xy = xy
+            best_yy = yy
+            T = T1
+            g = g1
+
+    best_xy = max(0, best_xy)
+    pg = 1.0 if best_yy <= best_xy else best_xy / (best_yy + 1)
+
+    xcorr = [np.dot(x, shifted(T+k-1)) for k in range(3)]
+    if (xcorr[2] - xcorr[0]) > 0.7*(xcorr[1] - xcorr[0]):
+        offset = 1
+    elif (xcorr[0] - xcorr[2]) > 0.7*(xcorr[1] - xcorr[2]):
+        offset = -1
+    else:
+        offset = 0
+    pg = min(pg, g)
+
+    T0 = max(2*T + offset, minperiod0)
+    return T0, pg
+
+
+def pitch_analysis(signal):
+    ''' Pitch period for each frame of the signal (pitch_downsample(), pitch_search() and remove_doubling() as in compute_frame_features()).
+    This is the only part of feature extraction that depends on the previous frame, so it is performed frame by frame.
+
+    1. signal - np.ndarray with number of samples multiple of FRAME_SIZE
+    2. returns np.ndarray with the pitch period for each frame '''
+
+    padded_signal = np.concatenate([np.zeros(PITCH_BUF_SIZE - FRAME_SIZE), signal])
+    number_of_frames = len(signal) // FRAME_SIZE
+    pitch_periods = np.empty(number_of_frames, dtype=np.int64)
+
+    last_period = 0
+    last_gain = 0.0
+    for i in range(number_of_frames):
+        pitch_buf_lp = _pitch_downsample(padded_signal[i*FRAME_SIZE:i*FRAME_SIZE+PITCH_BUF_SIZE])
+        pitch_index = _pitch_search(pitch_buf_lp[PITCH_MAX_PERIOD >> 1:], pitch_buf_lp, PITCH_FRAME_SIZE,
+                                    PITCH_MAX_PERIOD - 3*PITCH_MIN_PERIOD)
+        pitch_index = PITCH_MAX_PERIOD - pitch_index
+        pitch_index, gain = _remove_doubling(pitch_buf_lp, PITCH_MAX_PERIOD, PITCH_MIN_PERIOD, PITCH_FRAME_SIZE,
+                                             pitch_index, last_period, last_gain)
+        last_period = pitch_index
+        last_gain = gain
+        pitch_periods[i] = pitch_index
+    return pitch_periods
+
+
+def compute_frame_features(signal, lowpass=FREQ_SIZE):
+    ''' Input features of the network for each frame (compute_frame_features() in denoise.c with TRAINING=1).
+
+    1. signal - np.ndarray with noisy audio, number of samples multiple of FRAME_SIZE
+    2. lowpass - bins starting from this one are zeroed (random lowpass augmentation from denoise_training)
+    3. returns a tuple of features with shape (number of frames, NB_FEATURES), band energies with shape (number of frames, NB_BANDS) and
+       the silence flag of each frame '''
+
+    number_of_frames = len(signal) // FRAME_SIZE
+    spectrum = frame_spectrum(signal)
+    spectrum[:, lowpass:] = 0
+    Ex = band_energy(spectrum)
+
+    pitch_periods = pitch_analysis(signal)
+    padded_signal = np.concatenate([np.zeros(PITCH_BUF_SIZE - FRAME_SIZE), signal])
+    index = (np.arange(number_of_frames)*FRAME_SIZE + PITCH_BUF_SIZE - WINDOW_SIZE - pitch_periods)[:, None] + np.arange(WINDOW_SIZE)[None, :]
+    pitch_spectrum = np.fft.rfft(padded_signal[index] * WINDOW, axis=1) / WINDOW_SIZE
+    Ep = band_energy(pitch_spectrum)
+    Exp = (spectrum.real*pitch_spectrum.real + spectrum.imag*pitch_spectrum.imag) @ BAND_MATRIX
+    Exp = Exp / np.sqrt(0.001 + Ex*Ep)
+
+    features = np.zeros((number_of_frames, NB_FEATURES))
+    pitch_corr = Exp @ DCT_MATRIX
+    features[:, NB_BANDS+2*NB_DELTA_CEPS:NB_BANDS+3*NB_DELTA_CEPS] = pitch_corr[:, :NB_DELTA_CEPS]
+    features[:, NB_BANDS+2*NB_DELTA_CEPS] -= 1.3
+    features[:, NB_BANDS+2*NB_DELTA_CEPS+1] -= 0.9
+    features[:, NB_BANDS+3*NB_DELTA_CEPS] = 0.01 * (pitch_periods - 300)
+
+    Ly = np.log10(1e-2 + Ex)
+    log_max = np.full(number_of_frames, -2.0)
+    follow = np.full(number_of_frames, -2.0)
+    for i in range(NB_BANDS):
+        Ly[:, i] = np.maximum(log_max - 7, np.maximum(follow - 1.5, Ly[:, i]))
+        log_max = np.maximum(log_max, Ly[:, i])
+        follow = np.maximum(follow - 1.5, Ly[:, i])
+    silence = Ex.sum(axis=1) < 0.1
+
+    cepstrum = Ly @ DCT_MATRIX
+    cepstrum[:, 0] -= 12
+    cepstrum[:, 1] -= 4
+    cepstral_mem = np.concatenate([np.zeros((CEPS_MEM-1, NB_BANDS)), cepstrum])
+    ceps_1 = cepstral_mem[CEPS_MEM-2:-1]
+    ceps_2 = cepstral_mem[CEPS_MEM-3:-2]
+
+    features[:, :NB_BANDS] = cepstrum
+    features[:, :NB_DELTA_CEPS] = cepstrum[:, :NB_DELTA_CEPS] + ceps_1[:, :NB_DELTA_CEPS] + ceps_2[:, :NB_DELTA_CEPS]
+    features[:, NB_BANDS:NB_BANDS+NB_DELTA_CEPS] = cepstrum[:, :NB_DELTA_CEPS] - ceps_2[:, :NB_DELTA_CEPS]
+    features[:, NB_BANDS+NB_DELTA_CEPS:NB_BANDS+2*NB_DELTA_CEPS] = cepstrum[:, :NB_DELTA_CEPS] - 2*ceps_1[:, :NB_DELTA_CEPS] \
+                                                                   + ceps_2[:, :NB_DELTA_CEPS]
+
+    # Spectral variability: mean of minimal distances between each of the last CEPS_MEM cepstrums and the others
+    index = np.arange(number_of_frames)[:, None] + np.arange(CEPS_MEM)[None, :]
+    last_cepstrums = cepstral_mem[index]
+    distances = ((last_cepstrums[:, :, None, :] - last_cepstrums[:, None, :, :])**2).sum(axis=3)
+    distances[:, np.arange(CEPS_MEM), np.arange(CEPS_MEM)] = 1e15
+    features[:, NB_BANDS+3*NB_DELTA_CEPS+1] = distances.min(axis=2).sum(axis=1) / CEPS_MEM - 2.1
+
+    return features, Ex, silence
+
+
+def compute_vad(clean_frames_energy):
+    ''' VAD target for each frame with hysteresis based on the energy of the clean speech frame (as in denoise_training).
+
+    1. clean_frames_energy - np.ndarray with the energy of each clean speech frame (before applying the gain)
+    2. returns np.ndarray with VAD values 0, 0.5 or 1 '''
+
+    vad = np.empty(len(clean_frames_energy))
+    vad_cnt = 0
+    for i, E in enumerate(clean_frames_energy):
+        if E > 1e9:
+            vad_cnt = 0
+        elif E > 1e8:
+            vad_cnt -= 5
+        elif E > 1e7:
+            vad_cnt += 1
+        else:
+            vad_cnt += 2
+        vad_cnt = min(15, max(0, vad_cnt))
+
+        if vad_cnt >= 10:
+            vad[i] = 0.0
+        elif vad_cnt > 0:
+            vad[i] = 0.5
+        else:
+            vad[i] = 1.0
+    return vad
+
+
+def _random_response(rng):
+    return [1.0] + list(0.75*(rng.random_sample(2) - 0.5)), [1.0] + list(0.75*(rng.random_sample(2) - 0.5))
+
+
+def mix_and_compute_features(clean, noise, rng, snr_range=(-5.0, 30.0)):
+    ''' Mixing of clean speech and noise with random augmentations from denoise_training (speech level, frequency response, lowpass,
+    noise-only and speech-only segments) and computation of all 87 columns for each frame.
+
+    1. clean - np.ndarray with int16 samples of clean speech
+    2. noise - np.ndarray with int16 samples of noise (looped if shorter than clean speech)
+    3. rng - np.random.RandomState
+    4. snr_range - range of the random SNR in dB
+    5. returns a tuple of np.ndarray (float32) with shape (number of frames, NB_COLUMNS) and the used SNR (None for speech-only or
+       noise-only segments) '''
+
+    number_of_frames = len(clean) // FRAME_SIZE
+    clean = clean[:number_of_frames*FRAME_SIZE].astype(np.float64)
+    if len(noise) < len(clean):
+        noise = np.tile(noise, len(clean) // max(1, len(noise)) + 1)
+    noise_offset = rng.randint(0, len(noise) - len(clean) + 1)
+    noise = noise[noise_offset:noise_offset+len(clean)].astype(np.float64)
+
+    speech_gain = 10 ** ((-40 + rng.randint(60)) / 20)
+    snr = rng.uniform(*snr_range)
+    clean_power = np.mean(clean**2) + 1e-9
+    noise_power = np.mean(noise**2) + 1e-9
+    noise_gain = speech_gain * np.sqrt(clean_power / noise_power) * 10 ** (-snr/20)
+    if rng.randint(10) == 0:
+        noise_gain = 0.0
+        snr = None
+    if rng.randint(10) == 0:
+        speech_gain = 0.0
+        snr = None
+
+    lowpass = int(FREQ_SIZE * 3000.0/24000.0 * 50 ** rng.random_sample())
+    band_lp = NB_BANDS
+    for i in range(NB_BANDS):
+        if EBAND_5MS[i] << 2 > lowpass:
+            band_lp = i
+            break
+
+    clean_frames_energy = (clean.reshape(number_of_frames, FRAME_SIZE)**2).sum(axis=1) if speech_gain != 0 else np.zeros(number_of_frames)
+
+    b_sig, a_sig = _random_response(rng)
+    b_noise, a_noise = _random_response(rng)
+    x = lfilter(b_sig, a_sig, lfilter(HP_B, HP_A, speech_gain*clean))
+    n = lfilter(b_noise, a_noise, lfilter(HP_B, HP_A, noise_gain*noise))
+    xn = x + n
+
+    clean_spectrum = frame_spectrum(x)
+    clean_spectrum[:, lowpass:] = 0
+    Ey = band_energy(clean_spectrum)
+
+    noise_spectrum = frame_spectrum(n)
+    noise_spectrum[:, lowpass:] = 0
+    En = band_energy(noise_spectrum)
+
+    features, Ex, silence = compute_frame_features(xn, lowpass)
+    vad = compute_vad(clean_frames_energy)
+
+    gains = np.minimum(1.0, np.sqrt((Ey + 1e-3) / (Ex + 1e-3)))
+    gains[silence, :] = -1
+    gains[:, band_lp+1:] = -1
+    gains[(Ey < 5e-2) & (Ex < 5e-2)] = -1
+    if noise_gain == 0:
+        gains[vad == 0, :] = -1
+
+    data = np.empty((number_of_frames, NB_COLUMNS), dtype=np.float32)
+    data[:, :NB_FEATURES] = features
+    data[:, NB_FEATURES:NB_FEATURES+NB_BANDS] = gains
+    data[:, NB_FEATURES+NB_BANDS:NB_FEATURES+2*NB_BANDS] = np.log10(1e-2 + En)
+    data[:, NB_COLUMNS-1] = vad
+    return data, snr
+
+
+def search_audio_in_folder(folder_name):
+    ''' Recursive search of .wav audio in folder. Returns a sorted list with found audio names. '''
+
+    f_names_audio = []
+    for path, folder_names, f_names in os.walk(folder_name):
+        for f_name in f_names:
+            if f_name.rfind('.wav') != -1:
+                f_names_audio.append(os.path.join(path, f_name))
+    return sorted(f_names_audio)
+
+
+def process_clean_audio(task):
+    ''' Process pool task: reading one clean speech audio and a random noise audio, splitting them into segments of GAIN_CHANGE_FRAMES frames,
+    mixing each segment with its own random parameters.
+
+    1. task - tuple of clean speech audio name, list of noise audio names, random seed and SNR range
+    2. returns a list of tuples (np.ndarray with shape (number of frames, NB_COLUMNS), clean audio name, noise audio name, SNR) '''
+
+    f_name_clean_audio, f_names_noise_audio, seed, snr_range = task
+    rng = np.random.RandomState(seed)
+
+    clean = read_audio(f_name_clean_audio)
+    f_name_noise_audio = f_names_noise_audio[rng.randint(len(f_names_noise_audio))]
+    noise = read_audio(f_name_noise_audio)
+
+    results = []
+    segment_size = GAIN_CHANGE_FRAMES * FRAME_SIZE
+    for offset in range(0, len(clean) - FRAME_SIZE + 1, segment_size):
+        data, snr = mix_and_compute_features(clean[offset:offset+segment_size], noise, rng, snr_range)
+        results.append((data, f_name_clean_audio, f_name_noise_audio, snr))
+    return results
+
+
+def generate_features(f_names_clean_audio, f_names_noise_audio, jobs=None, seed=0, snr_range=(-5.0, 30.0), epochs=1):
+    ''' Computing training data for all clean speech audio in a process pool. Results are returned as they are ready (the order of clean
+    audio is preserved), nothing is written to disk.
+
+    1. f_names_clean_audio - list with clean speech audio names
+    2. f_names_noise_audio - list with noise audio names
+    3. jobs - number of worker processes (if None - the number of CPU cores)
+    4. seed - random seed (the same seed gives the same data)
+    5. snr_range - range of the random SNR in dB
+    6. epochs - number of passes over the clean speech (each pass uses new random noise and mixing parameters)
+    7. returns a generator of tuples (np.ndarray with shape (number of frames, NB_COLUMNS), clean audio name, noise audio name, SNR) '''
+
+    def tasks():
+        for epoch in range(epochs):
+            for i, f_name_clean_audio in enumerate(f_names_clean_audio):
+                yield f_name_clean_audio, f_names_noise_audio, seed + epoch*len(f_names_clean_audio) + i, snr_range
+
+    # The number of tasks in progress is limited, so that results are computed only slightly ahead of the consumer
+    pool = multiprocessing.Pool(jobs)
+    max_tasks_in_progress = 2 * pool._processes
+    tasks_in_progress = deque()
+    try:
+        for task in tasks():
+            tasks_in_progress.append(pool.apply_async(process_clean_audio, (task,)))
+            if len(tasks_in_progress) < max_tasks_in_progress:
+                continue
+            for result in tasks_in_progress.popleft().get():
+                yield result
+        while tasks_in_progress:
+            for result in tasks_in_progress.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+
+
+def training_batches(data_blocks, window_size=2000, batch_size=32):
+    ''' Converting a stream of training data blocks into batches for Keras `fit_generator()` in the format of `rnn_train_mod.py`.
+
+    1. data_blocks - iterable of np.ndarray with shape (number of frames, NB_COLUMNS)
+    2. window_size - length of one training sequence in frames
+    3. batch_size - number of sequences in a batch
+    4. returns a generator of tuples (x, [y, vad]) '''
+
+    buffer = np.empty((window_size*batch_size, NB_COLUMNS), dtype=np.float32)
+    filled = 0
+    for data in data_blocks:
+        offset = 0
+        while offset < len(data):
+            number_of_rows = min(len(data) - offset, len(buffer) - filled)
+            buffer[filled:filled+number_of_rows] = data[offset:offset+number_of_rows]
+            filled += number_of_rows
+            offset += number_of_rows
+            if filled == len(buffer):
+                batch = buffer.reshape(batch_size, window_size, NB_COLUMNS)
+                yield batch[:, :, :NB_FEATURES].copy(), [batch[:, :, NB_FEATURES:NB_FEATURES+NB_BANDS].copy(), batch[:, :, NB_COLUMNS-1:].copy()]
+                filled = 0
+
+
+def write_feature_shards(data_blocks, folder_name, shard_size=500000, max_frames=None):
+    ''' Saving a stream of training data blocks in .npy shards of fixed size (the last shard may be smaller).
+
+    1. data_blocks - iterable of np.ndarray with shape (number of frames, NB_COLUMNS)
+    2. folder_name - folder for shards
+    3. shard_size - number of frames in one shard
+    4. max_frames - total number of frames to save (if None - save all)
+    5. returns a list with shard names '''
+
+    if not os.path.exists(folder_name):
+        os.makedirs(folder_name)
+
+    f_names_shards = []
+    buffer = np.empty((shard_size, NB_COLUMNS), dtype=np.float32)
+    filled = 0
+    total_frames = 0
+
+    def save_shard(number_of_rows):
+        f_name_shard = os.path.join(folder_name, 'features_{:05d}.npy'.format(len(f_names_shards)))
+        np.save(f_name_shard, buffer[:number_of_rows])
+        f_names_shards.append(f_name_shard)
+        print("[i] Saved {} frames in '{}'".format(number_of_rows, f_name_shard))
+
+    for data in data_blocks:
+        if max_frames is not None:
+            data = data[:max_frames - total_frames]
+        offset = 0
+        while offset < len(data):
+            number_of_rows = min(len(data) - offset, shard_size - filled)
+            buffer[filled:filled+number_of_rows] = data[offset:offset+number_of_rows]
+            filled += number_of_rows
+            offset += number_of_rows
+            if filled == shard_size:
+                save_shard(filled)
+                filled = 0
+        total_frames += len(data)
+        if max_frames is not None and total_frames >= max_frames:
+            break
+
+    if filled > 0:
+        save_shard(filled)
+    return f_names_shards
+
+
+def create_and_parse_args():
+    ''' Creating and parsing command line arguments. '''
+
+    parser = argparse.ArgumentParser(description='Mixing clean speech and noise at random SNRs and computing RNNoise training features without ' + \
+                                                 'intermediate .raw and .f32 files. The result is saved as .npy shards with {} columns.'.format(NB_COLUMNS))
+    parser.add_argument('-cf', '--clean_folder', type=str, required=True,
+                        help='Folder name with clean speech audio (for example, "datasets/test_training_set/clean")')
+    parser.add_argument('-nf', '--noise_folder', type=str, required=True,
+                        help='Folder name with noise audio (for example, "datasets/test_training_set/noise")')
+    parser.add_argument('-o', '--output_folder', type=str, required=True,
+                        help='Folder name for .npy shards (for example, "train_logs/test_training_set/features")')
+    parser.add_argument('-n', '--number_of_frames', type=int, default=None,
+                        help='Total number of frames (rows) to compute (default: one pass over all clean speech)')
+    parser.add_argument('-ss', '--shard_size', type=int, default=500000,
+                        help='Number of frames in one shard (default is 500000)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes (default is the number of CPU cores)')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='Random seed (default is 0)')
+    parser.add_argument('--snr_range', type=str, default='-5,30',
+                        help='Range of random SNR in dB, separated by comma (default is "-5,30")')
+    return parser.parse_args()
+
+
+def main():
+    args = create_and_parse_args()
+    snr_range = tuple(float(value) for value in args.snr_range.split(','))
+
+    f_names_clean_audio = search_audio_in_folder(args.clean_folder)
+    f_names_noise_audio = search_audio_in_folder(args.noise_folder)
+    print('[i] Found {} clean speech audio and {} noise audio'.format(len(f_names_clean_audio), len(f_names_noise_audio)))
+    if not f_names_clean_audio or not f_names_noise_audio:
+        print('[E] Clean speech or noise audio not found')
+        sys.exit(1)
+
+    # When the number of frames is specified, clean speech is reused with new noise and mixing parameters until enough frames are computed
+    epochs = sys.maxsize if args.number_of_frames else 1
+
+    start_time = time.time()
+    data_blocks = (data for data, f_name_clean_audio, f_name_noise_audio, snr in generate_features(f_names_clean_audio, f_names_noise_audio,
+                                                                                                   args.jobs, args.seed, snr_range, epochs))
+    f_names_shards = write_feature_shards(data_blocks, args.output_folder, args.shard_size, args.number_of_frames)
+    elapsed_time = time.time() - start_time
+
+    print('[i] Saved {} shard(-s) in {:.1f} s'.format(len(f_names_shards), elapsed_time))
+
+
+if __name__ == '__main__':
+    main()
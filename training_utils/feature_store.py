@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#       OS : GNU/Linux Ubuntu 16.04 or later
+# LANGUAGE : Python 3.5.2 or later
+#   AUTHOR : Klim V. O.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+'''
+Feature store for RNNoise training: 87-column float32 training data in memory-mappable .npy shards with an index.
+
+Each shard contains the data of a group of clean speech audio from one language folder (about `shard_size` frames). The index (`index.json`)
+stores for each shard its inputs and for each segment of the shard the clean and noise audio names, SNR and language folder (the names of the
+folders match `balance_dns_challenge_dataset.py`). When the store is rebuilt, shards whose inputs (audio, noise set and mixing parameters)
+have not changed are not recomputed.
+
+The training script selects subsets of the data by an index query, the selected data are read directly from memory-mapped shards without
+copying the whole dataset.
+
+Dependencies: numpy, scipy, pydub.
+'''
+
+import os
+import sys
+import json
+import time
+import wave
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from extract_training_features import NB_COLUMNS, FRAME_SIZE, TARGET_SAMPLE_RATE, search_audio_in_folder, process_clean_audio, training_batches
+from balance_dns_challenge_dataset import FOLDER_NAMES_WITH_SPEECH, F_NAME_LANGUAGE_FOLDERS
+
+
+# Must be increased when feature extraction changes, so that all shards are recomputed
+FEATURES_VERSION = 1
+
+F_NAME_INDEX = 'index.json'
+UNKNOWN_LANGUAGE = 'unknown'
+
+
+def file_signature(f_name):
+    ''' Signature of the file for change detection: name, size and modification time. '''
+
+    stat = os.stat(f_name)
+    return [os.path.abspath(f_name), stat.st_size, stat.st_mtime_ns]
+
+
+def estimate_number_of_frames(f_name_audio):
+    ''' Estimation of the number of 10 ms frames of .wav audio after conversion to 48 kHz (from the .wav header). '''
+
+    with wave.open(f_name_audio, 'rb') as f_audio:
+        return int(f_audio.getnframes() * TARGET_SAMPLE_RATE / f_audio.getframerate()) // FRAME_SIZE
+
+
+def file_seed(seed, f_name_audio):
+    ''' Random seed for one clean speech audio, which does not depend on the other audio in the dataset. '''
+
+    return int(hashlib.sha1('{}:{}'.format(seed, os.path.abspath(f_name_audio)).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def find_language_folders(clean_folder, f_names_clean_audio):
+    ''' Determining the language folder of each clean speech audio. The mapping saved by `balance_dns_challenge_dataset.py` is used, if it exists,
+    otherwise the folder is searched in the path of the audio.
+
+    1. clean_folder - folder name with clean speech audio
+    2. f_names_clean_audio - list with clean speech audio names
+    3. returns a dict {clean audio name: language folder} '''
+
+    saved_language_folders = {}
+    f_name_language_folders = os.path.join(clean_folder, F_NAME_LANGUAGE_FOLDERS)
+    if os.path.isfile(f_name_language_folders):
+        with open(f_name_language_folders, 'r') as f_language_folders:
+            saved_language_folders = json.load(f_language_folders)
+
+    language_folders = {}
+    for f_name_audio in f_names_clean_audio:
+        language = saved_language_folders.get(os.path.basename(f_name_audio))
+        if not language:
+            path_parts = os.path.normpath(f_name_audio).split(os.sep)
+            language = next((part for part in path_parts if part in FOLDER_NAMES_WITH_SPEECH), UNKNOWN_LANGUAGE)
+        language_folders[f_name_audio] = language
+    return language_folders
+
+
+class FeatureStore(object):
+    """Sharded memory-mapped storage of RNNoise training data:
+    - build(): compute shards for clean speech and noise folders, skipping shards whose inputs have not changed
+    - query(): select segments by language folder, SNR and clean audio name
+    - split(): split selected segments into training and validation segments by clean audio
+    - load(): memory-mapped views of the selected segments
+    - batches(): endless generator of training batches from the selected segments for Keras `fit_generator()`
+
+    1. folder_name - folder with shards and the index
+    """
+
+    def __init__(self, folder_name='train_logs/feature_store'):
+        self.folder_name = folder_name
+        self.f_name_index = os.path.join(folder_name, F_NAME_INDEX)
+        self.shards = []
+        self.__mmaps = {}
+
+        if os.path.isfile(self.f_name_index):
+            with open(self.f_name_index, 'r') as f_index:
+                self.shards = json.load(f_index)['shards']
+
+
+    def __save_index(self):
+        f_name_index_tmp = self.f_name_index + '.tmp'
+        with open(f_name_index_tmp, 'w') as f_index:
+            json.dump({'version': FEATURES_VERSION, 'shards': self.shards}, f_index, indent=1)
+        os.replace(f_name_index_tmp, self.f_name_index)
+
+
+    def build(self, clean_folder, noise_folder, shard_size=500000, jobs=None, seed=0, snr_range=(-5.0, 30.0)):
+        ''' Computing shards for all clean speech audio. Clean audio are grouped by language folder and split into groups of about `shard_size`
+        frames, one shard per group. If the index already has a shard with the same inputs and its file exists, it is not recomputed.
+
+        1. clean_folder - folder name with clean speech audio
+        2. noise_folder - folder name with noise audio
+        3. shard_size - approximate number of frames in one shard
+        4. jobs - number of worker processes (if None - the number of CPU cores)
+        5. seed - random seed
+        6. snr_range - range of the random SNR in dB
+        7. returns a tuple from the number of computed and skipped shards '''
+
+        if not os.path.exists(self.folder_name):
+            os.makedirs(self.folder_name)
+
+        f_names_clean_audio = search_audio_in_folder(clean_folder)
+        f_names_noise_audio = search_audio_in_folder(noise_folder)
+        if not f_names_clean_audio or not f_names_noise_audio:
+            raise ValueError("clean speech or noise audio not found in '{}' and '{}'".format(clean_folder, noise_folder))
+
+        language_folders = find_language_folders(clean_folder, f_names_clean_audio)
+        noise_signature = hashlib.sha1(json.dumps([file_signature(f_name) for f_name in f_names_noise_audio]).encode('utf-8')).hexdigest()
+
+        # Grouping clean audio into shards
+        groups = []
+        for language in sorted(set(language_folders.values())):
+            group = []
+            group_frames = 0
+            for f_name_audio in f_names_clean_audio:
+                if language_folders[f_name_audio] != language:
+                    continue
+                group.append(f_name_audio)
+                group_frames += estimate_number_of_frames(f_name_audio)
+                if group_frames >= shard_size:
+                    groups.append((language, group))
+                    group = []
+                    group_frames = 0
+            if group:
+                groups.append((language, group))
+
+        existing_shards = {shard['key']: shard for shard in self.shards}
+        shards = []
+        groups_to_compute = []
+        for language, group in groups:
+            inputs = {'version': FEATURES_VERSION, 'clean': [file_signature(f_name) for f_name in group], 'noise': noise_signature,
+                      'seed': seed, 'snr_range': list(snr_range)}
+            key = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+            shard = existing_shards.get(key)
+            if shard and os.path.isfile(os.path.join(self.folder_name, shard['file'])):
+                shards.append(shard)
+            else:
+                shard = {'key': key, 'file': 'shard_{}_{}.npy'.format(language, key[:12]), 'language': language}
+                shards.append(shard)
+                groups_to_compute.append((shard, group))
+
+        print('[i] {} shard(-s) in total, {} up to date, {} to compute'.format(len(shards), len(shards) - len(groups_to_compute),
+                                                                               len(groups_to_compute)))
+
+        pool = multiprocessing.Pool(jobs) if groups_to_compute else None
+        try:
+            for shard, group in groups_to_compute:
+                start_time = time.time()
+                tasks = [(f_name_audio, f_names_noise_audio, file_seed(seed, f_name_audio), snr_range) for f_name_audio in group]
+                segments = []
+                blocks = []
+                number_of_rows = 0
+                for results in pool.imap(process_clean_audio, tasks):
+                    for data, f_name_clean_audio, f_name_noise_audio, snr in results:
+                        segments.append({'clean': f_name_clean_audio, 'noise': f_name_noise_audio, 'snr': snr, 'language': shard['language'],
+                                         'start': number_of_rows, 'stop': number_of_rows + len(data)})
+                        blocks.append(data)
+                        number_of_rows += len(data)
+
+                shard_data = np.lib.format.open_memmap(os.path.join(self.folder_name, shard['file']), mode='w+', dtype=np.float32,
+                                                       shape=(number_of_rows, NB_COLUMNS))
+                for segment, data in zip(segments, blocks):
+                    shard_data[segment['start']:segment['stop']] = data
+                shard_data.flush()
+                del shard_data
+
+                shard['rows'] = number_of_rows
+                shard['segments'] = segments
+                print("[i] Shard '{}': {} frames, {} segment(-s), {:.1f} s".format(shard['file'], number_of_rows, len(segments),
+                                                                                   time.time() - start_time))
+        finally:
+            if pool:
+                pool.terminate()
+
+        # Shards that are no longer used are removed
+        used_f_names = set(shard['file'] for shard in shards)
+        for shard in self.shards:
+            if shard['file'] not in used_f_names and os.path.isfile(os.path.join(self.folder_name, shard['file'])):
+                os.remove(os.path.join(self.folder_name, shard['file']))
+
+        self.shards = shards
+        self.__mmaps = {}
+        self.__save_index()
+        return len(groups_to_compute), len(shards) - len(groups_to_compute)
+
+
+    def query(self, languages=None, snr_range=None, include_without_snr=True, clean_name_contains=None):
+        ''' Selecting segments from the index.
+
+        1. languages - list of language folders (if None - all)
+        2. snr_range - tuple (min, max) of SNR in dB (if None - any SNR)
+        3. include_without_snr - include segments without SNR (speech-only or noise-only segments)
+        4. clean_name_contains - substring of clean speech audio name (if None - any)
+        5. returns a list of tuples (shard file name, segment) '''
+
+        selection = []
+        for shard in self.shards:
+            if languages and shard['language'] not in languages:
+                continue
+            for segment in shard['segments']:
+                if segment['snr'] is None:
+                    if not include_without_snr:
+                        continue
+                elif snr_range and not snr_range[0] <= segment['snr'] <= snr_range[1]:
+                    continue
+                if clean_name_contains and segment['clean'].find(clean_name_contains) == -1:
+                    continue
+                selection.append((shard['file'], segment))
+        return selection
+
+
+    @staticmethod
+    def split(selection, validation_share=0.1, seed=0):
+        ''' Splitting selected segments into training and validation segments by clean speech audio: in each language folder a random share of
+        clean audio (at least one, if the folder has two or more) is held out for validation with all its segments, so no clean audio is in both
+        parts and every language is validated. Noise audio can be in both parts, as every shard is mixed with all noise audio.
+
+        1. selection - result of query()
+        2. validation_share - share of clean audio of each language folder held out for validation
+        3. seed - random seed for choosing clean audio
+        4. returns a tuple of training and validation selections (lists of tuples (shard file name, segment) in the order of selection) '''
+
+        f_names_clean_audio_by_language = {}
+        for f_name_shard, segment in selection:
+            f_names_clean_audio = f_names_clean_audio_by_language.setdefault(segment['language'], [])
+            if segment['clean'] not in f_names_clean_audio:
+                f_names_clean_audio.append(segment['clean'])
+
+        rng = np.random.RandomState(seed)
+        f_names_validation_audio = set()
+        for language in sorted(f_names_clean_audio_by_language):
+            f_names_clean_audio = sorted(f_names_clean_audio_by_language[language])
+            if len(f_names_clean_audio) < 2:
+                continue
+            number_of_validation_audio = max(1, int(len(f_names_clean_audio) * validation_share))
+            f_names_validation_audio.update(f_names_clean_audio[i] for i in rng.permutation(len(f_names_clean_audio))[:number_of_validation_audio])
+
+        train_selection = [(f_name_shard, segment) for f_name_shard, segment in selection if segment['clean'] not in f_names_validation_audio]
+        validation_selection = [(f_name_shard, segment) for f_name_shard, segment in selection if segment['clean'] in f_names_validation_audio]
+        return train_selection, validation_selection
+
+
+    def load(self, selection):
+        ''' Memory-mapped views of the selected segments (the data are not copied).
+
+        1. selection - result of query()
+        2. returns a list of np.ndarray with shape (number of frames, NB_COLUMNS) '''
+
+        views = []
+        for f_name_shard, segment in selection:
+            if f_name_shard not in self.__mmaps:
+                self.__mmaps[f_name_shard] = np.load(os.path.join(self.folder_name, f_name_shard), mmap_mode='r')
+            views.append(self.__mmaps[f_name_shard][segment['start']:segment['stop']])
+        return views
+
+
+    def batches(self, selection, window_size=2000, batch_size=32, shuffle=True, seed=0):
+        ''' Endless generator of training batches from the selected segments in the format of `rnn_train_mod.py`. Only one batch at a time is
+        copied from the memory-mapped shards.
+
+        1. selection - result of query()
+        2. window_size - length of one training sequence in frames
+        3. batch_size - number of sequences in a batch
+        4. shuffle - shuffle the order of segments on each pass
+        5. seed - random seed for shuffling
+        6. returns a generator of tuples (x, [y, vad]) '''
+
+        views = self.load(selection)
+        rng = np.random.RandomState(seed)
+
+        def endless_views():
+            while True:
+                order = rng.permutation(len(views)) if shuffle else range(len(views))
+                for i in order:
+                    yield views[i]
+
+        return training_batches(endless_views(), window_size, batch_size)
+
+
+    @staticmethod
+    def number_of_frames(selection):
+        return sum(segment['stop'] - segment['start'] for f_name_shard, segment in selection)
+
+
+
+
+def create_and_parse_args():
+    ''' Creating and parsing command line arguments. '''
+
+    parser = argparse.ArgumentParser(description='Building the feature store for RNNoise training: {}-column float32 training data in '.format(NB_COLUMNS) + \
+                                                 'memory-mappable .npy shards with an index. Shards whose inputs have not changed are not recomputed.')
+    parser.add_argument('-cf', '--clean_folder', type=str, required=True,
+                        help='Folder name with clean speech audio (for example, "datasets/test_training_set/clean")')
+    parser.add_argument('-nf', '--noise_folder', type=str, required=True,
+                        help='Folder name with noise audio (for example, "datasets/test_training_set/noise")')
+    parser.add_argument('-fs', '--feature_store', type=str, default='train_logs/feature_store',
+                        help='Folder name for the feature store (default is "train_logs/feature_store")')
+    parser.add_argument('-ss', '--shard_size', type=int, default=500000,
+                        help='Approximate number of frames in one shard (default is 500000)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes (default is the number of CPU cores)')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='Random seed (default is 0)')
+    parser.add_argument('--snr_range', type=str, default='-5,30',
+                        help='Range of random SNR in dB, separated by comma (default is "-5,30")')
+    return parser.parse_args()
+
+
+def main():
+    args = create_and_parse_args()
+    snr_range = tuple(float(value) for value in args.snr_range.split(','))
+
+    feature_store = FeatureStore(args.feature_store)
+    start_time = time.time()
+    computed, skipped = feature_store.build(args.clean_folder, args.noise_folder, args.shard_size, args.jobs, args.seed, snr_range)
+    print('[i] Computed {} shard(-s), skipped {} up to date shard(-s) in {:.1f} s'.format(computed, skipped, time.time() - start_time))
+
+    for language in sorted(set(shard['language'] for shard in feature_store.shards)):
+        number_of_frames = feature_store.number_of_frames(feature_store.query(languages=[language]))
+        print("\tlanguage folder '{}': {} frames".format(language, number_of_frames))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
 #!/usr/bin/python
 
 from __future__ import print_function
+import os
 import sys
+import glob
+import argparse
 
 import keras
 from keras.models import Sequential
 from keras.models import Model
+from keras.models import load_model
 from keras.layers import Input
 from keras.layers import Dense
 from keras.layers import LSTM
@@ -60,70 +64,246 @@ class WeightClip(Constraint):
 reg = 0.000001
 constraint = WeightClip(0.499)
 
-print('Build model...')
-main_input = Input(shape=(None, 42), name='main_input')
-tmp = Dense(24, activation='tanh', name='input_dense', kernel_constraint=constraint, bias_constraint=constraint)(main_input)
-vad_gru = GRU(24, activation='tanh', recurrent_activation='sigmoid', return_sequences=True, name='vad_gru', kernel_regularizer=regularizers.l2(reg), recurrent_regularizer=regularizers.l2(reg), kernel_constraint=constraint, recurrent_constraint=constraint, bias_constraint=constraint)(tmp)
-vad_output = Dense(1, activation='sigmoid', name='vad_output', kernel_constraint=constraint, bias_constraint=constraint)(vad_gru)
-noise_input = keras.layers.concatenate([tmp, vad_gru, main_input])
-noise_gru = GRU(48, activation='relu', recurrent_activation='sigmoid', return_sequences=True, name='noise_gru', kernel_regularizer=regularizers.l2(reg), recurrent_regularizer=regularizers.l2(reg), kernel_constraint=constraint, recurrent_constraint=constraint, bias_constraint=constraint)(noise_input)
-denoise_input = keras.layers.concatenate([vad_gru, noise_gru, main_input])
-
-denoise_gru = GRU(96, activation='tanh', recurrent_activation='sigmoid', return_sequences=True, name='denoise_gru', kernel_regularizer=regularizers.l2(reg), recurrent_regularizer=regularizers.l2(reg), kernel_constraint=constraint, recurrent_constraint=constraint, bias_constraint=constraint)(denoise_input)
-
-denoise_output = Dense(22, activation='sigmoid', name='denoise_output', kernel_constraint=constraint, bias_constraint=constraint)(denoise_gru)
-
-model = Model(inputs=main_input, outputs=[denoise_output, vad_output])
-
-model.compile(loss=[mycost, my_crossentropy],
-              metrics=[msse],
-              optimizer='adam', loss_weights=[10, 0.5])
-
-
-f_name_training_data = 'training.h5'
-if len(sys.argv) >= 2:
-    f_name_training_data = sys.argv[1]
-
-print("\nLoading training data from '{}'...".format(f_name_training_data))
-with h5py.File(f_name_training_data, 'r') as hf:
-    all_data = hf['data'][:]
-print('done.\n')
-
+def build_model(input_dense_size=24, vad_gru_size=24, noise_gru_size=48, denoise_gru_size=96):
+    ''' Building and compiling the RNNoise model. The default layer sizes are the sizes of the original RNNoise model, smaller sizes give
+    a lighter and faster model (the sizes are read from the compiled library by the wrapper, see export_model.py). '''
+
+    print('Build model (layer sizes: input_dense {}, vad_gru {}, noise_gru {}, denoise_gru {})...'.format(input_dense_size, vad_gru_size,
+                                                                                                          noise_gru_size, denoise_gru_size))
+    main_input = Input(shape=(None, 42), name='main_input')
+    tmp = Dense(input_dense_size, activation='tanh', name='input_dense', kernel_constraint=constraint, bias_constraint=constraint)(main_input)
+    vad_gru = GRU(vad_gru_size, activation='tanh', recurrent_activation='sigmoid', return_sequences=True, name='vad_gru', kernel_regularizer=regularizers.l2(reg), recurrent_regularizer=regularizers.l2(reg), kernel_constraint=constraint, recurrent_constraint=constraint, bias_constraint=constraint)(tmp)
+    vad_output = Dense(1, activation='sigmoid', name='vad_output', kernel_constraint=constraint, bias_constraint=constraint)(vad_gru)
+    noise_input = keras.layers.concatenate([tmp, vad_gru, main_input])
+    noise_gru = GRU(noise_gru_size, activation='relu', recurrent_activation='sigmoid', return_sequences=True, name='noise_gru', kernel_regularizer=regularizers.l2(reg), recurrent_regularizer=regularizers.l2(reg), kernel_constraint=constraint, recurrent_constraint=constraint, bias_constraint=constraint)(noise_input)
+    denoise_input = keras.layers.concatenate([vad_gru, noise_gru, main_input])
+
+    denoise_gru = GRU(denoise_gru_size, activation='tanh', recurrent_activation='sigmoid', return_sequences=True, name='denoise_gru', kernel_regularizer=regularizers.l2(reg), recurrent_regularizer=regularizers.l2(reg), kernel_constraint=constraint, recurrent_constraint=constraint, bias_constraint=constraint)(denoise_input)
+
+    denoise_output = Dense(22, activation='sigmoid', name='denoise_output', kernel_constraint=constraint, bias_constraint=constraint)(denoise_gru)
+
+    model = Model(inputs=main_input, outputs=[denoise_output, vad_output])
+
+    model.compile(loss=[mycost, my_crossentropy],
+                  metrics=[msse],
+                  optimizer='adam', loss_weights=[10, 0.5])
+    return model
+
+
+def load_teacher(f_name_teacher_weights):
+    ''' Loading a trained model (for example, "train_logs/weights_5h_b_500k.hdf5") as the teacher for distillation. '''
+
+    print("Loading teacher model '{}'...".format(f_name_teacher_weights))
+    return load_model(f_name_teacher_weights, custom_objects={'msse': msse, 'my_crossentropy': my_crossentropy, 'mycost': mycost,
+                                                              'WeightClip': WeightClip})
+
+
+def mix_with_teacher(y, vad, teacher_y, teacher_vad, distillation_weight):
+    ''' Distillation targets: a mix of the ground truth gains/VAD and the predictions of the teacher. Bands without energy (gain -1) are kept
+    masked, as in the ground truth. '''
+
+    y = np.where(y < 0, y, distillation_weight*teacher_y + (1 - distillation_weight)*y)
+    vad = distillation_weight*teacher_vad + (1 - distillation_weight)*vad
+    return y.astype(np.float32), vad.astype(np.float32)
+
+
+def distillation_batches(batches, teacher, distillation_weight):
+    ''' Replacing targets of training batches with distillation targets (see mix_with_teacher()). '''
+
+    for x, (y, vad) in batches:
+        teacher_y, teacher_vad = teacher.predict_on_batch(x)
+        yield (x, list(mix_with_teacher(y, vad, teacher_y, teacher_vad, distillation_weight)))
+
+
+def create_and_parse_args():
+    parser = argparse.ArgumentParser(description='RNNoise training. Training data is read from .h5 file, from folder with .npy shards ' + \
+                                                 'or computed on the fly from clean speech and noise (see extract_training_features.py).')
+    parser.add_argument('names', type=str, nargs='*',
+                        help='Name .h5 file or folder with .npy shards with training data (default is "training.h5") and name .hdf5 file for ' + \
+                             'trained weights (default is "weights.hdf5"). With "--clean_folder" or "--feature_store" only the name for ' + \
+                             'trained weights is passed')
+    parser.add_argument('-cf', '--clean_folder', type=str, default=None,
+                        help='Folder with clean speech audio: compute training data on the fly instead of reading "training_data"')
+    parser.add_argument('-nf', '--noise_folder', type=str, default=None,
+                        help='Folder with noise audio (required with "--clean_folder")')
+    parser.add_argument('-fs', '--feature_store', type=str, default=None,
+                        help='Folder with the feature store (see feature_store.py): read training data selected by "--languages" and "--snr_range"')
+    parser.add_argument('-l', '--languages', type=str, default=None,
+                        help='Language folders to select from the feature store, separated by commas (default: all)')
+    parser.add_argument('--snr_range', type=str, default=None,
+                        help='Range of SNR in dB to select from the feature store, separated by comma (default: any)')
+    parser.add_argument('-spe', '--steps_per_epoch', type=int, default=250,
+                        help='Number of batches per epoch when computing training data on the fly (default is 250)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes when computing training data on the fly (default is the number of CPU cores)')
+    parser.add_argument('--input_dense_size', type=int, default=24,
+                        help='Size of the input dense layer (default is 24, as in the original RNNoise)')
+    parser.add_argument('--vad_gru_size', type=int, default=24,
+                        help='Size of the VAD GRU layer (default is 24)')
+    parser.add_argument('--noise_gru_size', type=int, default=48,
+                        help='Size of the noise GRU layer (default is 48)')
+    parser.add_argument('--denoise_gru_size', type=int, default=96,
+                        help='Size of the denoise GRU layer (default is 96)')
+    parser.add_argument('-t', '--teacher', type=str, default=None,
+                        help='Name .hdf5 file with weights of a trained model (for example, "train_logs/weights_5h_b_500k.hdf5") for ' + \
+                             'distillation: targets are mixed with predictions of this model')
+    parser.add_argument('-dw', '--distillation_weight', type=float, default=0.5,
+                        help='Weight of teacher predictions in distillation targets, from 0 to 1 (default is 0.5)')
+    args = parser.parse_args()
+
+    for size in [args.input_dense_size, args.vad_gru_size, args.noise_gru_size, args.denoise_gru_size]:
+        if size < 1:
+            parser.error('layer sizes must be positive')
+    if not 0.0 <= args.distillation_weight <= 1.0:
+        parser.error("'--distillation_weight' must be from 0 to 1")
+
+    names = list(args.names)
+    if args.clean_folder or args.feature_store:
+        names.insert(0, None)
+    args.training_data = names[0] if len(names) >= 1 and names[0] else 'training.h5'
+    args.trained_weights = names[1] if len(names) >= 2 else 'weights.hdf5'
+    return args
+
+
+args = create_and_parse_args()
+
+model = build_model(args.input_dense_size, args.vad_gru_size, args.noise_gru_size, args.denoise_gru_size)
+teacher = load_teacher(args.teacher) if args.teacher else None
 
 batch_size = 32
 window_size = 2000
 
-nb_sequences = len(all_data)//window_size
-print(nb_sequences, 'sequences')
-x_train = all_data[:nb_sequences*window_size, :42]
-x_train = np.reshape(x_train, (nb_sequences, window_size, 42))
-
-y_train = np.copy(all_data[:nb_sequences*window_size, 42:64])
-y_train = np.reshape(y_train, (nb_sequences, window_size, 22))
-
-noise_train = np.copy(all_data[:nb_sequences*window_size, 64:86])
-noise_train = np.reshape(noise_train, (nb_sequences, window_size, 22))
-
-vad_train = np.copy(all_data[:nb_sequences*window_size, 86:87])
-vad_train = np.reshape(vad_train, (nb_sequences, window_size, 1))
-
-all_data = 0;
-#x_train = x_train.astype('float32')
-#y_train = y_train.astype('float32')
-
-print(len(x_train), 'train sequences. x shape =', x_train.shape, 'y shape =', y_train.shape)
-
-
-print('\nTrain...')
-model.fit(x_train, [y_train, vad_train],
-          batch_size=batch_size,
-          epochs=120,
-          validation_split=0.1)
-
-
-f_name_trained_weights = 'weights.hdf5'
-if len(sys.argv) >= 3:
-    f_name_trained_weights = sys.argv[2]
+if args.clean_folder:
+    if not args.noise_folder:
+        print("[E] '--noise_folder' is required with '--clean_folder'")
+        sys.exit(1)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from extract_training_features import search_audio_in_folder, generate_features, training_batches
+
+    print("\nComputing training data on the fly from '{}' and '{}'...".format(args.clean_folder, args.noise_folder))
+    f_names_clean_audio = search_audio_in_folder(args.clean_folder)
+    f_names_noise_audio = search_audio_in_folder(args.noise_folder)
+    if len(f_names_clean_audio) < 2 or len(f_names_noise_audio) < 2:
+        print("[E] at least 2 clean and 2 noise audio are required: some of them are held out for validation")
+        sys.exit(1)
+
+    # The last 10% of clean and noise audio are held out for validation, so it is computed on audio that is never seen in training
+    f_names_validation_clean_audio = f_names_clean_audio[len(f_names_clean_audio) - max(1, len(f_names_clean_audio)//10):]
+    f_names_validation_noise_audio = f_names_noise_audio[len(f_names_noise_audio) - max(1, len(f_names_noise_audio)//10):]
+    f_names_clean_audio = f_names_clean_audio[:len(f_names_clean_audio) - len(f_names_validation_clean_audio)]
+    f_names_noise_audio = f_names_noise_audio[:len(f_names_noise_audio) - len(f_names_validation_noise_audio)]
+
+    # Validation data are computed once before training (the pool of generate_features() is closed after that), only the training data are
+    # computed on the fly
+    print('Computing validation data from {} clean and {} noise audio...'.format(len(f_names_validation_clean_audio),
+                                                                                 len(f_names_validation_noise_audio)))
+    validation_features = generate_features(f_names_validation_clean_audio, f_names_validation_noise_audio, args.jobs, seed=1000000007)
+    validation_batches = []
+    for batch in training_batches((data for data, f_name_clean_audio, f_name_noise_audio, snr in validation_features), window_size, batch_size):
+        validation_batches.append(batch)
+        if len(validation_batches) == max(1, args.steps_per_epoch // 10):
+            break
+    validation_features.close()
+    if not validation_batches:
+        print('[E] held out audio is too short for one validation batch ({} frames)'.format(window_size*batch_size))
+        sys.exit(1)
+    x_validation = np.concatenate([x for x, [y, vad] in validation_batches])
+    y_validation = np.concatenate([y for x, [y, vad] in validation_batches])
+    vad_validation = np.concatenate([vad for x, [y, vad] in validation_batches])
+    print('{} train and {} validation clean audio, {} validation sequences'.format(len(f_names_clean_audio), len(f_names_validation_clean_audio),
+                                                                                   len(x_validation)))
+
+    def data_blocks(seed):
+        for data, f_name_clean_audio, f_name_noise_audio, snr in generate_features(f_names_clean_audio, f_names_noise_audio, args.jobs, seed,
+                                                                                   epochs=sys.maxsize):
+            yield data
+
+    train_batches = training_batches(data_blocks(seed=0), window_size, batch_size)
+    if teacher is not None:
+        train_batches = distillation_batches(train_batches, teacher, args.distillation_weight)
+
+    print('\nTrain...')
+    model.fit_generator(train_batches,
+                        steps_per_epoch=args.steps_per_epoch,
+                        epochs=120,
+                        validation_data=(x_validation, [y_validation, vad_validation]))
+
+elif args.feature_store:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from feature_store import FeatureStore
+
+    languages = [language.strip() for language in args.languages.split(',')] if args.languages else None
+    snr_range = tuple(float(value) for value in args.snr_range.split(',')) if args.snr_range else None
+
+    print("\nSelecting training data from feature store '{}' (languages: {}, SNR range: {})...".format(args.feature_store, languages, snr_range))
+    feature_store = FeatureStore(args.feature_store)
+    selection = feature_store.query(languages=languages, snr_range=snr_range)
+
+    # 10% of clean audio of each language folder are held out for validation (shards are grouped by language, so the last segments would be
+    # only the last language)
+    train_selection, validation_selection = FeatureStore.split(selection)
+    if not validation_selection:
+        print('[E] at least 2 clean audio of one language folder are required in the selection: some of them are held out for validation')
+        sys.exit(1)
+    steps_per_epoch = max(1, feature_store.number_of_frames(train_selection) // (window_size*batch_size))
+    validation_steps = max(1, feature_store.number_of_frames(validation_selection) // (window_size*batch_size))
+    print('{} train and {} validation segments, {} steps per epoch'.format(len(train_selection), len(validation_selection), steps_per_epoch))
+    train_batches = feature_store.batches(train_selection, window_size, batch_size)
+    if teacher is not None:
+        train_batches = distillation_batches(train_batches, teacher, args.distillation_weight)
+
+    print('\nTrain...')
+    model.fit_generator(train_batches,
+                        steps_per_epoch=steps_per_epoch,
+                        epochs=120,
+                        validation_data=feature_store.batches(validation_selection, window_size, batch_size, shuffle=False),
+                        validation_steps=validation_steps)
+
+else:
+    print("\nLoading training data from '{}'...".format(args.training_data))
+    if os.path.isdir(args.training_data):
+        f_names_shards = sorted(glob.glob(os.path.join(args.training_data, '*.npy')))
+        all_data = np.concatenate([np.load(f_name_shard, mmap_mode='r') for f_name_shard in f_names_shards])
+    else:
+        with h5py.File(args.training_data, 'r') as hf:
+            all_data = hf['data'][:]
+    print('done.\n')
+
+    nb_sequences = len(all_data)//window_size
+    print(nb_sequences, 'sequences')
+    x_train = all_data[:nb_sequences*window_size, :42]
+    x_train = np.reshape(x_train, (nb_sequences, window_size, 42))
+
+    y_train = np.copy(all_data[:nb_sequences*window_size, 42:64])
+    y_train = np.reshape(y_train, (nb_sequences, window_size, 22))
+
+    noise_train = np.copy(all_data[:nb_sequences*window_size, 64:86])
+    noise_train = np.reshape(noise_train, (nb_sequences, window_size, 22))
+
+    vad_train = np.copy(all_data[:nb_sequences*window_size, 86:87])
+    vad_train = np.reshape(vad_train, (nb_sequences, window_size, 1))
+
+    all_data = 0;
+    #x_train = x_train.astype('float32')
+    #y_train = y_train.astype('float32')
+
+    print(len(x_train), 'train sequences. x shape =', x_train.shape, 'y shape =', y_train.shape)
+
+    if teacher is not None:
+        print('\nComputing distillation targets with the teacher model...')
+        teacher_y_train, teacher_vad_train = teacher.predict(x_train, batch_size=batch_size)
+        y_train, vad_train = mix_with_teacher(y_train, vad_train, teacher_y_train, teacher_vad_train, args.distillation_weight)
+
+
+    print('\nTrain...')
+    model.fit(x_train, [y_train, vad_train],
+              batch_size=batch_size,
+              epochs=120,
+              validation_split=0.1)
+
+
+f_name_trained_weights = args.trained_weights
 
 print("\nSaving network model and trained weights in '{}'...".format(f_name_trained_weights))
 model.save(f_name_trained_weights)